@@ -0,0 +1,288 @@
+"""离线批量提取术语定义或术语关系
+
+输入为 JSONL（每行一个术语 / 术语对，或含 term 字段的对象）或 JSON 数组，
+结果逐条追加写入 JSONL 或 CSV。运行中断后使用相同参数重新运行即从断点继续：
+已写入输出文件的条目会被跳过。
+
+示例:
+    python batch_extract.py definition terms.jsonl -o definitions.jsonl
+    python batch_extract.py relationship pairs.jsonl -o relations.csv --workers 8
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+from dotenv import load_dotenv
+from loguru import logger as log
+from tqdm import tqdm
+
+from config import batch_concurrency, llm_batch_group_size
+from service.bulk import SEARCH_TYPES, iter_items, iter_term_pairs, iter_terms
+from service.ingest import file_digest
+from service.search import (
+    get_definitions,
+    get_relations,
+    to_definition_result,
+    to_relation_result,
+)
+from utils.llm import llm_usage
+
+load_dotenv()
+
+CSV_FIELDS = {
+    "definition": ["index", "term", "definition", "documents", "page", "error"],
+    "relationship": [
+        "index",
+        "term1",
+        "term2",
+        "relation",
+        "reason",
+        "documents",
+        "page",
+        "error",
+    ],
+}
+
+
+class Checkpoint:
+    """断点信息，与输出文件放在一起
+
+    已完成的条目以输出文件为准，这里只记录输入文件、检索类型与累计统计，
+    用于校验续跑时的参数并累计吞吐与 token 用量。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.data: Dict[str, Any] = {}
+        if path.exists():
+            self.data = json.loads(path.read_text("utf-8"))
+
+    def check(self, input_hash: str, search_type: str):
+        if not self.data:
+            return
+        if self.data.get("input_hash") != input_hash or self.data.get("search_type") != search_type:
+            raise SystemExit(
+                f"{self.path} 记录的输入文件或检索类型与本次不同，请更换输出文件或使用 --restart"
+            )
+
+    def save(self, **data):
+        self.data.update(data)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.data, ensure_ascii=False, indent=2), "utf-8")
+        os.replace(tmp_path, self.path)
+
+
+def _truncate_partial_line(path: Path):
+    """删除上次中断时写了一半的最后一行"""
+    with open(path, "rb+") as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            f.truncate(content.rfind(b"\n") + 1)
+
+
+def completed_indices(path: Path, format: str) -> set[int]:
+    """从已有的输出文件中读取已完成的条目序号"""
+    if not path.exists():
+        return set()
+    _truncate_partial_line(path)
+    done = set()
+    with open(path, encoding="utf-8", newline="") as f:
+        if format == "csv":
+            for row in csv.DictReader(f):
+                done.add(int(row["index"]))
+        else:
+            for line in f:
+                if line.strip():
+                    done.add(json.loads(line)["index"])
+    return done
+
+
+class ResultWriter:
+    """逐条追加写入结果，每条写入后立即刷新到磁盘"""
+
+    def __init__(self, path: Path, format: str, search_type: str):
+        self.format = format
+        self.search_type = search_type
+        new_file = not path.exists() or path.stat().st_size == 0
+        self.file = open(path, "a", encoding="utf-8", newline="")
+        self.csv = None
+        if format == "csv":
+            self.csv = csv.DictWriter(self.file, fieldnames=CSV_FIELDS[search_type])
+            if new_file:
+                self.csv.writeheader()
+
+    def write(self, index: int, item: Any, result: dict | None, error: str | None):
+        if self.csv is None:
+            record = {"index": index, "input": item, "result": result, "error": error}
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            if self.search_type == "definition":
+                row = {"term": item}
+            else:
+                row = {"term1": item[0], "term2": item[1]}
+            row.update(result or {})
+            row.update({"index": index, "error": error or ""})
+            # 每条结果占一行，续跑时按行截断即可
+            self.csv.writerow(
+                {key: str(value).replace("\r", " ").replace("\n", " ") for key, value in row.items()}
+            )
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def extract_group(search_type: str, items: List[Any]) -> List[dict | None]:
+    if search_type == "definition":
+        return [to_definition_result(d).model_dump() if d else None for d in get_definitions(items)]
+    return [to_relation_result(d).model_dump() if d else None for d in get_relations(items)]
+
+
+def iter_groups(
+    input_path: Path, search_type: str, field: str, group_size: int, skip: set[int]
+) -> Iterator[List[Tuple[int, Any]]]:
+    """读取输入并跳过已完成的条目，按 group_size 分组"""
+    items = iter_items(input_path, input_path.suffix == ".jsonl")
+    inputs = iter_terms(items, field) if search_type == "definition" else iter_term_pairs(items)
+    group: List[Tuple[int, Any]] = []
+    for index, item in enumerate(inputs):
+        if index in skip:
+            continue
+        group.append((index, item))
+        if len(group) >= group_size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def run(args: argparse.Namespace):
+    input_path = Path(args.input)
+    output_path = Path(args.output)
+    format = args.format or ("csv" if output_path.suffix == ".csv" else "jsonl")
+    checkpoint_path = output_path.with_name(output_path.name + ".checkpoint.json")
+
+    if args.restart:
+        output_path.unlink(missing_ok=True)
+        checkpoint_path.unlink(missing_ok=True)
+
+    input_hash = file_digest(input_path)
+    checkpoint = Checkpoint(checkpoint_path)
+    checkpoint.check(input_hash, args.search_type)
+    done = completed_indices(output_path, format)
+    if done:
+        log.info(f"从断点继续，已完成 {len(done)} 条")
+
+    previous = checkpoint.data
+    usage_before = llm_usage.stats()
+    started = time.perf_counter()
+    completed = failed = 0
+
+    def save_checkpoint(finished: bool = False):
+        usage = llm_usage.stats()
+        total_usage = {
+            key: previous.get("usage", {}).get(key, 0) + usage[key] - usage_before[key]
+            for key in usage
+        }
+        checkpoint.save(
+            input=str(input_path),
+            input_hash=input_hash,
+            search_type=args.search_type,
+            format=format,
+            completed=len(done) + completed,
+            failed=previous.get("failed", 0) + failed,
+            seconds=round(previous.get("seconds", 0) + time.perf_counter() - started, 3),
+            usage=total_usage,
+            finished=finished,
+        )
+        return total_usage
+
+    writer = ResultWriter(output_path, format, args.search_type)
+    progress = tqdm(desc=f"提取{'定义' if args.search_type == 'definition' else '关系'}", unit="条")
+    groups = iter_groups(input_path, args.search_type, args.field, args.group_size, done)
+    in_flight: Dict[Future, List[Tuple[int, Any]]] = {}
+    exhausted = False
+    last_saved = 0
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            while not exhausted or in_flight:
+                # 最多预读 workers 个分组，输入文件按处理进度读取
+                while not exhausted and len(in_flight) < args.workers:
+                    group = next(groups, None)
+                    if group is None:
+                        exhausted = True
+                        break
+                    future = executor.submit(
+                        extract_group, args.search_type, [item for _, item in group]
+                    )
+                    in_flight[future] = group
+
+                if not in_flight:
+                    break
+                finished_futures, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished_futures:
+                    group = in_flight.pop(future)
+                    try:
+                        results, error = future.result(), None
+                    except Exception as e:
+                        log.error(f"处理 {[item for _, item in group]} 时出错: {e}")
+                        results, error = [None] * len(group), getattr(e, "detail", None) or str(e)
+                        failed += len(group)
+                    for (index, item), result in zip(group, results):
+                        writer.write(index, item, result, error)
+                    completed += len(group)
+                    progress.update(len(group))
+
+                if completed - last_saved >= args.checkpoint_every:
+                    last_saved = completed
+                    usage = save_checkpoint()
+                    progress.set_postfix(tokens=usage["total_tokens"])
+    finally:
+        writer.close()
+        progress.close()
+        usage = save_checkpoint(finished=exhausted and not in_flight)
+
+    seconds = time.perf_counter() - started
+    log.info(
+        f"本次完成 {completed} 条（失败 {failed} 条），耗时 {seconds:.1f}s，"
+        f"{completed / seconds if seconds else 0:.2f} 条/s"
+    )
+    log.info(
+        f"累计 LLM 请求 {usage['requests']} 次，prompt {usage['prompt_tokens']} tokens，"
+        f"completion {usage['completion_tokens']} tokens，合计 {usage['total_tokens']} tokens"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量提取术语定义或术语关系")
+    parser.add_argument("search_type", choices=SEARCH_TYPES, help="提取类型")
+    parser.add_argument("input", help="输入文件（.jsonl 或 JSON 数组）")
+    parser.add_argument("-o", "--output", required=True, help="输出文件（.jsonl 或 .csv）")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="输出格式，默认按扩展名判断")
+    parser.add_argument("--field", default="term", help="输入为对象时术语所在的字段")
+    parser.add_argument("--workers", type=int, default=batch_concurrency, help="并发处理的分组数")
+    parser.add_argument(
+        "--group-size",
+        type=int,
+        default=max(1, llm_batch_group_size),
+        help="每个提示词合并的术语（或术语对）数量",
+    )
+    parser.add_argument(
+        "--checkpoint-every", type=int, default=50, help="每完成多少条保存一次断点统计"
+    )
+    parser.add_argument("--restart", action="store_true", help="忽略已有输出，从头开始")
+    args = parser.parse_args()
+    args.workers = max(1, args.workers)
+    args.group_size = max(1, args.group_size)
+    args.checkpoint_every = max(1, args.checkpoint_every)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
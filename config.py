@@ -1,5 +1,121 @@
+import os
 from pathlib import Path
 
+from dotenv import load_dotenv
+
+load_dotenv()
+
 self_dir = Path.cwd()
 data_path = Path(__file__).parent / "data"
 files_store_path = data_path / "files"
+chroma_db_path = Path("./chroma_db")
+chroma_collection_name = "my_collection"
+# 入库清单：记录已入库文件的内容哈希、分割参数与片段 ID
+ingest_manifest_path = chroma_db_path / "ingest_manifest.json"
+# 批量检索任务上传文件的暂存目录
+search_jobs_path = data_path / "search_jobs"
+
+# 单次检索请求的工作线程数，与批量接口的线程池分开，批量请求不占用单次请求的线程
+search_concurrency = int(os.getenv("search_concurrency", "8"))
+# 批量检索时同时处理的术语数量上限
+batch_concurrency = int(os.getenv("batch_concurrency", "8"))
+# 后台批量检索任务的工作线程数，低于交互请求的线程数，大任务不拖慢交互检索
+bulk_concurrency = int(os.getenv("bulk_concurrency", "2"))
+
+# SiliconFlow 上游服务
+siliconflow_base_url = os.getenv("siliconflow_base_url", "https://api.siliconflow.cn/v1")
+siliconflow_token = os.getenv("siliconflow_token")
+
+# embedding 后端：siliconflow（远程 API）或 onnx（本地 CPU 推理）
+embedding_backend = os.getenv("embedding_backend", "siliconflow")
+# 本地 ONNX 模型目录（含 model.onnx 与 tokenizer.json）、推理线程数与动态组批上限
+onnx_model_path = Path(os.getenv("onnx_model_path", str(data_path / "models" / "bge-m3-onnx")))
+onnx_threads = int(os.getenv("onnx_threads", "0"))
+onnx_max_batch_size = int(os.getenv("onnx_max_batch_size", "32"))
+onnx_max_batch_tokens = int(os.getenv("onnx_max_batch_tokens", "8192"))
+onnx_max_length = int(os.getenv("onnx_max_length", "512"))
+# 查询 embedding 合并：并发的查询在 embedding_batch_window_ms 毫秒内或凑满 embedding_batch_max_size 个时
+# 合并为一次上游请求，最多 embedding_batch_concurrency 批同时请求
+embedding_batch_enabled = os.getenv("embedding_batch_enabled", "true").lower() == "true"
+embedding_batch_window_ms = float(os.getenv("embedding_batch_window_ms", "5"))
+embedding_batch_max_size = int(os.getenv("embedding_batch_max_size", "32"))
+embedding_batch_concurrency = int(os.getenv("embedding_batch_concurrency", "4"))
+# embedding 缓存：进程内 LRU 的条目数，以及磁盘缓存的目录与向量存储精度（float32 / float16）
+embedding_lru_size = int(os.getenv("embedding_lru_size", "10000"))
+embedding_cache_path = Path(os.getenv("embedding_cache_path", "./tmp/embeddings"))
+embedding_cache_dtype = os.getenv("embedding_cache_dtype", "float32")
+# 旧版 embedding 缓存目录（LocalFileStore 与 diskcache），启动时导入新的缓存
+legacy_embedding_cache_paths = [Path("./tmp/cache"), Path("./tmp/embedding_cache")]
+
+# 上游 HTTP 客户端：超时（秒）、连接池与重试
+http_timeout = float(os.getenv("http_timeout", "60"))
+http_connect_timeout = float(os.getenv("http_connect_timeout", "5"))
+http_max_connections = int(os.getenv("http_max_connections", "32"))
+http_max_retries = int(os.getenv("http_max_retries", "3"))
+http_backoff_base = float(os.getenv("http_backoff_base", "0.5"))
+http_backoff_max = float(os.getenv("http_backoff_max", "8"))
+
+# LLM 回答缓存：过期时间（秒）与磁盘占用上限（字节）
+llm_cache_enabled = os.getenv("llm_cache_enabled", "true").lower() == "true"
+llm_cache_ttl = int(os.getenv("llm_cache_ttl", str(7 * 24 * 3600)))
+llm_cache_size_limit = int(os.getenv("llm_cache_size_limit", str(512 * 1024**2)))
+
+# 入库流水线：解析进程数、embedding 线程数、每批片段数与阶段间队列长度
+ingest_parse_workers = int(os.getenv("ingest_parse_workers", str(os.cpu_count() or 4)))
+ingest_embed_workers = int(os.getenv("ingest_embed_workers", "4"))
+ingest_batch_size = int(os.getenv("ingest_batch_size", "32"))
+ingest_queue_size = int(os.getenv("ingest_queue_size", "16"))
+
+# 后台任务：内存中保留的已结束任务数量
+job_history_size = int(os.getenv("job_history_size", "200"))
+
+# 混合检索：字符二元组 BM25 倒排索引与向量检索结果做倒数排名融合
+lexical_index_path = chroma_db_path / "lexical.sqlite3"
+hybrid_search_enabled = os.getenv("hybrid_search_enabled", "true").lower() == "true"
+rrf_k = int(os.getenv("rrf_k", "60"))
+
+# 向量检索结果排序：多取候选的倍数、MMR 多样性、重叠片段去重阈值与重排序的候选数量
+rank_fetch_factor = int(os.getenv("rank_fetch_factor", "2"))
+rank_mmr_enabled = os.getenv("rank_mmr_enabled", "false").lower() == "true"
+rank_mmr_lambda = float(os.getenv("rank_mmr_lambda", "0.5"))
+rank_dedupe_enabled = os.getenv("rank_dedupe_enabled", "true").lower() == "true"
+rank_dedupe_max_covered = float(os.getenv("rank_dedupe_max_covered", "0.8"))
+rerank_top_k = int(os.getenv("rerank_top_k", "20"))
+
+# Chroma HNSW 索引参数：距离（l2 / cosine / ip）、构建时的候选数、每个节点的邻居数与检索时的候选数。
+# space、ef_construction 与 M 只在创建 collection 时生效，修改后需运行 manage_collection.py rebuild；
+# ef_search 启动时直接应用到已有 collection
+hnsw_space = os.getenv("hnsw_space", "l2")
+hnsw_ef_construction = int(os.getenv("hnsw_ef_construction", "100"))
+hnsw_m = int(os.getenv("hnsw_m", "16"))
+hnsw_ef_search = int(os.getenv("hnsw_ef_search", "100"))
+# 术语表：查询定义时先查各标准“术语和定义”中的条目，查不到再检索并调用 LLM
+glossary_enabled = os.getenv("glossary_enabled", "true").lower() == "true"
+# 术语检索时取回的片段数
+retrieval_limit = int(os.getenv("retrieval_limit", "20"))
+
+# 向量检索引擎：chroma，或 local（进程内索引，内存映射持久化在 chroma_db/vector_index）
+vector_search_engine = os.getenv("vector_search_engine", "chroma")
+vector_index_path = chroma_db_path / "vector_index"
+# 进程内索引类型：flat（暴力检索）、ivf（倒排聚类）或 auto（片段数达到 vector_index_ivf_min_size 时用 ivf）
+vector_index_type = os.getenv("vector_index_type", "auto")
+# 向量量化：none（float32）或 int8
+vector_index_quantization = os.getenv("vector_index_quantization", "int8")
+vector_index_ivf_min_size = int(os.getenv("vector_index_ivf_min_size", "50000"))
+# ivf 聚类数（0 时取 4√N）与检索时扫描的聚类数
+vector_index_nlist = int(os.getenv("vector_index_nlist", "0"))
+vector_index_nprobe = int(os.getenv("vector_index_nprobe", "16"))
+# 增量写入与删除累计达到 vector_index_compact_threshold 条、且达到索引片段数的
+# vector_index_compact_ratio 时在后台重写索引文件
+vector_index_compact_threshold = int(os.getenv("vector_index_compact_threshold", "2000"))
+vector_index_compact_ratio = float(os.getenv("vector_index_compact_ratio", "0.1"))
+
+# 合并相同术语（术语对）与检索范围的并发查询，以及相同提示词的并发 LLM 请求
+single_flight_enabled = os.getenv("single_flight_enabled", "true").lower() == "true"
+
+# LLM 提示词中上下文的 token 预算
+llm_context_token_budget = int(os.getenv("llm_context_token_budget", "3000"))
+
+# 批量提取：每个提示词合并的术语（或术语对）数量，为 1 时逐个请求；合并提示词的上下文 token 预算
+llm_batch_group_size = int(os.getenv("llm_batch_group_size", "5"))
+llm_batch_token_budget = int(os.getenv("llm_batch_token_budget", "6000"))
@@ -1,72 +1,64 @@
 import json
-from typing import List
+import time
+from typing import Callable, List, Tuple
 import uuid
-import os
-from fastapi import HTTPException, status
-import requests
-
 from dotenv import load_dotenv
 
 import chromadb
 from chromadb.errors import NotFoundError
-from langchain_classic.embeddings import CacheBackedEmbeddings
-from langchain_classic.embeddings.base import Embeddings as LangChainEmbeddings
 from langchain_classic.storage import LocalFileStore
 from tqdm import tqdm
-from utils.hash import make_hash
+from loguru import logger as log
+from config import (
+    chroma_collection_name,
+    chroma_db_path,
+    embedding_backend,
+    embedding_batch_enabled,
+    embedding_lru_size,
+    hnsw_ef_construction,
+    hnsw_ef_search,
+    hnsw_m,
+    hnsw_space,
+    hybrid_search_enabled,
+    lexical_index_path,
+    rank_dedupe_enabled,
+    rank_dedupe_max_covered,
+    rank_fetch_factor,
+    rank_mmr_enabled,
+    rank_mmr_lambda,
+    rerank_top_k,
+    retrieval_limit,
+    rrf_k,
+    vector_index_compact_ratio,
+    vector_index_compact_threshold,
+    vector_index_ivf_min_size,
+    vector_index_nlist,
+    vector_index_nprobe,
+    vector_index_path,
+    vector_index_quantization,
+    vector_index_type,
+    vector_search_engine,
+)
+from utils.cache import bump_corpus_version
+from utils.embeddings import (
+    BatchingEmbeddings,
+    CachedEmbeddings,
+    SiliconFlowEmbeddings,
+    create_embeddings,
+)
+from utils.filters import SearchFilter
+from utils.lexical import LexicalIndex, reciprocal_rank_fusion
+from utils.ranking import Candidate, StageTimer, get_reranker, rank_candidates
+from utils.terms import TermIndex
+from utils.vector_cache import PackedEmbeddingStore
+from utils.vector_index import VectorIndex
 
 load_dotenv()
 
+# 旧版 embedding 缓存，每个键一个 JSON 文件，只读（启动时导入 PackedEmbeddingStore）
 store = LocalFileStore("./tmp/cache/")
 
 
-class SiliconFlowEmbeddings(LangChainEmbeddings):
-    """自定义 SiliconFlow embedding 类，兼容 LangChain 接口"""
-
-    def __init__(self):
-        self.model = "BAAI/bge-m3"
-        self.base_url = "https://api.siliconflow.cn/v1"
-        self.api_key = os.getenv("siliconflow_token")
-
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """嵌入多个文档"""
-
-        url = f"{self.base_url}/embeddings"
-        payload = {
-            "model": self.model,
-            "input": texts,
-        }
-
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
-
-        response = requests.post(url, json=payload, headers=headers)
-        if not response.ok:
-            if response.status_code == 401:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid API key for Embedding service",
-                )
-
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Embedding API request failed with status code {response.status_code}",
-            )
-
-        data = response.json()
-        message = data.get("message")
-        if message:
-            assert False, f"Embedding API error: {message}"
-
-        return [item["embedding"] for item in data["data"]] if data["data"] else []
-
-    def embed_query(self, text: str) -> List[float]:
-        """嵌入单个查询"""
-        return self.embed_documents([text])[0]
-
-
 class CustomDocument:
     def __init__(self, content: str, doc_name: str, page_number):
         self.content = content
@@ -82,27 +74,90 @@ class CustomDocument:
 
 
 # 创建带缓存的 embedding 实例
-underlying_embeddings = SiliconFlowEmbeddings()
-cached_embeddings = CacheBackedEmbeddings.from_bytes_store(
-    underlying_embeddings,
-    store,
-    key_encoder=make_hash,
+underlying_embeddings = create_embeddings(embedding_backend)
+_cache_namespace = getattr(underlying_embeddings, "cache_namespace", embedding_backend)
+# 缓存未命中的并发查询合并为一次上游请求
+embedding_batcher = (
+    BatchingEmbeddings(underlying_embeddings) if embedding_batch_enabled else None
 )
+cached_embeddings = CachedEmbeddings(
+    embedding_batcher or underlying_embeddings,
+    PackedEmbeddingStore(),
+    lru_size=embedding_lru_size,
+    # 不同后端的向量不能混用，缓存键按后端区分
+    namespace=_cache_namespace,
+    # 旧版缓存的键不带后端前缀，只对 SiliconFlow 后端有效
+    legacy_store=store if not _cache_namespace else None,
+)
+
+chroma_client = chromadb.PersistentClient(path=str(chroma_db_path))
+
+# 只能在创建 collection 时设置的 HNSW 参数
+_HNSW_FIXED_KEYS = ("space", "ef_construction", "max_neighbors")
 
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
 
-try:
-    collection = chroma_client.get_collection("my_collection")
-    if not collection:
-        collection = chroma_client.create_collection(name="my_collection")
-except NotFoundError:
-    collection = chroma_client.create_collection(name="my_collection")
+def hnsw_configuration() -> dict:
+    return {
+        "space": hnsw_space,
+        "ef_construction": hnsw_ef_construction,
+        "max_neighbors": hnsw_m,
+        "ef_search": hnsw_ef_search,
+    }
+
+
+def open_collection(name: str = chroma_collection_name):
+    """打开 collection，不存在时按配置的 HNSW 参数创建
+
+    已有 collection 的 ef_search 与配置不同时直接更新；其余参数只能重建 collection 修改。
+    """
+    try:
+        collection = chroma_client.get_collection(name)
+    except NotFoundError:
+        return chroma_client.create_collection(
+            name=name, configuration={"hnsw": hnsw_configuration()}  # type: ignore
+        )
+
+    current = (collection.configuration or {}).get("hnsw") or {}
+    if current.get("ef_search") != hnsw_ef_search:
+        collection.modify(configuration={"hnsw": {"ef_search": hnsw_ef_search}})
+    expected = hnsw_configuration()
+    changed = [
+        f"{key}={current[key]}→{expected[key]}"
+        for key in _HNSW_FIXED_KEYS
+        if key in current and current[key] != expected[key]
+    ]
+    if changed:
+        log.warning(
+            f"collection {name} 的 HNSW 参数与配置不同（{', '.join(changed)}），"
+            "运行 python manage_collection.py rebuild 后生效"
+        )
+    return collection
+
+
+collection = open_collection()
+
+# 与 collection 同步维护的关键词倒排索引
+lexical_index = LexicalIndex(lexical_index_path)
+# 术语到片段的倒排索引，与关键词索引共用同一个 SQLite 文件
+term_index = TermIndex(lexical_index)
+# 进程内向量索引（vector_search_engine=local 时使用），与 collection 同步维护
+vector_index = VectorIndex(
+    vector_index_path,
+    index_type=vector_index_type,
+    quantization=vector_index_quantization,
+    ivf_min_size=vector_index_ivf_min_size,
+    nlist=vector_index_nlist,
+    nprobe=vector_index_nprobe,
+    compact_threshold=vector_index_compact_threshold,
+    compact_ratio=vector_index_compact_ratio,
+)
 
 
 class DocumentRecord:
     metadata: dict
 
-    def __init__(self, content: str, metadata: str | dict):
+    def __init__(self, content: str, metadata: str | dict, id: str | None = None):
+        self.id = id
         self.content = content
         if isinstance(metadata, str):
             try:
@@ -126,104 +181,538 @@ class DocumentRecord:
         }
 
 
+def embed_records(docs: List[DocumentRecord]) -> List[List[float]]:
+    """生成文档记录的 embedding"""
+    return cached_embeddings.embed_documents([doc.content for doc in docs])
+
+
+def write_records(
+    docs: List[DocumentRecord], embeddings: List[List[float]]
+) -> List[str]:
+    """将已生成 embedding 的文档记录写入collection，已带 ID 的记录按 ID 覆盖写入"""
+    # 沿用记录自带的ID，没有时随机生成
+    ids = [doc.id or str(uuid.uuid4()) for doc in docs]
+    collection.upsert(
+        ids=ids,
+        documents=[doc.content for doc in docs],
+        embeddings=embeddings,  # type: ignore
+        metadatas=[doc.metadata for doc in docs],
+    )
+    records = [(id, doc.content, doc.metadata) for id, doc in zip(ids, docs)]
+    lexical_index.add(records)
+    term_index.add(records)
+    vector_index.add(ids, embeddings)
+    return ids
+
+
 def insert_record(doc: DocumentRecord) -> str:
-    id = str(uuid.uuid4())
     doc_embedding = cached_embeddings.embed_query(doc.content)
-    collection.add(
-        ids=[id],
-        documents=[doc.content],
-        embeddings=[doc_embedding],
-        metadatas=[doc.metadata],
-    )
+    id = write_records([doc], [doc_embedding])[0]
+    bump_corpus_version()
     return id
 
 
-def insert_records_batch(docs: List[DocumentRecord], batch_size: int = 32) -> List[str]:
-    """批量插入文档记录"""
+def insert_records_batch(
+    docs: List[DocumentRecord],
+    batch_size: int = 32,
+    on_progress: Callable[[int, int], None] | None = None,
+) -> List[str]:
+    """批量插入文档记录，已带 ID 的记录按 ID 覆盖写入
+
+    Args:
+        docs: 文档记录
+        batch_size: 每批生成 embedding 的记录数
+        on_progress: 每批写入后回调 (已写入数量, 总数量)
+    """
     all_ids = []
 
     for i in range(0, len(docs), batch_size):
         batch = docs[i : i + batch_size]
+        batch_embeddings = embed_records(batch)
+        all_ids.extend(write_records(batch, batch_embeddings))
+        if on_progress:
+            on_progress(len(all_ids), len(docs))
+
+    if all_ids:
+        bump_corpus_version()
+    return all_ids
 
-        # 批量生成ID
-        batch_ids = [str(uuid.uuid4()) for _ in batch]
 
-        # 批量生成embedding
-        batch_contents = [doc.content for doc in batch]
-        batch_embeddings = cached_embeddings.embed_documents(batch_contents)
+def delete_records(ids: List[str], batch_size: int = 512):
+    """按 ID 删除文档记录"""
+    for i in range(0, len(ids), batch_size):
+        collection.delete(ids=ids[i : i + batch_size])
+    vector_index.remove(ids)
+    term_index.remove(ids)
+    lexical_index.remove(ids)
 
-        # 批量插入到collection
-        collection.add(
-            ids=batch_ids,
-            documents=batch_contents,
-            embeddings=batch_embeddings,  # type: ignore
-            metadatas=[doc.metadata for doc in batch],
-        )
+    if ids:
+        bump_corpus_version()
 
-        all_ids.extend(batch_ids)
 
-    return all_ids
+def delete_records_by_source(source: str):
+    """删除某个来源文件的全部文档记录
+
+    片段 ID 取自关键词索引的来源列（有索引），按 ID 删除；关键词索引未就绪时按元数据条件删除。
+    """
+    if lexical_index.ready:
+        delete_records(lexical_index.ids_for_source(source))
+        return
+
+    if vector_index.ready:
+        vector_index.remove(collection.get(where={"source": source}, include=[])["ids"])  # type: ignore
+    collection.delete(where={"source": source})
+    term_index.remove_source(source)
+    lexical_index.remove_source(source)
+    bump_corpus_version()
+
+
+def _resolve_sources(search_filter: SearchFilter) -> List[str] | None:
+    """满足来源与文档类型条件的完整来源名，取自关键词索引的来源列表
+
+    没有来源条件或关键词索引未就绪时返回 None，此时来源条件只能在取回结果后过滤。
+    """
+    if not (search_filter.sources or search_filter.doc_types) or not lexical_index.ready:
+        return None
+    return [source for source in lexical_index.sources() if search_filter.match_source(source)]
 
 
-def similarity_search(query: str, limit: int = 5) -> List[DocumentRecord]:
-    # 使用缓存的 embeddings 生成查询向量
-    query_embedding = cached_embeddings.embed_query(query)
+def filter_ids(search_filter: SearchFilter | None) -> List[str] | None:
+    """检索范围内的全部片段 ID，没有检索条件或关键词索引未就绪时返回 None"""
+    if search_filter is None or search_filter.empty or not lexical_index.ready:
+        return None
+    return lexical_index.filter_ids(
+        _resolve_sources(search_filter), search_filter.page_from, search_filter.page_to
+    )
+
+
+def _query_chroma(
+    query_embeddings: List[List[float]],
+    fetch_k: int,
+    with_embeddings: bool,
+    search_filter: SearchFilter | None = None,
+) -> List[List[Candidate]]:
+    """一次 collection.query 检索多个查询向量，返回每个查询的候选片段"""
+    where = None
+    if search_filter is not None and not search_filter.empty:
+        sources = _resolve_sources(search_filter)
+        if sources == []:
+            return [[] for _ in query_embeddings]
+        where = search_filter.where(sources)
+
+    include = ["documents", "metadatas", "distances"]
+    if with_embeddings:
+        include.append("embeddings")
     query_results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=limit,
+        query_embeddings=query_embeddings,  # type: ignore
+        n_results=fetch_k,
+        where=where,
+        include=include,  # type: ignore
     )
     if (not query_results["documents"]) or (not query_results["metadatas"]):
-        return []
+        return [[] for _ in query_embeddings]
+
+    results = []
+    for i, ids_list in enumerate(query_results["ids"]):
+        documents_list = query_results["documents"][i]
+        metadatas_list = query_results["metadatas"][i]
+        # 没有距离信息时保持原始顺序
+        distances = (query_results.get("distances") or [None] * (i + 1))[i] or range(
+            len(ids_list)
+        )
+        embeddings = query_results.get("embeddings")
+        embeddings_list = embeddings[i] if embeddings is not None else [None] * len(ids_list)
+        results.append(
+            [
+                Candidate(id, content, dict(metadata), distance, embedding)
+                for id, content, metadata, distance, embedding in zip(
+                    ids_list, documents_list, metadatas_list, distances, embeddings_list
+                )
+            ]
+        )
+    return results
+
 
-    documents_list = query_results["documents"][0]
-    metadatas_list = query_results["metadatas"][0]
+def _query_local(
+    query_embedding: List[float],
+    fetch_k: int,
+    timer: StageTimer,
+    search_filter: SearchFilter | None = None,
+) -> List[Candidate]:
+    """进程内索引检索，片段内容从关键词索引读取（未就绪时从 collection 读取）"""
+    with timer("query"):
+        within = filter_ids(search_filter)
+        if within == []:
+            return []
+        hits = vector_index.search(query_embedding, fetch_k, within=within)
+    ids = [id for id, _, _ in hits]
+    with timer("fetch"):
+        if lexical_index.ready:
+            found = lexical_index.get(ids)
+        else:
+            stored = collection.get(ids=ids, include=["documents", "metadatas"])  # type: ignore
+            found = {
+                id: (content, dict(metadata or {}))
+                for id, content, metadata in zip(
+                    stored["ids"], stored["documents"] or [], stored["metadatas"] or []
+                )
+            }
+    return [
+        Candidate(id, found[id][0], found[id][1], distance, embedding)
+        for id, distance, embedding in hits
+        if id in found
+    ]
 
-    if "distances" in query_results and query_results["distances"]:
-        distances = query_results["distances"][0]
-        # 创建 (distance, content, metadata) 的列表
-        items = list(zip(distances, documents_list, metadatas_list))
-        # 按距离升序排序（距离越小，越相似）
-        items.sort(key=lambda x: x[0], reverse=True)
+
+def similarity_search(
+    query: str,
+    limit: int = 5,
+    mmr: bool | None = None,
+    engine: str | None = None,
+    search_filter: SearchFilter | None = None,
+) -> List[DocumentRecord]:
+    """向量检索，结果经排序阶段处理后按相关性降序返回
+
+    排序阶段依次为：按距离升序、去除重叠片段、MMR 多样性选择（可选）、
+    本地重排序模型（已注册时）。去重与 MMR 会减少结果数量，因此先多取候选。
+
+    Args:
+        query: 查询文本
+        limit: 返回数量上限
+        mmr: 是否使用 MMR，默认取配置 rank_mmr_enabled
+        engine: 检索引擎 chroma 或 local，默认取配置 vector_search_engine；
+            进程内索引未就绪时退回 chroma
+        search_filter: 检索范围，条件下推到 Chroma 的 where（或进程内索引的候选片段）
+    """
+    return similarity_search_batch([query], limit, mmr, engine, search_filter)[0]
+
+
+def similarity_search_batch(
+    queries: List[str],
+    limit: int = 5,
+    mmr: bool | None = None,
+    engine: str | None = None,
+    search_filter: SearchFilter | None = None,
+) -> List[List[DocumentRecord]]:
+    """批量向量检索，参数与 similarity_search 相同，按 queries 的顺序返回各自的结果
+
+    全部查询的 embedding 合并为一次请求，Chroma 检索合并为一次 collection.query；
+    排序阶段逐个查询进行。
+    """
+    if not queries:
+        return []
+    use_mmr = rank_mmr_enabled if mmr is None else mmr
+    reranking = get_reranker() is not None and rerank_top_k > 0
+    fetch_k = limit
+    if use_mmr or rank_dedupe_enabled or reranking:
+        fetch_k = max(limit * rank_fetch_factor, rerank_top_k if reranking else 0)
+
+    timer = StageTimer()
+    with timer("embed"):
+        # 使用缓存的 embeddings 生成查询向量
+        query_embeddings = cached_embeddings.embed_queries(queries)
+    if (engine or vector_search_engine) == "local" and vector_index.ready:
+        candidate_lists = [
+            _query_local(query_embedding, fetch_k, timer, search_filter)
+            for query_embedding in query_embeddings
+        ]
     else:
-        # 如果没有距离信息，直接使用原始顺序
-        items = list(zip([0] * len(documents_list), documents_list, metadatas_list))
-
-    # 创建 DocumentRecord 列表
-    documents = [
-        DocumentRecord(
-            content=content,
-            metadata=dict(metadata),  # 转换为 dict
+        with timer("query"):
+            candidate_lists = _query_chroma(
+                query_embeddings, fetch_k, with_embeddings=use_mmr, search_filter=search_filter
+            )
+
+    results = []
+    for query, query_embedding, candidates in zip(queries, query_embeddings, candidate_lists):
+        if search_filter is not None and not search_filter.empty:
+            # 关键词索引未就绪时来源条件未能下推
+            candidates = [c for c in candidates if search_filter.matches(c.metadata)]
+        if not candidates:
+            results.append([])
+            continue
+
+        ranked = rank_candidates(
+            query,
+            query_embedding,
+            candidates,
+            limit,
+            timer,
+            use_mmr=use_mmr,
+            mmr_lambda=rank_mmr_lambda,
+            dedupe_max_covered=rank_dedupe_max_covered if rank_dedupe_enabled else None,
+            rerank_top_k=rerank_top_k if reranking else 0,
+        )
+        results.append(
+            [DocumentRecord(content=c.content, metadata=c.metadata, id=c.id) for c in ranked]
+        )
+    log.debug(
+        f"向量检索 {len(queries)} 个查询，"
+        f"{sum(map(len, candidate_lists))} -> {sum(map(len, results))} 个片段：{timer.summary()}"
+    )
+    return results
+
+
+def rebuild_collection(
+    batch_size: int = 1000,
+    keep_old: bool = False,
+    on_progress: Callable[[int, int], None] | None = None,
+) -> int:
+    """按当前配置的 HNSW 参数重建 collection，返回片段数
+
+    直接复制已存储的向量、内容与元数据，不重新生成 embedding，片段 ID 不变，
+    关键词、术语与进程内向量索引无需重建。新 collection 写入完成后再替换原 collection，
+    中途失败时原 collection 不受影响。
+
+    Args:
+        batch_size: 每批复制的片段数
+        keep_old: 保留原 collection（重命名为 <名称>__old_<时间戳>）
+        on_progress: 每批复制后回调 (已复制数量, 总数量)
+    """
+    global collection
+
+    temp_name = f"{chroma_collection_name}__rebuild"
+    try:
+        chroma_client.delete_collection(temp_name)
+    except NotFoundError:
+        pass
+    target = chroma_client.create_collection(
+        name=temp_name, configuration={"hnsw": hnsw_configuration()}  # type: ignore
+    )
+
+    total = collection.count()
+    try:
+        for offset in range(0, total, batch_size):
+            page = collection.get(
+                limit=batch_size,
+                offset=offset,
+                include=["embeddings", "documents", "metadatas"],  # type: ignore
+            )
+            target.add(
+                ids=page["ids"],
+                embeddings=page["embeddings"],  # type: ignore
+                documents=page["documents"],
+                metadatas=[metadata or None for metadata in page["metadatas"] or []],  # type: ignore
+            )
+            if on_progress:
+                on_progress(min(offset + batch_size, total), total)
+        if target.count() != total:
+            raise RuntimeError(f"重建的 collection 片段数 {target.count()} 与原有的 {total} 不一致")
+    except BaseException:
+        chroma_client.delete_collection(temp_name)
+        raise
+
+    backup_name = f"{chroma_collection_name}__old_{int(time.time())}"
+    collection.modify(name=backup_name)
+    target.modify(name=chroma_collection_name)
+    collection = target
+    if not keep_old:
+        chroma_client.delete_collection(backup_name)
+    log.info(f"collection 重建完成，共 {total} 个片段，HNSW 参数 {hnsw_configuration()}")
+    return total
+
+
+class EmbeddingDimensionError(ValueError):
+    """当前 embedding 后端的向量维度与 collection 中已存储的向量不一致"""
+
+
+def check_embedding_dimension() -> int | None:
+    """检查当前 embedding 后端与 collection 中已有向量的维度是否一致
+
+    更换 embedding 后端后，已入库的向量与新的查询向量无法比较，需要清空向量库重新导入。
+
+    Returns:
+        collection 中向量的维度，collection 为空时为 None
+    """
+    stored = collection.get(limit=1, include=["embeddings"])  # type: ignore
+    embeddings = stored.get("embeddings")
+    if embeddings is None or len(embeddings) == 0:
+        return None
+
+    stored_dim = len(embeddings[0])
+    dim = len(cached_embeddings.embed_documents(["embedding dimension check"])[0])
+    if dim != stored_dim:
+        raise EmbeddingDimensionError(
+            f"embedding 后端 {embedding_backend} 的向量维度为 {dim}，"
+            f"与向量库中的 {stored_dim} 不一致，请清空 {chroma_db_path} 后重新导入"
+        )
+    return stored_dim
+
+
+def ensure_lexical_index(batch_size: int = 1000):
+    """关键词索引与 collection 不一致时，从 collection 中已存储的片段重建（术语索引一并重建）"""
+    total = collection.count()
+    if lexical_index.ready and lexical_index.count() == total:
+        return
+
+    log.info(f"正在重建关键词索引，共 {total} 个片段")
+    lexical_index.set_ready(False)
+    lexical_index.clear()
+    term_index.clear()
+    for offset in range(0, total, batch_size):
+        page = collection.get(
+            limit=batch_size, offset=offset, include=["documents", "metadatas"]  # type: ignore
+        )
+        records = [
+            (id, content, dict(metadata or {}))
+            for id, content, metadata in zip(
+                page["ids"], page["documents"] or [], page["metadatas"] or []
+            )
+        ]
+        lexical_index.add(records)
+        term_index.add(records)
+    lexical_index.set_ready(True)
+    log.info("关键词索引重建完成")
+
+
+def ensure_vector_index(batch_size: int = 1000):
+    """vector_search_engine=local 时，进程内向量索引缺失或与 collection 不一致则从已存储的向量重建"""
+    if vector_search_engine != "local":
+        return
+    vector_index.flush()
+    total = collection.count()
+    if vector_index.ready and vector_index.count() == total:
+        return
+
+    log.info(f"正在构建向量索引，共 {total} 个片段")
+
+    def batches():
+        for offset in range(0, total, batch_size):
+            page = collection.get(
+                limit=batch_size, offset=offset, include=["embeddings"]  # type: ignore
+            )
+            yield page["ids"], page["embeddings"]
+
+    vector_index.build(batches())
+
+
+def lexical_search(
+    query: str,
+    limit: int = 20,
+    must_contain: List[str] | None = None,
+    ids: List[str] | None = None,
+    within: List[str] | None = None,
+) -> List[DocumentRecord]:
+    """关键词检索，结果按 BM25 得分降序"""
+    return [
+        DocumentRecord(content=content, metadata=metadata, id=id)
+        for id, content, metadata, _ in lexical_index.search(
+            query, limit=limit, must_contain=must_contain, ids=ids, within=within
         )
-        for _, content, metadata in items
     ]
-    return documents
 
 
-def extract_docs_has_single_term(term: str) -> List[DocumentRecord]:
-    """Extract sentences containing the term from the text."""
-    documents = similarity_search(f"`{term}`", limit=20)
+def hybrid_search(
+    query: str,
+    terms: List[str],
+    limit: int = retrieval_limit,
+    search_filter: SearchFilter | None = None,
+) -> List[DocumentRecord] | None:
+    """混合检索：取包含全部 terms 的片段，按关键词与向量排名融合排序
+
+    terms 均为术语表中的术语时，候选片段直接取自术语索引的交集，结果已完整，
+    不再进行向量检索；关键词索引找到的片段已足够 limit 个时同样跳过向量检索
+    （省去 embedding 请求）。关键词索引不可用时返回 None，由调用方退回纯向量检索。
+    """
+    results = hybrid_search_batch([(query, terms)], limit, search_filter)
+    return None if results is None else results[0]
+
+
+def hybrid_search_batch(
+    items: List[Tuple[str, List[str]]],
+    limit: int = retrieval_limit,
+    search_filter: SearchFilter | None = None,
+) -> List[List[DocumentRecord]] | None:
+    """批量混合检索，items 为 (查询, 术语) 列表；需要向量检索的查询合并为一次批量检索"""
+    if not hybrid_search_enabled or not lexical_index.ready:
+        return None
+
+    within = filter_ids(search_filter)
+    results: List[List[DocumentRecord] | None] = []
+    # 结果不足 limit 个的关键词检索结果，稍后与向量检索结果融合
+    partial: dict[int, List[DocumentRecord]] = {}
+    for query, terms in items:
+        term_ids = term_index.lookup(terms)
+        if term_ids is not None:
+            if within is not None:
+                term_ids = list(set(term_ids).intersection(within))
+            results.append(
+                lexical_search(" ".join(terms), limit=limit, must_contain=terms, ids=term_ids)
+            )
+            continue
+        lexical_docs = lexical_search(
+            " ".join(terms), limit=limit, must_contain=terms, within=within
+        )
+        if len(lexical_docs) < limit:
+            partial[len(results)] = lexical_docs
+            results.append(None)
+        else:
+            results.append(lexical_docs)
+
+    pending = list(partial)
+    vector_results = similarity_search_batch(
+        [items[i][0] for i in pending], limit=limit, search_filter=search_filter
+    )
+    for i, documents in zip(pending, vector_results):
+        terms, lexical_docs = items[i][1], partial[i]
+        vector_docs = [doc for doc in documents if all(term in doc.content for term in terms)]
+        by_id = {doc.id: doc for doc in vector_docs + lexical_docs}
+        fused = reciprocal_rank_fusion(
+            [[doc.id for doc in lexical_docs], [doc.id for doc in vector_docs]],  # type: ignore
+            k=rrf_k,
+        )
+        results[i] = [by_id[id] for id in fused[:limit]]
+    return results  # type: ignore
 
-    results: List[DocumentRecord] = []
-    for doc in documents:
-        if term in doc.content:
-            results.append(doc)
 
-    print("Retrieved Documents:")
-    print(f"Found {len(results)} documents containing the term.")
+def extract_docs_has_single_term(
+    term: str, search_filter: SearchFilter | None = None
+) -> List[DocumentRecord]:
+    """Extract sentences containing the term from the text."""
+    return extract_docs_has_single_term_batch([term], search_filter)[0]
+
 
+def extract_docs_has_single_term_batch(
+    terms: List[str], search_filter: SearchFilter | None = None
+) -> List[List[DocumentRecord]]:
+    """批量检索包含各个术语的片段，向量检索合并为一次批量检索"""
+    queries = [(f"`{term}`", [term]) for term in terms]
+    results = _retrieve_containing(queries, search_filter)
+    for term, docs in zip(terms, results):
+        log.debug(f"术语“{term}”：找到 {len(docs)} 个包含该术语的片段")
     return results
 
 
-def extract_docs_has_both_term(term_pair: tuple) -> List[DocumentRecord]:
+def extract_docs_has_both_term(
+    term_pair: tuple, search_filter: SearchFilter | None = None
+) -> List[DocumentRecord]:
     """Extract sentences containing both terms from the text."""
-    documents = similarity_search(f"`{term_pair[0]}`和`{term_pair[1]}`", limit=20)
-
-    results: List[DocumentRecord] = []
-    for doc in documents:
-        if term_pair[0] in doc.content and term_pair[1] in doc.content:
-            results.append(doc)
+    return extract_docs_has_both_term_batch([term_pair], search_filter)[0]
 
-    print("Retrieved Documents:")
-    print(f"Found {len(results)} documents containing both terms.")
 
+def extract_docs_has_both_term_batch(
+    term_pairs: List[tuple], search_filter: SearchFilter | None = None
+) -> List[List[DocumentRecord]]:
+    """批量检索同时包含各术语对中两个术语的片段，向量检索合并为一次批量检索"""
+    queries = [
+        (f"`{term_pair[0]}`和`{term_pair[1]}`", list(term_pair)) for term_pair in term_pairs
+    ]
+    results = _retrieve_containing(queries, search_filter)
+    for term_pair, docs in zip(term_pairs, results):
+        log.debug(f"术语“{term_pair[0]}”“{term_pair[1]}”：找到 {len(docs)} 个同时包含两者的片段")
     return results
+
+
+def _retrieve_containing(
+    items: List[Tuple[str, List[str]]], search_filter: SearchFilter | None
+) -> List[List[DocumentRecord]]:
+    """检索包含各自全部术语的片段：混合检索，关键词索引不可用时退回纯向量检索"""
+    results = hybrid_search_batch(items, limit=retrieval_limit, search_filter=search_filter)
+    if results is not None:
+        return results
+    documents = similarity_search_batch(
+        [query for query, _ in items], limit=retrieval_limit, search_filter=search_filter
+    )
+    return [
+        [doc for doc in docs if all(term in doc.content for term in terms)]
+        for (_, terms), docs in zip(items, documents)
+    ]
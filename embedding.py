@@ -1,15 +1,13 @@
 import tarfile
 import lzma
 from pathlib import Path
-from tqdm import tqdm
 from loguru import logger as log
 
-from database import DocumentRecord, insert_records_batch
-from service.splitter import get_splitter_docs
-
 
 def init_embedding_db():
     """初始化嵌入数据库：解压文件并导入所有PDF到ChromaDB"""
+    # 在函数内导入，避免 spawn 方式启动的解析进程加载数据库（见 load_pdf.load_all_pdfs）
+    from service.pipeline import run_ingest_pipeline
 
     # 定义路径
     data_dir = Path("./data/files")
@@ -39,32 +37,8 @@ def init_embedding_db():
             log.warning("没有找到PDF文件")
             return
 
-        # 处理每个PDF文件
-        for file_path in tqdm(pdf_files, desc="处理PDF文件"):
-            try:
-                log.debug(f"正在处理: {file_path.name}")
-
-                # 使用分割器处理文档
-                splits = get_splitter_docs(file_path)
-
-                # 准备批量插入的文档记录
-                docs_to_insert = []
-                for split in splits:
-                    docs_to_insert.append(
-                        DocumentRecord(
-                            content=split.page_content,
-                            metadata=split.metadata,
-                        )
-                    )
-
-                # 批量插入，batch_size设为32（API限制）
-                insert_records_batch(docs_to_insert, batch_size=32)
-
-                log.debug(f"{file_path.name} 处理并插入完成！")
-
-            except Exception as e:
-                log.error(f"处理文件 {file_path.name} 时出错: {str(e)}")
-                continue
+        # 增量导入：仅处理新增或变化的PDF文件
+        run_ingest_pipeline(pdf_files)
 
         log.info("所有PDF文件处理完成！")
 
@@ -6,8 +6,12 @@ from fastapi.middleware.cors import CORSMiddleware
 from routes.swaggerui import setupSwaggerUI
 from routes.file import router as file_router
 from routes.search import router as search_router
+from routes.stats import router as stats_router
 
+from database import EmbeddingDimensionError, check_embedding_dimension, vector_index
 from log import log_init
+from service.jobs import job_queue
+from utils.client import aclose_clients
 
 from load_pdf import load_all_pdfs
 
@@ -24,10 +28,26 @@ async def lifespan(app: FastAPI):
         log.info("load_pdf completed before FastAPI startup.")
     except Exception as e:
         log.exception("Error while running load_all_pdfs before startup: {}", e)
+    try:
+        # 需要请求一次上游 embedding 接口，放到线程中执行，避免重试期间阻塞事件循环
+        await asyncio.get_running_loop().run_in_executor(None, check_embedding_dimension)
+    except EmbeddingDimensionError:
+        raise
+    except Exception as e:
+        log.warning("Skipped embedding dimension check: {}", e)
+    job_queue.start()
+    # 关键词索引缺失或不完整时在后台重建，期间检索退回纯向量检索
+    job_queue.submit("lexical", "")
+    # 使用进程内向量索引时，索引缺失或不一致则在后台构建，期间退回 Chroma 查询
+    job_queue.submit("vector_index", "")
+    # 旧版 embedding 缓存导入到紧凑存储，已导入的键直接跳过
+    job_queue.submit("embedding_cache", "")
     yield
     # after the application stops
     log.info("FastAPI application is shutting down.")
-    pass
+    job_queue.stop(timeout=5)
+    vector_index.flush()
+    await aclose_clients()
 
 
 app = FastAPI(
@@ -52,6 +72,7 @@ setupSwaggerUI(app)
 
 app.include_router(file_router, tags=["文件管理"])
 app.include_router(search_router, tags=["知识检索"])
+app.include_router(stats_router, tags=["运行状态"])
 
 if __name__ == "__main__":
     import uvicorn
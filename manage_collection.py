@@ -0,0 +1,225 @@
+"""向量库 collection 维护工具
+
+rebuild: 按 config 中的 HNSW 参数（hnsw_space / hnsw_ef_construction / hnsw_m / hnsw_ef_search）
+    重建 collection，复制已存储的向量，不重新生成 embedding。运行前请停止服务，
+    完成后重启服务。
+benchmark: 测量不同 ef_search（以及进程内向量索引不同 nprobe）下的召回率与查询延迟，
+    输出 Markdown 表格。召回率以全部已存储向量上的精确检索结果为准。
+
+示例:
+    hnsw_m=32 hnsw_ef_construction=200 python manage_collection.py rebuild
+    python manage_collection.py benchmark --ef-search 10 20 50 100 200
+    python manage_collection.py benchmark --queries queries.txt -o benchmark.md
+"""
+
+import argparse
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+import chromadb
+import numpy as np
+from chromadb.api.client import SharedSystemClient
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+import database
+from config import chroma_collection_name, chroma_db_path
+from database import cached_embeddings, rebuild_collection, vector_index
+
+load_dotenv()
+
+
+def sample_queries(count: int, seed: int = 0) -> Tuple[np.ndarray, List[str | None]]:
+    """随机抽取已存储的片段向量作为查询，返回 (查询向量, 查询自身的片段 ID)"""
+    total = database.collection.count()
+    rng = np.random.default_rng(seed)
+    offsets = sorted(rng.choice(total, size=min(count, total), replace=False).tolist())
+    pages = [
+        database.collection.get(limit=1, offset=offset, include=["embeddings"])  # type: ignore
+        for offset in offsets
+    ]
+    vectors = np.asarray([page["embeddings"][0] for page in pages], dtype=np.float32)  # type: ignore
+    return vectors, [page["ids"][0] for page in pages]
+
+
+def embed_queries(path: Path) -> Tuple[np.ndarray, List[str | None]]:
+    """每行一条查询文本"""
+    lines = [line.strip() for line in path.read_text("utf-8").splitlines() if line.strip()]
+    vectors = np.asarray([cached_embeddings.embed_query(line) for line in lines], dtype=np.float32)
+    return vectors, [None] * len(lines)
+
+
+def _distances(space: str, queries: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    """与 Chroma 相同的距离定义"""
+    dots = queries @ vectors.T
+    if space == "ip":
+        return 1.0 - dots
+    if space == "cosine":
+        norms = np.linalg.norm(queries, axis=1)[:, None] * np.linalg.norm(vectors, axis=1)[None, :]
+        return 1.0 - dots / np.maximum(norms, 1e-12)
+    return (queries**2).sum(axis=1)[:, None] + (vectors**2).sum(axis=1)[None, :] - 2 * dots
+
+
+def exact_neighbors(queries: np.ndarray, k: int, space: str, batch_size: int = 2000) -> List[List[str]]:
+    """逐批读取全部已存储向量，计算每条查询的精确近邻（按距离升序）"""
+    total = database.collection.count()
+    best_ids = np.empty((len(queries), 0), dtype=object)
+    best_distances = np.empty((len(queries), 0), dtype=np.float32)
+    for offset in tqdm(range(0, total, batch_size), desc="精确检索", unit="批"):
+        page = database.collection.get(
+            limit=batch_size, offset=offset, include=["embeddings"]  # type: ignore
+        )
+        vectors = np.asarray(page["embeddings"], dtype=np.float32)
+        ids = np.asarray(page["ids"], dtype=object)
+        distances = np.concatenate([best_distances, _distances(space, queries, vectors)], axis=1)
+        candidates = np.concatenate([best_ids, np.broadcast_to(ids, (len(queries), len(ids)))], axis=1)
+        keep = np.argsort(distances, axis=1)[:, :k]
+        best_distances = np.take_along_axis(distances, keep, axis=1)
+        best_ids = np.take_along_axis(candidates, keep, axis=1)
+    return [list(row) for row in best_ids]
+
+
+def _without(ids: List[str], exclude: str | None, k: int) -> List[str]:
+    return [id for id in ids if id != exclude][:k]
+
+
+def measure(
+    search: Callable[[List[float], int], List[str]],
+    queries: np.ndarray,
+    exclude: List[str | None],
+    truth: List[List[str]],
+    k: int,
+) -> dict:
+    """查询为已存储的片段时多取一个结果并去掉片段自身，否则召回率总包含这个平凡的近邻"""
+    search(queries[0].tolist(), k + 1)  # 预热，加载索引
+    recall = 0.0
+    latencies = []
+    for query, own_id, neighbors in zip(queries, exclude, truth):
+        started = time.perf_counter()
+        found = search(query.tolist(), k + 1)
+        latencies.append((time.perf_counter() - started) * 1000)
+        expected = set(_without(neighbors, own_id, k))
+        recall += len(expected.intersection(_without(found, own_id, k))) / max(1, len(expected))
+    return {
+        f"recall@{k}": round(recall / len(queries), 4),
+        "mean_ms": round(float(np.mean(latencies)), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def _reopen_collection():
+    """Chroma 在进程内缓存已加载的 HNSW 索引，修改 ef_search 后需重新打开 collection 才生效"""
+    SharedSystemClient.clear_system_cache()
+    client = chromadb.PersistentClient(path=str(chroma_db_path))
+    return client.get_collection(chroma_collection_name)
+
+
+def benchmark(args: argparse.Namespace) -> str:
+    collection = database.collection
+    hnsw = (collection.configuration or {}).get("hnsw") or {}
+    space = hnsw.get("space", "l2")
+    if args.queries:
+        queries, exclude = embed_queries(Path(args.queries))
+    else:
+        queries, exclude = sample_queries(args.samples)
+    if not len(queries):
+        raise SystemExit("collection 为空或没有查询")
+    truth = exact_neighbors(queries, args.k + 1, space)
+
+    rows = []
+    original_ef = hnsw.get("ef_search")
+    try:
+        for ef_search in args.ef_search:
+            collection.modify(configuration={"hnsw": {"ef_search": ef_search}})
+            collection = _reopen_collection()
+
+            def chroma_search(query: List[float], n: int) -> List[str]:
+                return collection.query(
+                    query_embeddings=[query], n_results=n, include=[]  # type: ignore
+                )["ids"][0]
+
+            rows.append(
+                (
+                    "chroma",
+                    f"ef_search={ef_search}",
+                    measure(chroma_search, queries, exclude, truth, args.k),
+                )
+            )
+    finally:
+        if original_ef is not None:
+            collection.modify(configuration={"hnsw": {"ef_search": original_ef}})
+
+    if vector_index.ready:
+        original_nprobe = vector_index.nprobe
+        info = vector_index.stats()
+        nprobes = args.nprobe if info["type"] == "ivf" else [original_nprobe]
+
+        def local_search(query: List[float], n: int) -> List[str]:
+            return [id for id, _, _ in vector_index.search(query, n)]
+
+        try:
+            for nprobe in nprobes:
+                vector_index.nprobe = nprobe
+                label = f"{info['type']}/{info['quantization']}" + (
+                    f" nprobe={nprobe}" if info["type"] == "ivf" else ""
+                )
+                rows.append(("local", label, measure(local_search, queries, exclude, truth, args.k)))
+        finally:
+            vector_index.nprobe = original_nprobe
+
+    header = (
+        f"collection {chroma_collection_name}：{collection.count()} 个片段，"
+        f"{len(queries)} 条查询，space={space}，"
+        f"ef_construction={hnsw.get('ef_construction')}，M={hnsw.get('max_neighbors')}\n\n"
+    )
+    columns = list(rows[0][2]) if rows else []
+    lines = [
+        "| engine | params | " + " | ".join(columns) + " |",
+        "|---|---|" + "---:|" * len(columns),
+    ]
+    for engine, params, result in rows:
+        lines.append(f"| {engine} | {params} | " + " | ".join(str(result[c]) for c in columns) + " |")
+    return header + "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量库 collection 维护工具")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild", help="按配置的 HNSW 参数重建 collection")
+    rebuild.add_argument("--batch-size", type=int, default=1000, help="每批复制的片段数")
+    rebuild.add_argument("--keep-old", action="store_true", help="保留原 collection")
+
+    bench = commands.add_parser("benchmark", help="测量召回率与查询延迟")
+    bench.add_argument("--queries", help="查询文本文件（每行一条），默认随机抽取已存储的片段向量")
+    bench.add_argument("--samples", type=int, default=200, help="抽取的片段数量")
+    bench.add_argument("-k", type=int, default=10, help="每条查询取回的片段数")
+    bench.add_argument(
+        "--ef-search", type=int, nargs="+", default=[10, 20, 50, 100, 200], help="测试的 ef_search"
+    )
+    bench.add_argument(
+        "--nprobe", type=int, nargs="+", default=[1, 4, 16, 64], help="进程内 ivf 索引测试的 nprobe"
+    )
+    bench.add_argument("-o", "--output", help="将表格写入文件")
+
+    args = parser.parse_args()
+    if args.command == "rebuild":
+        progress = tqdm(desc="重建 collection", unit="个")
+
+        def on_progress(done: int, total: int):
+            progress.total = total
+            progress.update(done - progress.n)
+
+        rebuild_collection(args.batch_size, args.keep_old, on_progress)
+        progress.close()
+    else:
+        table = benchmark(args)
+        print(table)
+        if args.output:
+            Path(args.output).write_text(table, "utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, File, HTTPException, UploadFile
 from fastapi.responses import FileResponse
 from config import files_store_path
+from service.jobs import job_queue
 
 router = APIRouter()
 
@@ -16,6 +17,11 @@ async def upload_file(file: UploadFile = File(...)):
     with open(files_store_path.joinpath(file.filename), "wb") as f:
         f.write(content)
 
+    # 在后台将 PDF 导入向量库
+    if file.filename.endswith(".pdf"):
+        job = job_queue.submit("index", file.filename)
+        return {"filename": file.filename, "job_id": job.id}
+
     return {"filename": file.filename}
 
 
@@ -50,4 +56,24 @@ async def delete_file(filename: str):
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="File not found")
     file_path.unlink()
-    return {"filename": filename, "message": "File deleted successfully"}
+
+    # 在后台从向量库中移除该文件的片段
+    job = job_queue.submit("purge", filename)
+    return {
+        "filename": filename,
+        "message": "File deleted successfully",
+        "job_id": job.id,
+    }
+
+
+@router.get("/files/jobs/")
+async def list_jobs():
+    return {"jobs": [job.to_dict() for job in job_queue.list()]}
+
+
+@router.get("/files/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
@@ -1,60 +1,171 @@
 import itertools
 import json
 from loguru import logger as log
-from fastapi import HTTPException, Query, UploadFile, File, Form, APIRouter, status
+from fastapi import HTTPException, Query, Request, UploadFile, File, Form, APIRouter, status
+from fastapi.responses import StreamingResponse
 
-from demo_nlp import extract_docs_has_both_term, extract_term_relation
-from model import DefinitionResponse, DefinitionResult, RelationResponse, RelationResult
-from service.search import get_definition
+from model import DefinitionResponse, RelationResponse
+from config import llm_batch_group_size
+from service.batch import batch_executor, run_batch, run_grouped, run_sync
+from service.bulk import SEARCH_TYPES, SearchJob, new_input_path, search_jobs
+from service.search import (
+    definitions_context,
+    get_definition,
+    get_relation,
+    relations_context,
+    stream_definition,
+    stream_relation,
+    to_definition_result,
+    to_relation_result,
+)
+from utils.definition import extract_term_definition, extract_term_definitions
+from utils.filters import SearchFilter
+from utils.relation import extract_term_relation, extract_term_relations
 
 router = APIRouter()
 
 
+def _split_list(value: str | None) -> list[str]:
+    return [item.strip() for item in (value or "").replace("，", ",").split(",") if item.strip()]
+
+
+def _search_filter(
+    source: str | None, doc_type: str | None, page_from: int | None, page_to: int | None
+) -> SearchFilter | None:
+    """由表单参数构造检索范围，未给出任何条件时返回 None"""
+    try:
+        search_filter = SearchFilter(_split_list(source), _split_list(doc_type), page_from, page_to)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return None if search_filter.empty else search_filter
+
+
+# 各检索接口共用的检索范围参数
+SOURCE_FORM = Form(None, description="限定来源标准，如 GB+14778-2025（多个用逗号分隔）")
+DOC_TYPE_FORM = Form(None, description="限定文档类型，如 GB/T、HY/T（多个用逗号分隔）")
+PAGE_FROM_FORM = Form(None, ge=1, description="起始页码")
+PAGE_TO_FORM = Form(None, ge=1, description="结束页码")
+RESPONSE_FORMAT_FORM = Form(
+    None, description="json 或 sse（流式返回 LLM 的回答），默认按 Accept 请求头选择"
+)
+
+
+def _wants_sse(request: Request, format: str | None) -> bool:
+    if format:
+        return format == "sse"
+    return "text/event-stream" in request.headers.get("accept", "")
+
+
+def _sse(event: str, data, id: int | None = None) -> str:
+    prefix = f"id: {id}\n" if id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _check_format(format: str | None, allowed: tuple):
+    if format not in (None, *allowed):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid format parameter"
+        )
+
+
+def _stream_extraction(events, not_found: str) -> StreamingResponse:
+    """以 SSE 返回单次提取的过程：context（检索到的片段数）、token（LLM 回答的增量）、
+    field（已生成的字段）、result（最终结果）或 error，最后为 end"""
+
+    async def encode():
+        try:
+            async for event, data in events:
+                if event == "result" and data is None:
+                    yield _sse("error", {"status": status.HTTP_404_NOT_FOUND, "detail": not_found})
+                elif event == "token":
+                    yield _sse(event, {"text": data})
+                else:
+                    yield _sse(event, data)
+        except HTTPException as e:
+            yield _sse("error", {"status": e.status_code, "detail": e.detail})
+        except json.JSONDecodeError as e:
+            log.warning(f"LLM 回答不是合法 JSON: {e}")
+            yield _sse(
+                "error",
+                {"status": status.HTTP_502_BAD_GATEWAY, "detail": "Invalid LLM response"},
+            )
+        except Exception as e:
+            # 响应头已发出，无法再改状态码，以 error 事件告知客户端失败而非连接中断
+            log.exception(f"流式提取失败: {e}")
+            yield _sse(
+                "error",
+                {"status": status.HTTP_500_INTERNAL_SERVER_ERROR, "detail": "Internal server error"},
+            )
+        yield _sse("end", {})
+
+    return StreamingResponse(
+        encode(),
+        media_type="text/event-stream",
+        # 禁止反向代理缓冲，保证增量及时送达
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/definition")
 async def search_definition(
+    request: Request,
     query: str = Form(..., description="搜索关键词"),
+    source: str | None = SOURCE_FORM,
+    doc_type: str | None = DOC_TYPE_FORM,
+    page_from: int | None = PAGE_FROM_FORM,
+    page_to: int | None = PAGE_TO_FORM,
+    format: str | None = RESPONSE_FORMAT_FORM,
 ) -> DefinitionResponse:
     if not query:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Type parameter is required"
         )
+    _check_format(format, ("json", "sse"))
 
-    data = get_definition(query)
+    search_filter = _search_filter(source, doc_type, page_from, page_to)
+    if _wants_sse(request, format):
+        return _stream_extraction(  # type: ignore
+            stream_definition(query, search_filter), "No definition found"
+        )
+
+    data = await run_sync(get_definition, query, search_filter)
     if not data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="No definition found"
         )
 
-    result: DefinitionResult = DefinitionResult(
-        term=data.term,
-        definition=data.definition.replace("\n", "").replace(" ", "").replace("\t", ""),
-        documents=data.documents,
-        page=data.page,
-    )
-
-    return DefinitionResponse(result=[result])
+    return DefinitionResponse(result=[to_definition_result(data)])
 
 
 @router.post("/definition/batch")
 async def search_definition_batch(
     query: str = Form(..., description="搜索关键词（用逗号分隔）"),
+    source: str | None = SOURCE_FORM,
+    doc_type: str | None = DOC_TYPE_FORM,
+    page_from: int | None = PAGE_FROM_FORM,
+    page_to: int | None = PAGE_TO_FORM,
 ) -> DefinitionResponse:
     results = []
-    query.replace("，", ",")
-    for q in query.split(","):
-        data = get_definition(q.strip())
+    query = query.replace("，", ",")
+    terms = [q.strip() for q in query.split(",") if q.strip()]
+    search_filter = _search_filter(source, doc_type, page_from, page_to)
+    # 先查术语表，其余术语的上下文一次批量检索，再按组调用 LLM 提取
+    definitions, contexts = await run_sync(
+        definitions_context, terms, search_filter, pool=batch_executor
+    )
+    pending = [i for i, data in enumerate(definitions) if data is None]
+    items = [(terms[i], contexts[i]) for i in pending]
+    if llm_batch_group_size > 1:
+        # 多个术语合并到一个提示词中提取，减少 LLM 请求次数
+        extracted = await run_grouped(extract_term_definitions, items, llm_batch_group_size)
+    else:
+        extracted = await run_batch(lambda item: extract_term_definition(*item), items)
+    for i, data in zip(pending, extracted):
+        definitions[i] = data
+    for data in definitions:
         if not data:
             continue
-
-        result: DefinitionResult = DefinitionResult(
-            term=data.term,
-            definition=data.definition.replace("\n", "")
-            .replace(" ", "")
-            .replace("\t", ""),
-            documents=data.documents,
-            page=data.page,
-        )
-        results.append(result)
+        results.append(to_definition_result(data))
 
     return DefinitionResponse(result=results)
 
@@ -62,8 +173,15 @@ async def search_definition_batch(
 @router.post("/relation")
 @router.post("/relation/batch")
 async def search_relationship(
+    request: Request,
     query: str = Form(..., description="搜索关键词"),
+    source: str | None = SOURCE_FORM,
+    doc_type: str | None = DOC_TYPE_FORM,
+    page_from: int | None = PAGE_FROM_FORM,
+    page_to: int | None = PAGE_TO_FORM,
+    format: str | None = RESPONSE_FORMAT_FORM,
 ) -> RelationResponse:
+    _check_format(format, ("json", "sse"))
     try:
         terms = json.loads(query)
         log.debug("json:{}", terms)
@@ -89,55 +207,114 @@ async def search_relationship(
             detail="At least two terms are required for relationship search",
         )
 
+    search_filter = _search_filter(source, doc_type, page_from, page_to)
     results = []
     # 将词汇两两分组
-    for i in range(0, len(terms), 2):
-        term_pair = (terms[i], terms[i + 1])
-        context_docs = extract_docs_has_both_term(term_pair)
-        relation_result = extract_term_relation(
-            term1=term_pair[0], term2=term_pair[1], docs=context_docs
+    term_pairs = [(terms[i], terms[i + 1]) for i in range(0, len(terms), 2)]
+    if _wants_sse(request, format):
+        if len(term_pairs) > 1:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Streaming supports a single term pair",
+            )
+        return _stream_extraction(  # type: ignore
+            stream_relation(term_pairs[0], search_filter), "No relation found"
+        )
+
+    if len(term_pairs) == 1:
+        relations = [await run_sync(get_relation, term_pairs[0], search_filter)]
+    else:
+        # 全部术语对的上下文一次批量检索，再按组调用 LLM 提取
+        contexts = await run_sync(
+            relations_context, term_pairs, search_filter, pool=batch_executor
         )
+        items = [(pair[0], pair[1], docs) for pair, docs in zip(term_pairs, contexts)]
+        if llm_batch_group_size > 1:
+            # 多组术语合并到一个提示词中提取，减少 LLM 请求次数
+            relations = await run_grouped(extract_term_relations, items, llm_batch_group_size)
+        else:
+            relations = await run_batch(lambda item: extract_term_relation(*item), items)
+    for relation_result in relations:
         if not relation_result:
             continue
 
-        results.append(
-            RelationResult(
-                term1=relation_result.term1,
-                term2=relation_result.term2,
-                relation=relation_result.relation,
-                reason=relation_result.reason,
-                documents=relation_result.documents.replace(".pdf", "").replace(
-                    "/T", "_T_"
-                ),
-                page=relation_result.page,
-            )
-        )
+        results.append(to_relation_result(relation_result))
 
     return RelationResponse(result=results)
 
 
+def _stream_job(job: SearchJob, offset: int, sse: bool) -> StreamingResponse:
+    """以 NDJSON 或 SSE 流式返回任务结果，每个结果附带可用于断点续传的 offset"""
+
+    def encode(event: str, data: dict, id: int | None = None) -> str:
+        if sse:
+            return _sse(event, data, id)
+        return json.dumps({"event": event, **data}, ensure_ascii=False) + "\n"
+
+    async def events():
+        yield encode("job", job.to_dict())
+        async for index, result in job.follow(offset):
+            yield encode("result", {"offset": index, **result}, id=index)
+        yield encode("end", job.to_dict())
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"X-Job-Id": job.id, "Cache-Control": "no-cache"},
+    )
+
+
 @router.post("/search/batch")
 async def search(
-    # 文件参数
+    request: Request,
+    # 文件参数：JSON 数组或 JSONL（.jsonl / .ndjson）
     file: UploadFile = File(...),
     # 表单参数（与文件同属multipart/form-data）
     search_type: str = Form(...),  # 必选表单参数
+    format: str | None = Form(None, description="ndjson 或 sse，默认按 Accept 请求头选择"),
 ):
     if not search_type:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Type parameter is required"
         )
-    if not search_type in ["relationship", "definition"]:
+    if not search_type in SEARCH_TYPES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid type parameter"
         )
+    _check_format(format, ("ndjson", "sse"))
 
-    file_content = await file.read()
-    try:
-        obj = json.loads(file_content)
-    except json.JSONDecodeError:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid JSON file"
-        )
+    # 分块写入暂存文件，由后台任务边读取边处理
+    input_path = new_input_path()
+    with open(input_path, "wb") as f:
+        while chunk := await file.read(1024 * 1024):
+            f.write(chunk)
+
+    jsonl = (file.filename or "").endswith((".jsonl", ".ndjson"))
+    job = search_jobs.create(search_type, input_path, jsonl)
+    return _stream_job(job, 0, _wants_sse(request, format))
+
+
+@router.get("/search/batch/{job_id}")
+async def get_search_job(job_id: str):
+    job = search_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@router.get("/search/batch/{job_id}/results")
+async def resume_search_job(
+    request: Request,
+    job_id: str,
+    offset: int = Query(0, ge=0, description="从第几个结果开始返回"),
+    format: str | None = Query(None, description="ndjson 或 sse，默认按 Accept 请求头选择"),
+):
+    job = search_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
 
-    return obj
+    # SSE 客户端重连时通过 Last-Event-ID 告知最后收到的结果
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        offset = max(offset, int(last_event_id) + 1)
+    return _stream_job(job, offset, _wants_sse(request, format))
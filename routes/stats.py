@@ -0,0 +1,30 @@
+from fastapi import APIRouter
+
+from database import cached_embeddings, embedding_batcher, term_index, vector_index
+from service.search import definition_flight, relation_flight, retrieval_flight
+from utils.cache import llm_cache
+from utils.context import context_stats
+from utils.llm import llm_flight, llm_usage
+from utils.ranking import ranking_stats
+
+router = APIRouter()
+
+
+@router.get("/stats")
+async def get_stats():
+    return {
+        "llm_cache": llm_cache.stats(),
+        "llm_usage": llm_usage.stats(),
+        "embedding_cache": cached_embeddings.stats(),
+        "embedding_batching": embedding_batcher.stats() if embedding_batcher else None,
+        "term_index": term_index.stats(),
+        "vector_index": vector_index.stats(),
+        "ranking": ranking_stats.stats(),
+        "llm_context": context_stats.stats(),
+        "single_flight": {
+            "definition": definition_flight.stats(),
+            "relation": relation_flight.stats(),
+            "retrieval": retrieval_flight.stats(),
+            "llm": llm_flight.stats(),
+        },
+    }
@@ -0,0 +1,67 @@
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Iterable, List, TypeVar
+
+from config import batch_concurrency, bulk_concurrency, search_concurrency
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# 检索与 LLM 调用均为阻塞 IO，放到线程池中执行，避免阻塞事件循环。
+# 单次请求与批量接口各用一个线程池，批量请求占满自己的线程时单次请求不受影响
+executor = ThreadPoolExecutor(
+    max_workers=max(1, search_concurrency), thread_name_prefix="search"
+)
+batch_executor = ThreadPoolExecutor(
+    max_workers=max(1, batch_concurrency), thread_name_prefix="batch"
+)
+# 后台批量检索任务（上传文件）单独使用一个较小的线程池
+bulk_executor = ThreadPoolExecutor(
+    max_workers=max(1, bulk_concurrency), thread_name_prefix="bulk"
+)
+
+
+async def run_sync(func: Callable[..., R], *args, pool: Executor = executor) -> R:
+    """在线程池中执行阻塞函数，默认使用单次请求的线程池"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, func, *args)
+
+
+async def run_batch(
+    func: Callable[[T], R],
+    items: Iterable[T],
+    concurrency: int = batch_concurrency,
+) -> List[R]:
+    """以有限并发在批量线程池中对每个元素执行 func，结果按输入顺序返回
+
+    Args:
+        func: 处理单个元素的阻塞函数
+        items: 待处理的元素
+        concurrency: 同一批次内的最大并发数
+
+    Returns:
+        与 items 顺序一致的结果列表
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def worker(item: T) -> R:
+        async with semaphore:
+            return await run_sync(func, item, pool=batch_executor)
+
+    return await asyncio.gather(*(worker(item) for item in items))
+
+
+async def run_grouped(
+    func: Callable[[List[T]], List[R]],
+    items: List[T],
+    group_size: int,
+    concurrency: int = batch_concurrency,
+) -> List[R]:
+    """将 items 按 group_size 分组，以有限并发对每组执行 func，结果按输入顺序展平返回"""
+    group_size = max(1, group_size)
+    groups = [items[i : i + group_size] for i in range(0, len(items), group_size)]
+    return [
+        result
+        for group_results in await run_batch(func, groups, concurrency)
+        for result in group_results
+    ]
@@ -0,0 +1,353 @@
+import asyncio
+import itertools
+import json
+from array import array
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Iterable, Iterator, List
+
+from loguru import logger as log
+
+from config import (
+    bulk_concurrency,
+    job_history_size,
+    llm_batch_group_size,
+    search_jobs_path,
+)
+from service.batch import bulk_executor, run_sync
+from service.search import (
+    get_definitions,
+    get_relations,
+    to_definition_result,
+    to_relation_result,
+)
+
+SEARCH_TYPES = ("definition", "relationship")
+
+# 读取上传文件的块大小（字符）
+_READ_SIZE = 64 * 1024
+# follow 每次从结果文件读取的结果数
+_FOLLOW_BATCH = 256
+
+
+def _truncated(error: json.JSONDecodeError, buffer: str) -> bool:
+    """解析失败是否可能只是因为元素在块边界处被截断"""
+    # 未闭合的字符串、末尾不完整的字面量（如 tru）或 \uXXXX 转义，读入更多数据后可能合法
+    return error.msg.startswith("Unterminated string") or error.pos + 6 >= len(buffer)
+
+
+def iter_json_array(chunks: Iterable[str]) -> Iterator[Any]:
+    """逐个解析顶层 JSON 数组中的元素，不需要将整个数组读入内存
+
+    多余或重复的逗号等格式错误在读到时即报错，不再继续读取后续内容。
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    offset = 0  # 已从 buffer 中移除的字符数，用于报告错误位置
+    # 期望的下一项：open 为数组开始，first 为首个元素或 ]，item 为元素，
+    # delimiter 为 , 或 ]，end 为数组已结束
+    state = "open"
+    for chunk in itertools.chain(chunks, [None]):
+        final = chunk is None
+        if not final:
+            buffer += chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos >= len(buffer):
+                break
+            char = buffer[pos]
+            if state == "open":
+                if char != "[":
+                    raise ValueError("JSON file must contain an array")
+                state = "first"
+                pos += 1
+            elif state == "end":
+                raise ValueError(f"Invalid JSON array at position {offset + pos}")
+            elif state == "delimiter":
+                if char not in ",]":
+                    raise ValueError(f"Invalid JSON array at position {offset + pos}")
+                state = "item" if char == "," else "end"
+                pos += 1
+            elif state == "first" and char == "]":
+                state = "end"
+                pos += 1
+            else:
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError as e:
+                    if final or not _truncated(e, buffer):
+                        raise ValueError(f"Invalid JSON array at position {offset + e.pos}")
+                    break  # 元素尚未读完整
+                if end == len(buffer) and not final:
+                    break  # 数字等元素可能在块边界处被截断，等待更多数据
+                yield item
+                state = "delimiter"
+                pos = end
+        offset += pos
+        buffer = buffer[pos:]
+
+    if state != "end":
+        raise ValueError("Invalid JSON array")
+
+
+def iter_json_lines(lines: Iterable[str]) -> Iterator[Any]:
+    """逐行解析 JSONL，空行跳过"""
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            raise ValueError(f"Invalid JSON on line {number}")
+
+
+def _read_chunks(file) -> Iterator[str]:
+    for chunk in iter(lambda: file.read(_READ_SIZE), ""):
+        yield chunk
+
+
+def iter_items(path: Path, jsonl: bool) -> Iterator[Any]:
+    with open(path, encoding="utf-8-sig") as f:
+        yield from iter_json_lines(f) if jsonl else iter_json_array(_read_chunks(f))
+
+
+def iter_terms(items: Iterable[Any], field: str = "term") -> Iterator[str]:
+    """术语输入：字符串或 {field: ...}"""
+    for item in items:
+        if isinstance(item, dict):
+            item = item.get(field)
+        if not isinstance(item, str) or not item.strip():
+            raise ValueError(f"Invalid term: {json.dumps(item, ensure_ascii=False)}")
+        yield item.strip()
+
+
+def iter_term_pairs(items: Iterable[Any]) -> Iterator[tuple]:
+    """术语对输入：[术语1, 术语2]、{"term1": ..., "term2": ...}、"术语1,术语2"，
+    或与 /relation 相同的扁平术语列表（相邻两个术语为一组）"""
+    single: str | None = None
+    for item in items:
+        if isinstance(item, dict):
+            item = [item.get("term1"), item.get("term2")]
+        elif isinstance(item, str) and ("," in item or "，" in item):
+            item = item.replace("，", ",").split(",")
+
+        if isinstance(item, str) and item.strip():
+            if single is None:
+                single = item.strip()
+            else:
+                yield (single, item.strip())
+                single = None
+            continue
+
+        if (
+            not isinstance(item, list)
+            or len(item) != 2
+            or not all(isinstance(term, str) and term.strip() for term in item)
+        ):
+            raise ValueError(f"Invalid term pair: {json.dumps(item, ensure_ascii=False)}")
+        yield (item[0].strip(), item[1].strip())
+
+    if single is not None:
+        raise ValueError("Number of terms must be even for relationship search")
+
+
+class SearchJob:
+    """批量检索任务
+
+    任务在后台处理，结果按完成顺序追加到输入文件旁的结果文件（每行一个 JSON），
+    内存中只保留每条结果在文件中的位置。客户端断开后可以通过任务 ID
+    与已收到的结果数量继续接收结果。
+    """
+
+    def __init__(self, search_type: str, input_path: Path, jsonl: bool):
+        self.id = uuid.uuid4().hex
+        self.search_type = search_type
+        self.input_path = input_path
+        self.jsonl = jsonl
+        self.status = "queued"
+        self.message = ""
+        self.total = 0
+        self.failed = 0
+        self.results_path = input_path.with_suffix(".results.jsonl")
+        self._results_file = None
+        # 第 i 条结果在结果文件中的起始字节位置
+        self._offsets = array("q")
+        self.created_at = time.time()
+        self.finished_at: float | None = None
+        self._changed = asyncio.Condition()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    @property
+    def completed(self) -> int:
+        return len(self._offsets)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "search_type": self.search_type,
+            "status": self.status,
+            "message": self.message,
+            "total": self.total,
+            "completed": self.completed,
+            "failed": self.failed,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _publish(self, results: List[dict]):
+        async with self._changed:
+            if self._results_file is None:
+                self._results_file = open(self.results_path, "ab")
+            for result in results:
+                self._offsets.append(self._results_file.tell())
+                self._results_file.write(json.dumps(result, ensure_ascii=False).encode() + b"\n")
+            self._results_file.flush()
+            self._changed.notify_all()
+
+    def _read_results(self, offset: int, count: int) -> List[dict]:
+        with open(self.results_path, "rb") as f:
+            f.seek(self._offsets[offset])
+            return [json.loads(f.readline()) for _ in range(count)]
+
+    def remove_files(self):
+        """删除任务的暂存文件，任务从任务表中移除时调用"""
+        self.input_path.unlink(missing_ok=True)
+        self.results_path.unlink(missing_ok=True)
+
+    async def _run(self):
+        self.status = "running"
+        semaphore = asyncio.Semaphore(max(1, bulk_concurrency))
+        tasks: set[asyncio.Task] = set()
+        # 读取与解析输入在线程中进行，大文件不阻塞事件循环
+        groups = self._groups()
+        try:
+            while (group := await run_sync(next, groups, None, pool=bulk_executor)) is not None:
+                await semaphore.acquire()
+                task = asyncio.create_task(self._run_group(group, semaphore))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+            self.status = "done"
+        except ValueError as e:
+            log.warning(f"批量检索任务 {self.id} 的输入格式错误: {e}")
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.status = "failed"
+            self.message = str(e)
+        except Exception as e:
+            log.exception(f"批量检索任务 {self.id} 失败: {e}")
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.status = "failed"
+            self.message = str(e)
+        finally:
+            groups.close()
+            self.finished_at = time.time()
+            self.input_path.unlink(missing_ok=True)
+            async with self._changed:
+                if self._results_file is not None:
+                    self._results_file.close()
+                    self._results_file = None
+                self._changed.notify_all()
+
+    def _groups(self) -> Iterator[List[tuple[int, Any]]]:
+        """按 llm_batch_group_size 分组读取输入，读取进度随处理进度推进"""
+        items = iter_items(self.input_path, self.jsonl)
+        inputs = iter_terms(items) if self.search_type == "definition" else iter_term_pairs(items)
+        group: List[tuple[int, Any]] = []
+        try:
+            for item in inputs:
+                group.append((self.total, item))
+                self.total += 1
+                if len(group) >= max(1, llm_batch_group_size):
+                    yield group
+                    group = []
+        except ValueError:
+            # 输入格式错误时，错误之前读到的条目仍然处理
+            if group:
+                yield group
+            raise
+        if group:
+            yield group
+
+    async def _run_group(self, group: List[tuple[int, Any]], semaphore: asyncio.Semaphore):
+        inputs = [item for _, item in group]
+        try:
+            if self.search_type == "definition":
+                data = await run_sync(get_definitions, inputs, pool=bulk_executor)
+                results = [
+                    to_definition_result(d).model_dump() if d else None for d in data
+                ]
+            else:
+                data = await run_sync(get_relations, inputs, pool=bulk_executor)
+                results = [to_relation_result(d).model_dump() if d else None for d in data]
+            errors = [None] * len(group)
+        except Exception as e:
+            log.error(f"批量检索任务 {self.id} 处理 {inputs} 时出错: {e}")
+            self.failed += len(group)
+            results = [None] * len(group)
+            errors = [getattr(e, "detail", None) or str(e)] * len(group)
+        finally:
+            semaphore.release()
+
+        await self._publish(
+            [
+                {"index": index, "input": item, "result": result, "error": error}
+                for (index, item), result, error in zip(group, results, errors)
+            ]
+        )
+
+    async def follow(self, offset: int = 0):
+        """从第 offset 个结果开始依次产出结果，任务结束且结果取尽时停止"""
+        while True:
+            async with self._changed:
+                while offset >= self.completed and not self.finished:
+                    await self._changed.wait()
+                count = min(self.completed - offset, _FOLLOW_BATCH)
+            if count > 0:
+                for result in await run_sync(self._read_results, offset, count):
+                    yield offset, result
+                    offset += 1
+            if self.finished and offset >= self.completed:
+                return
+
+
+class SearchJobs:
+    """进程内的批量检索任务表，保留最近的 history_size 个已结束任务"""
+
+    def __init__(self, history_size: int = job_history_size):
+        self.history_size = history_size
+        self.jobs: OrderedDict[str, SearchJob] = OrderedDict()
+
+    def create(self, search_type: str, input_path: Path, jsonl: bool) -> SearchJob:
+        job = SearchJob(search_type, input_path, jsonl)
+        self.jobs[job.id] = job
+        self._trim()
+        job.start()
+        return job
+
+    def get(self, job_id: str) -> SearchJob | None:
+        return self.jobs.get(job_id)
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[: max(0, len(finished) - self.history_size)]:
+            self.jobs.pop(job_id).remove_files()
+
+
+search_jobs = SearchJobs()
+
+
+def new_input_path() -> Path:
+    search_jobs_path.mkdir(parents=True, exist_ok=True)
+    return search_jobs_path / f"{uuid.uuid4().hex}.input"
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Callable, Iterable, List, Tuple
+
+from loguru import logger as log
+
+from config import ingest_manifest_path
+from database import (
+    DocumentRecord,
+    delete_records,
+    delete_records_by_source,
+    insert_records_batch,
+)
+from service.splitter import SPLITTER_PARAMS, split_pdf_chunks
+
+
+def file_digest(file_path: Path) -> str:
+    """计算文件内容的 sha256"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def split_pdf_records(file_path: Path) -> List[DocumentRecord]:
+    """分割 PDF 文件并生成带确定性 ID 的文档记录"""
+    return [
+        DocumentRecord(content=content, metadata=metadata, id=id)
+        for id, content, metadata in split_pdf_chunks(file_path)
+    ]
+
+
+class IngestManifest:
+    """入库清单，记录每个文件的内容哈希、分割参数与片段 ID
+
+    清单以 JSON 形式保存在 chroma_db 目录下，与向量库一同持久化。
+    """
+
+    def __init__(self, path: Path = ingest_manifest_path):
+        self.path = path
+        self.files: dict[str, dict] = {}
+        if path.exists():
+            try:
+                self.files = json.loads(path.read_text("utf-8")).get("files", {})
+            except json.JSONDecodeError:
+                log.warning(f"入库清单 {path} 已损坏，将重新导入所有文件")
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(
+            json.dumps({"files": self.files}, ensure_ascii=False), "utf-8"
+        )
+        os.replace(tmp_path, self.path)
+
+    def check(self, file_path: Path) -> Tuple[bool, str | None]:
+        """检查文件是否已按当前分割参数入库
+
+        Returns:
+            (是否无需处理, 文件内容哈希)。文件大小与修改时间未变时不计算哈希。
+        """
+        entry = self.files.get(file_path.name)
+        if not entry or entry.get("splitter") != SPLITTER_PARAMS:
+            return False, None
+
+        stat = file_path.stat()
+        if entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+            return True, entry["hash"]
+
+        digest = file_digest(file_path)
+        if digest != entry.get("hash"):
+            return False, digest
+
+        # 内容未变，仅更新文件状态以便下次跳过哈希计算
+        entry["size"] = stat.st_size
+        entry["mtime_ns"] = stat.st_mtime_ns
+        return True, digest
+
+    def chunk_ids(self, name: str) -> List[str]:
+        return self.files.get(name, {}).get("chunk_ids", [])
+
+    def record(self, file_path: Path, digest: str, chunk_ids: List[str]):
+        stat = file_path.stat()
+        self.files[file_path.name] = {
+            "hash": digest,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "splitter": SPLITTER_PARAMS,
+            "chunk_ids": chunk_ids,
+        }
+
+    def remove(self, name: str):
+        self.files.pop(name, None)
+
+
+def purge_file(manifest: IngestManifest, name: str):
+    """从向量库中删除某个文件的全部片段，并移出清单"""
+    chunk_ids = manifest.chunk_ids(name)
+    if name in manifest.files:
+        delete_records(chunk_ids)
+    else:
+        delete_records_by_source(Path(name).stem)
+    manifest.remove(name)
+    log.debug(f"{name} 已从向量库移除，共 {len(chunk_ids)} 个片段")
+
+
+def purge_missing_files(manifest: IngestManifest, file_paths: Iterable[Path]) -> List[str]:
+    """删除清单中已不存在于磁盘的文件的片段"""
+    existing = {file_path.name for file_path in file_paths}
+    removed = [name for name in manifest.files if name not in existing]
+    for name in removed:
+        purge_file(manifest, name)
+    if removed:
+        manifest.save()
+    return removed
+
+
+def pending_files(
+    manifest: IngestManifest, file_paths: Iterable[Path]
+) -> List[Tuple[Path, str]]:
+    """筛选出新增或内容变化的文件
+
+    Returns:
+        (文件路径, 内容哈希) 列表
+    """
+    pending = []
+    for file_path in file_paths:
+        current, digest = manifest.check(file_path)
+        if not current:
+            pending.append((file_path, digest or file_digest(file_path)))
+    return pending
+
+
+def clear_previous_chunks(
+    manifest: IngestManifest, file_path: Path, new_ids: List[str]
+):
+    """删除文件在上次入库时写入、本次已不存在的片段"""
+    if file_path.name in manifest.files:
+        stale_ids = set(manifest.chunk_ids(file_path.name)) - set(new_ids)
+        delete_records(list(stale_ids))
+    else:
+        # 清单之前导入的数据使用随机 ID，按来源整体清理
+        delete_records_by_source(file_path.stem)
+
+
+def index_records(
+    manifest: IngestManifest,
+    file_path: Path,
+    digest: str,
+    docs: List[DocumentRecord],
+    batch_size: int = 32,
+    on_progress: Callable[[int, int], None] | None = None,
+):
+    """写入文件的新片段，删除该文件不再存在的旧片段，并更新清单"""
+    new_ids = [doc.id for doc in docs if doc.id]
+    clear_previous_chunks(manifest, file_path, new_ids)
+
+    if docs:
+        # 批量插入，batch_size设为32（API限制）
+        insert_records_batch(docs, batch_size=batch_size, on_progress=on_progress)
+
+    manifest.record(file_path, digest, new_ids)
+    manifest.save()
+
+
+def index_file(
+    file_path: Path, on_progress: Callable[[int, int], None] | None = None
+) -> int:
+    """增量导入单个文件，返回该文件的片段数"""
+    manifest = IngestManifest()
+    current, digest = manifest.check(file_path)
+    if current:
+        manifest.save()
+        log.info(f"{file_path.name} 未变化，无需重新导入")
+        return len(manifest.chunk_ids(file_path.name))
+
+    docs = split_pdf_records(file_path)
+    index_records(
+        manifest,
+        file_path,
+        digest or file_digest(file_path),
+        docs,
+        on_progress=on_progress,
+    )
+    log.info(f"{file_path.name} 导入完成，共 {len(docs)} 个片段")
+    return len(docs)
+
+
+def remove_file(name: str) -> int:
+    """从向量库中移除单个文件的全部片段，返回移除的片段数"""
+    manifest = IngestManifest()
+    count = len(manifest.chunk_ids(name))
+    purge_file(manifest, name)
+    manifest.save()
+    return count
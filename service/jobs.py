@@ -0,0 +1,161 @@
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, List
+
+from loguru import logger as log
+
+from config import files_store_path, job_history_size
+from database import cached_embeddings, ensure_lexical_index, ensure_vector_index
+from service.ingest import index_file, remove_file
+from utils.vector_cache import migrate_embedding_cache
+
+
+class Job:
+    """后台任务的状态与进度"""
+
+    def __init__(self, kind: str, filename: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.filename = filename
+        self.status = "queued"
+        self.progress = 0.0
+        self.message = ""
+        self.chunks = 0
+        self.created_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "filename": self.filename,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "message": self.message,
+            "chunks": self.chunks,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """进程内的后台任务队列
+
+    由单个工作线程按提交顺序执行，保证同一时刻只有一个任务读写入库清单，
+    请求线程与事件循环只负责提交任务。
+    """
+
+    def __init__(self, history_size: int = job_history_size):
+        self.history_size = history_size
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+        self.handlers: dict[str, Callable[[Job], None]] = {}
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: threading.Thread | None = None
+
+    def register(self, kind: str, handler: Callable[[Job], None]):
+        self.handlers[kind] = handler
+
+    def start(self):
+        with self._lock:
+            if self._worker and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name="jobs", daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout: float | None = None):
+        if self._worker and self._worker.is_alive():
+            self._queue.put(None)
+            self._worker.join(timeout)
+
+    def submit(self, kind: str, filename: str) -> Job:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        job = Job(kind, filename)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._trim()
+        self._queue.put(job)
+        self.start()
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self.jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(self.jobs.values())
+
+    def _trim(self):
+        finished = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.status in ("done", "failed")
+        ]
+        for job_id in finished[: max(0, len(finished) - self.history_size)]:
+            del self.jobs[job_id]
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                self.handlers[job.kind](job)
+                job.status = "done"
+                job.progress = 1.0
+            except Exception as e:
+                log.exception(f"后台任务 {job.kind} {job.filename} 失败: {e}")
+                job.status = "failed"
+                job.message = str(e)
+            finally:
+                job.finished_at = time.time()
+
+
+def _index_job(job: Job):
+    file_path = files_store_path.joinpath(job.filename)
+
+    def on_progress(done: int, total: int):
+        # 分割完成记为 10%，其余进度按写入的片段数计算
+        job.progress = 0.1 + 0.9 * done / total
+
+    job.message = "indexing"
+    job.chunks = index_file(file_path, on_progress=on_progress)
+    job.message = "indexed"
+
+
+def _purge_job(job: Job):
+    job.chunks = remove_file(job.filename)
+    job.message = "purged"
+
+
+def _lexical_job(job: Job):
+    ensure_lexical_index()
+    job.message = "lexical index ready"
+
+
+def _vector_index_job(job: Job):
+    ensure_vector_index()
+    job.message = "vector index ready"
+
+
+def _embedding_cache_job(job: Job):
+    job.chunks = migrate_embedding_cache(cached_embeddings.store)
+    job.message = "embedding cache migrated"
+
+
+job_queue = JobQueue()
+job_queue.register("index", _index_job)
+job_queue.register("purge", _purge_job)
+job_queue.register("lexical", _lexical_job)
+job_queue.register("vector_index", _vector_index_job)
+job_queue.register("embedding_cache", _embedding_cache_job)
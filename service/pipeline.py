@@ -0,0 +1,287 @@
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from loguru import logger as log
+from tqdm import tqdm
+
+from config import (
+    ingest_batch_size,
+    ingest_embed_workers,
+    ingest_parse_workers,
+    ingest_queue_size,
+)
+from database import (
+    DocumentRecord,
+    check_embedding_dimension,
+    embed_records,
+    ensure_lexical_index,
+    ensure_vector_index,
+    vector_index,
+    write_records,
+)
+from service.ingest import (
+    IngestManifest,
+    clear_previous_chunks,
+    pending_files,
+    purge_missing_files,
+)
+from service.splitter import split_pdf_chunks
+from utils.cache import bump_corpus_version
+
+# 队列结束标记
+_STOP = object()
+
+
+class StageStats:
+    """单个流水线阶段的吞吐统计"""
+
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items: int, seconds: float):
+        with self._lock:
+            self.items += items
+            self.busy += seconds
+
+    def to_dict(self, wall: float) -> dict:
+        return {
+            "items": self.items,
+            "unit": self.unit,
+            "busy_seconds": round(self.busy, 3),
+            "throughput": round(self.items / wall, 2) if wall else 0.0,
+        }
+
+
+class IngestPipeline:
+    """流式入库流水线
+
+    解析与分割在进程池中执行；分割结果按 batch_size 跨文件组批后放入有界队列，
+    由多个 embedding 线程并发处理；最终由单一写线程写入 Chroma 并更新入库清单。
+    """
+
+    def __init__(
+        self,
+        parse_workers: int = ingest_parse_workers,
+        embed_workers: int = ingest_embed_workers,
+        batch_size: int = ingest_batch_size,
+        queue_size: int = ingest_queue_size,
+    ):
+        self.parse_workers = max(1, parse_workers)
+        self.embed_workers = max(1, embed_workers)
+        self.batch_size = batch_size
+        self.embed_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.write_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+        self.stats = {
+            "parse": StageStats("parse", "files"),
+            "embed": StageStats("embed", "chunks"),
+            "write": StageStats("write", "chunks"),
+        }
+        self.failed_files: set[Path] = set()
+        self.done_files: List[Path] = []
+        self.progress: tqdm | None = None
+
+    def run(self, files: List[Tuple[Path, str]], manifest: IngestManifest) -> dict:
+        """处理 (文件路径, 内容哈希) 列表，返回各阶段吞吐统计"""
+        started = time.perf_counter()
+        self.progress = tqdm(total=len(files), desc="处理PDF文件")
+
+        embedders = [
+            threading.Thread(target=self._embed_worker, name=f"embed-{i}", daemon=True)
+            for i in range(self.embed_workers)
+        ]
+        writer = threading.Thread(
+            target=self._write_worker, args=(manifest,), name="writer", daemon=True
+        )
+        for thread in embedders:
+            thread.start()
+        writer.start()
+
+        try:
+            self._parse_and_dispatch(files)
+        finally:
+            for _ in embedders:
+                self.embed_queue.put(_STOP)
+            for thread in embedders:
+                thread.join()
+            self.write_queue.put(_STOP)
+            writer.join()
+            self.progress.close()
+
+        if self.done_files:
+            bump_corpus_version()
+        # 入库脚本退出后内存中的增量即丢失，结束时写入索引文件
+        vector_index.flush()
+
+        wall = time.perf_counter() - started
+        report = {
+            "files": len(self.done_files),
+            "failed": len(self.failed_files),
+            "seconds": round(wall, 3),
+            "stages": {name: stats.to_dict(wall) for name, stats in self.stats.items()},
+        }
+        for name, stats in report["stages"].items():
+            log.info(
+                f"[{name}] {stats['items']} {stats['unit']}，"
+                f"{stats['throughput']} {stats['unit']}/s，忙碌 {stats['busy_seconds']}s"
+            )
+        return report
+
+    def _parse_and_dispatch(self, files: List[Tuple[Path, str]]):
+        """在进程池中解析文件，并将片段跨文件组批后送入 embedding 队列"""
+        digests = dict(files)
+        remaining = [file_path for file_path, _ in files]
+        batch: List[Tuple[Path, DocumentRecord]] = []
+
+        # embedding 与写入线程此时已在运行，fork 会把其他线程持有的锁（日志、进度条、
+        # HTTP 连接池）原样复制到子进程中，因此以 spawn 方式启动解析进程。
+        # spawn 的子进程会重新导入 __main__，入口脚本须在函数内导入本模块
+        with ProcessPoolExecutor(
+            max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            in_flight: Dict[Future, Tuple[Path, float]] = {}
+            while remaining or in_flight:
+                # 同时提交的文件数不超过进程数，下游阻塞时解析随之暂停，
+                # 提交到完成的耗时也就近似为解析耗时
+                while remaining and len(in_flight) < self.parse_workers:
+                    file_path = remaining.pop(0)
+                    future = executor.submit(split_pdf_chunks, file_path)
+                    in_flight[future] = (file_path, time.perf_counter())
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path, submitted = in_flight.pop(future)
+                    try:
+                        chunks = future.result()
+                    except Exception as e:
+                        log.error(f"处理文件 {file_path.name} 时出错: {str(e)}")
+                        self.failed_files.add(file_path)
+                        self.progress.update(1)  # type: ignore
+                        continue
+                    self.stats["parse"].add(1, time.perf_counter() - submitted)
+                    log.debug(f"{file_path.name} 文档分割完成，共 {len(chunks)} 个片段")
+
+                    docs = [
+                        DocumentRecord(content=content, metadata=metadata, id=id)
+                        for id, content, metadata in chunks
+                    ]
+                    # 登记消息先于该文件的任何批次到达写线程
+                    self.write_queue.put(("file", file_path, digests[file_path], docs))
+
+                    for doc in docs:
+                        batch.append((file_path, doc))
+                        if len(batch) >= self.batch_size:
+                            self.embed_queue.put(batch)
+                            batch = []
+
+        if batch:
+            self.embed_queue.put(batch)
+
+    def _embed_worker(self):
+        while True:
+            batch = self.embed_queue.get()
+            if batch is _STOP:
+                return
+
+            started = time.perf_counter()
+            try:
+                embeddings = embed_records([doc for _, doc in batch])
+            except Exception as e:
+                log.error(f"生成 embedding 时出错: {str(e)}")
+                self.write_queue.put(("failed", batch, None))
+                continue
+            self.stats["embed"].add(len(batch), time.perf_counter() - started)
+            self.write_queue.put(("batch", batch, embeddings))
+
+    def _write_worker(self, manifest: IngestManifest):
+        """唯一的写线程，负责 Chroma 写入与入库清单更新"""
+        # 文件路径 -> (内容哈希, 片段 ID, 尚未写入的片段数)
+        pending: Dict[Path, Tuple[str, List[str], int]] = {}
+
+        def finish(file_path: Path):
+            digest, ids, _ = pending.pop(file_path)
+            if file_path in self.failed_files:
+                log.warning(f"{file_path.name} 部分片段写入失败，下次导入时重试")
+            else:
+                manifest.record(file_path, digest, ids)
+                manifest.save()
+                self.done_files.append(file_path)
+                log.debug(f"{file_path.name} 处理并插入完成！共 {len(ids)} 个文档片段")
+            self.progress.update(1)  # type: ignore
+
+        while True:
+            message = self.write_queue.get()
+            if message is _STOP:
+                break
+
+            kind = message[0]
+            try:
+                if kind == "file":
+                    _, file_path, digest, docs = message
+                    ids = [doc.id for doc in docs]
+                    clear_previous_chunks(manifest, file_path, ids)
+                    pending[file_path] = (digest, ids, len(docs))
+                    if not docs:
+                        finish(file_path)
+                    continue
+
+                _, batch, embeddings = message
+                if kind == "batch":
+                    started = time.perf_counter()
+                    write_records([doc for _, doc in batch], embeddings)
+                    self.stats["write"].add(len(batch), time.perf_counter() - started)
+                else:
+                    self.failed_files.update(file_path for file_path, _ in batch)
+            except Exception as e:
+                log.error(f"写入数据库时出错: {str(e)}")
+                if kind == "file":
+                    self.failed_files.add(message[1])
+                    pending.pop(message[1], None)
+                    self.progress.update(1)  # type: ignore
+                    continue
+                self.failed_files.update(file_path for file_path, _ in message[1])
+
+            for file_path, _ in message[1]:
+                if file_path not in pending:
+                    continue
+                digest, ids, left = pending[file_path]
+                pending[file_path] = (digest, ids, left - 1)
+                if left == 1:
+                    finish(file_path)
+
+
+def run_ingest_pipeline(file_paths: List[Path], **kwargs) -> dict | None:
+    """按入库清单增量导入文件
+
+    未变化的文件直接跳过，已删除文件的片段从数据库移除，其余文件交由流水线处理。
+    """
+    manifest = IngestManifest()
+    check_embedding_dimension()
+    ensure_lexical_index()
+    ensure_vector_index()
+
+    removed = purge_missing_files(manifest, file_paths)
+    if removed:
+        log.info(f"已移除 {len(removed)} 个已删除文件的片段")
+
+    pending = pending_files(manifest, file_paths)
+    if not pending:
+        manifest.save()
+        log.info("所有PDF文件均未变化，无需重新导入")
+        return None
+
+    pipeline = IngestPipeline(**kwargs)
+    log.info(
+        f"开始处理 {len(pending)} 个PDF文件，解析进程 {pipeline.parse_workers} 个，"
+        f"embedding 线程 {pipeline.embed_workers} 个"
+    )
+    return pipeline.run(pending, manifest)
@@ -1,8 +1,185 @@
-from database import extract_docs_has_single_term
-from utils.definition import extract_term_definition
+from typing import AsyncIterator, List, Tuple
 
+from loguru import logger as log
 
-def get_definition(query: str):
-    docs = extract_docs_has_single_term(query)
+from config import glossary_enabled, single_flight_enabled
+from model import DefinitionResult, RelationResult, TermDefinition, TermRelation
+from database import (
+    DocumentRecord,
+    extract_docs_has_both_term,
+    extract_docs_has_both_term_batch,
+    extract_docs_has_single_term,
+    extract_docs_has_single_term_batch,
+    term_index,
+)
+from service.batch import run_sync
+from utils.definition import (
+    astream_term_definition,
+    extract_term_definition,
+    extract_term_definitions,
+)
+from utils.filters import SearchFilter
+from utils.relation import astream_term_relation, extract_term_relation, extract_term_relations
+from utils.singleflight import SingleFlight
+
+# 相同术语（术语对）与检索范围的并发查询只执行一次：完整的定义、关系查询，以及其中的上下文检索
+definition_flight = SingleFlight(single_flight_enabled)
+relation_flight = SingleFlight(single_flight_enabled)
+retrieval_flight = SingleFlight(single_flight_enabled)
+
+
+def _filter_key(search_filter: SearchFilter | None) -> tuple | None:
+    return search_filter.key() if search_filter is not None else None
+
+
+def definition_docs(term: str, search_filter: SearchFilter | None = None):
+    """包含术语的上下文片段
+
+    检索按术语原文匹配片段内容，合并的键只去除首尾空白。
+    """
+    key = ("definition", term.strip(), _filter_key(search_filter))
+    return retrieval_flight.do(key, extract_docs_has_single_term, term, search_filter)
+
+
+def relation_docs(term_pair: tuple, search_filter: SearchFilter | None = None):
+    """同时包含两个术语的上下文片段"""
+    key = ("relation", term_pair[0].strip(), term_pair[1].strip(), _filter_key(search_filter))
+    return retrieval_flight.do(key, extract_docs_has_both_term, term_pair, search_filter)
+
+
+def lookup_definition(
+    term: str, search_filter: SearchFilter | None = None
+) -> TermDefinition | None:
+    """术语表中有该术语时直接返回标准中的定义；多个标准都有定义时取排序最前的一个"""
+    if not glossary_enabled:
+        return None
+    entries = term_index.define(term, search_filter)
+    if not entries:
+        return None
+    entry = entries[0]
+    log.debug(f"术语“{term}”命中术语表：{entry['source']} {entry['clause']}")
+    return TermDefinition(
+        term=term,
+        definition=entry["definition"],
+        documents=entry["source"] or "",
+        page=entry["page"] or 0,
+        reason=f"{entry['source']} {entry['clause']}",
+    )
+
+
+def _get_definition(query: str, search_filter: SearchFilter | None):
+    result = lookup_definition(query, search_filter)
+    if result is not None:
+        return result
+    docs = definition_docs(query, search_filter)
     result = extract_term_definition(query, docs)
     return result
+
+
+def get_definition(query: str, search_filter: SearchFilter | None = None):
+    key = (query.strip(), _filter_key(search_filter))
+    return definition_flight.do(key, _get_definition, query, search_filter)
+
+
+def _get_relation(term_pair: tuple, search_filter: SearchFilter | None):
+    docs = relation_docs(term_pair, search_filter)
+    result = extract_term_relation(term1=term_pair[0], term2=term_pair[1], docs=docs)
+    return result
+
+
+def get_relation(term_pair: tuple, search_filter: SearchFilter | None = None):
+    key = (term_pair[0].strip(), term_pair[1].strip(), _filter_key(search_filter))
+    return relation_flight.do(key, _get_relation, term_pair, search_filter)
+
+
+def definitions_context(
+    terms: List[str], search_filter: SearchFilter | None = None
+) -> Tuple[List[TermDefinition | None], List[List[DocumentRecord]]]:
+    """一组术语在术语表中的定义，以及术语表中没有的术语的上下文
+
+    上下文一次批量检索；术语表命中的术语上下文为空列表。
+    """
+    found = [lookup_definition(term, search_filter) for term in terms]
+    pending = [i for i, result in enumerate(found) if result is None]
+    contexts: List[List[DocumentRecord]] = [[] for _ in terms]
+    docs = extract_docs_has_single_term_batch([terms[i] for i in pending], search_filter)
+    for i, context in zip(pending, docs):
+        contexts[i] = context
+    return found, contexts
+
+
+def get_definitions(terms: List[str], search_filter: SearchFilter | None = None):
+    """检索一组术语的上下文，并在一个提示词中提取它们的定义；术语表中有的术语直接取其定义"""
+    results, contexts = definitions_context(terms, search_filter)
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        items = [(terms[i], contexts[i]) for i in pending]
+        for i, result in zip(pending, extract_term_definitions(items)):
+            results[i] = result
+    return results
+
+
+def relations_context(
+    term_pairs: List[tuple], search_filter: SearchFilter | None = None
+) -> List[List[DocumentRecord]]:
+    """一组术语对的上下文，一次批量检索"""
+    return extract_docs_has_both_term_batch(term_pairs, search_filter)
+
+
+def get_relations(term_pairs: List[tuple], search_filter: SearchFilter | None = None):
+    """检索一组术语对的上下文，并在一个提示词中提取它们的关系"""
+    items = [
+        (term_pair[0], term_pair[1], docs)
+        for term_pair, docs in zip(term_pairs, relations_context(term_pairs, search_filter))
+    ]
+    return extract_term_relations(items)
+
+
+async def stream_definition(
+    query: str, search_filter: SearchFilter | None = None
+) -> AsyncIterator[Tuple[str, dict | str | None]]:
+    """get_definition 的流式版本：依次产生检索到的片段数、LLM 回答的增量与已生成的字段，
+    最后产生 ("result", DefinitionResult 的字典 | None)。术语表命中时直接产生结果"""
+    result = await run_sync(lookup_definition, query, search_filter)
+    if result is not None:
+        yield "result", to_definition_result(result).model_dump()
+        return
+
+    docs = await run_sync(definition_docs, query, search_filter)
+    yield "context", {"documents": len(docs)}
+    async for event, data in astream_term_definition(query, docs):
+        if event == "result":
+            data = to_definition_result(data).model_dump() if data else None  # type: ignore
+        yield event, data  # type: ignore
+
+
+async def stream_relation(
+    term_pair: tuple, search_filter: SearchFilter | None = None
+) -> AsyncIterator[Tuple[str, dict | str | None]]:
+    """get_relation 的流式版本，事件与 stream_definition 相同"""
+    docs = await run_sync(relation_docs, term_pair, search_filter)
+    yield "context", {"documents": len(docs)}
+    async for event, data in astream_term_relation(term_pair[0], term_pair[1], docs):
+        if event == "result":
+            data = to_relation_result(data).model_dump() if data else None  # type: ignore
+        yield event, data  # type: ignore
+
+
+def to_definition_result(data: TermDefinition) -> DefinitionResult:
+    return DefinitionResult(
+        term=data.term,
+        definition=data.definition.replace("\n", "").replace(" ", "").replace("\t", ""),
+        documents=data.documents,
+        page=data.page,
+    )
+
+
+def to_relation_result(data: TermRelation) -> RelationResult:
+    return RelationResult(
+        term1=data.term1,
+        term2=data.term2,
+        relation=data.relation,
+        reason=data.reason,
+        documents=data.documents.replace(".pdf", "").replace("/T", "_T_"),
+        page=data.page,
+    )
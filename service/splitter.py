@@ -1,5 +1,10 @@
+import bisect
 import hashlib
+import json
+import re
+from collections import Counter
 from pathlib import Path
+from typing import List, Tuple
 
 from loguru import logger as log
 
@@ -7,8 +12,43 @@ from langchain_core.documents import Document
 from langchain_community.document_loaders import PDFPlumberLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 64
+# 按条款分割时单个片段的长度上限，超过时在段落与句子边界处继续切分（不重叠）
+CLAUSE_MAX_SIZE = 1024
 
-def get_splitter_docs(file_path: Path) -> list[Document]:
+# 分割参数，变化后已入库的文件需要重新分割
+SPLITTER_PARAMS = {
+    "splitter": "gb_clause",
+    "version": 1,
+    "clause_max_size": CLAUSE_MAX_SIZE,
+    # 未识别出条款结构的文件仍按字符长度分割
+    "chunk_size": CHUNK_SIZE,
+    "chunk_overlap": CHUNK_OVERLAP,
+}
+
+# 条款编号：1、3.1、4.1.2；附录条款：A.1、B.2.3
+_CLAUSE = re.compile(r"^(\d{1,2}(?:\.\d{1,2}){0,5}|[A-Z](?:\.\d{1,2}){1,5})(?:\s+(\S.*))?$")
+_APPENDIX = re.compile(r"^附\s*录\s*([A-Z])\s*(.*)$")
+# 附录性质，部分文件的文字层中括号与文字分处两行
+_APPENDIX_KIND = re.compile(r"^[（(]?\s*(资料性|规范性)?\s*[)）]?$")
+# 部分文件的文字层中条款编号的点号单独成行：“41 分类”的下一行为“.”
+_BARE_NUMBER = re.compile(r"^([A-Z]?)(\d{2,6})(?:\s+(\S.*))?$")
+_DOTS = re.compile(r"^(?:\.\s*)+$")
+# 页眉中的标准号，如 GB 14778—2025、GB/T 19721.1—2017
+_STANDARD_NUMBER = re.compile(r"^[A-Z]{1,4}(?:/[A-Z])?\s*\d[\d.]*\s*[—–\-]\s*\d{4}$")
+# 页脚页码：阿拉伯数字或罗马数字
+_PAGE_NUMBER = re.compile(r"^[\s\-—]*(\d{1,4}|[ⅠⅡⅢⅣⅤⅥⅦⅧⅨⅩⅪⅫ]+|[IVXLivxl]{1,6})[\s\-—]*$")
+# 目次中的引导符，以及文末的分隔线
+_LEADER = re.compile(r"[…·.]{4,}")
+_RULE = re.compile(r"^[—\-_\s]{3,}$")
+# 术语条目首行：中文术语后接英文名称
+_TERM = re.compile(r"^(.+?)\s+[A-Za-z][A-Za-z\s\-,'()]*$")
+# 标题行不超过该长度且不以句末标点结尾
+_TITLE_MAX_LENGTH = 40
+
+
+def load_pages(file_path: Path) -> list[Document]:
     loader = PDFPlumberLoader(file_path)
     docs = loader.load()
 
@@ -16,10 +56,313 @@ def get_splitter_docs(file_path: Path) -> list[Document]:
     for doc in docs:
         doc.metadata["page"] += 1
         doc.metadata["source"] = file_path.stem
+    return docs
+
+
+def _furniture(pages: List[List[str]]) -> Tuple[set[str], set[str]]:
+    """在多数页面的首行（末行）重复出现的文字视为页眉（页脚）"""
+    non_empty = [lines for lines in pages if lines]
+    threshold = max(2, len(non_empty) * 0.3)
+    firsts = Counter(lines[0] for lines in non_empty)
+    lasts = Counter(lines[-1] for lines in non_empty)
+    return (
+        {line for line, count in firsts.items() if count >= threshold},
+        {line for line, count in lasts.items() if count >= threshold},
+    )
+
+
+def clean_page_lines(pages: List[str]) -> List[List[str]]:
+    """去除页眉、页脚页码、目次引导行与分隔线，返回每页保留的行"""
+    split_pages = [[line.strip() for line in text.splitlines() if line.strip()] for text in pages]
+    headers, footers = _furniture(split_pages)
+    cleaned = []
+    for lines in split_pages:
+        if lines and (lines[0] in headers or _STANDARD_NUMBER.match(lines[0])):
+            lines = lines[1:]
+        if lines and (lines[-1] in footers or _PAGE_NUMBER.match(lines[-1])):
+            lines = lines[:-1]
+        cleaned.append(
+            [line for line in lines if not _LEADER.search(line) and not _RULE.match(line)]
+        )
+    return cleaned
+
+
+def _parse_number(number: str) -> tuple:
+    return tuple(part if part.isalpha() else int(part) for part in number.split("."))
+
+
+def _split_digits(digits: str, parts: int) -> List[tuple]:
+    """把连写的编号数字拆成 parts 段（每段 1~2 位、无前导零）的所有方式"""
+    if parts == 1:
+        return [(int(digits),)] if len(digits) <= 2 and digits[0] != "0" else []
+    result = []
+    for size in (1, 2):
+        head = digits[:size]
+        if len(digits) - size < parts - 1 or head[0] == "0":
+            continue
+        result += [(int(head),) + rest for rest in _split_digits(digits[size:], parts - 1)]
+    return result
+
+
+def _is_next(previous: tuple | None, candidate: tuple) -> bool:
+    """candidate 是否可以紧接 previous 出现：previous 的第一个子条款，或某一级的下一个条款
+
+    用于排除正文与表格中以数字开头的行。
+    """
+    if previous is None:
+        return candidate == (1,)
+    if candidate == previous + (1,):
+        return True
+    level = len(candidate)
+    if level > len(previous) or candidate[:-1] != previous[: level - 1]:
+        return False
+    last, before = candidate[-1], previous[level - 1]
+    if isinstance(last, int) and isinstance(before, int):
+        return last == before + 1
+    return False
+
+
+class _Line:
+    __slots__ = ("page", "offset", "text")
+
+    def __init__(self, page: int, offset: int, text: str):
+        self.page = page
+        self.offset = offset
+        self.text = text
+
+
+class _Clause:
+    def __init__(self, number: str, title: str, heading: List[str], line: _Line | None):
+        self.number = number
+        self.title = title
+        self.heading = heading
+        self.lines: List[_Line] = [line] if line else []
+        self.term: str | None = None
+
+
+def _is_title(text: str) -> bool:
+    return len(text) <= _TITLE_MAX_LENGTH and not text.endswith(("。", "；", "：", ":", ";"))
+
+
+def _heading_label(number: tuple, title: str) -> str:
+    if len(number) == 1 and isinstance(number[0], str):
+        return f"附录 {number[0]} {title}".strip()
+    return f"{'.'.join(map(str, number))} {title}".strip()
+
+
+def _is_heading(number: tuple, title: str) -> bool:
+    """章标题必须有标题文字；条款编号后的文字不能以数字或标点开头（排除表格中的数值行）"""
+    if title and not re.match(r"[\w\u4e00-\u9fff]", title[0]) or title[:1].isdigit():
+        return False
+    if len(number) == 1:
+        return bool(title) and _is_title(title)
+    return True
 
+
+def parse_clauses(pages: List[List[str]]) -> List[_Clause] | None:
+    """按条款编号切分全文，返回的第一项为首个条款之前的内容（封面、前言等）
+
+    识别出的章少于 2 个时返回 None，调用方退回按长度分割。
+    """
+    front = _Clause("", "", [], None)
+    clauses = [front]
+    current = front
+    number: tuple | None = None
+    # 当前条款及其各级上级条款的标题，用于生成片段的标题路径
+    titles: dict[tuple, str] = {}
+    appendix: str | None = None
+    in_terms = False
+    expect_appendix_title = False
+    chapters = 0
+
+    def start_clause(new_number: tuple, label: str, title: str, line: _Line):
+        nonlocal current, number, titles
+        number = new_number
+        titles = {key: value for key, value in titles.items() if key == number[: len(key)]}
+        heading = [
+            _heading_label(key, value)
+            for key, value in sorted(titles.items(), key=lambda item: len(item[0]))
+            if value
+        ]
+        titles[number] = title if _is_title(title) else ""
+        current = _Clause(label, titles[number], heading, line)
+        clauses.append(current)
+
+    for page, lines in enumerate(pages, start=1):
+        offset = 0
+        skip = False
+        for index, text in enumerate(lines):
+            line = _Line(page, offset, text)
+            offset += len(text) + 1
+            if skip:
+                skip = False
+                continue
+
+            bare = _BARE_NUMBER.match(text)
+            if bare and index + 1 < len(lines) and _DOTS.match(lines[index + 1]):
+                # 按点号个数还原编号，取能接续当前条款的拆分方式
+                letter, digits, rest = bare.groups()
+                parts = lines[index + 1].count(".") + (0 if letter else 1)
+                for split in _split_digits(digits, parts):
+                    candidate = ((letter,) if letter else ()) + split
+                    if _is_next(number, candidate):
+                        line.text = text = " ".join(
+                            [".".join(map(str, candidate))] + ([rest] if rest else [])
+                        )
+                        skip = True
+                        break
+
+            if expect_appendix_title:
+                current.lines.append(line)
+                if _APPENDIX_KIND.match(text):
+                    continue
+                expect_appendix_title = False
+                if not current.title:
+                    current.title = titles[number] = text  # type: ignore
+                continue
+
+            match = _APPENDIX.match(text)
+            if (
+                match
+                and (not match.group(2) or _APPENDIX_KIND.match(match.group(2)))
+                and (appendix is None or match.group(1) == chr(ord(appendix) + 1))
+            ):
+                appendix = match.group(1)
+                in_terms = False
+                titles = {}
+                start_clause((appendix,), f"附录{appendix}", "", line)
+                expect_appendix_title = True
+                continue
+
+            match = _CLAUSE.match(text)
+            if match:
+                candidate = _parse_number(match.group(1))
+                title = (match.group(2) or "").strip()
+                follows = _is_next(number, candidate) or (
+                    appendix is not None and number == (appendix,) and candidate == (appendix, 1)
+                )
+                if isinstance(candidate[0], int) and appendix is not None:
+                    follows = False
+                if follows and _is_heading(candidate, title):
+                    if len(candidate) == 1:
+                        chapters += 1
+                        in_terms = "术语" in title
+                    start_clause(candidate, ".".join(map(str, candidate)), title, line)
+                    if in_terms and len(candidate) >= 2 and title:
+                        term = _TERM.match(title)
+                        current.term = (term.group(1) if term else title).strip()
+                    continue
+
+            current.lines.append(line)
+            # 术语条目的编号单独一行，下一行为“术语 英文名称”；术语标准中各章都由这样的条目组成
+            if len(current.lines) == 2 and "." in current.number and not current.title:
+                term = _TERM.match(text)
+                if term or (in_terms and _is_title(text)):
+                    current.term = (term.group(1) if term else text).strip()
+                    current.title = text
+
+    if chapters < 2:
+        return None
+    return clauses
+
+
+def _position(lines: List[_Line], starts: List[int], index: int) -> Tuple[int, int]:
+    """条款文本中第 index 个字符所在的 (页码, 页内偏移)"""
+    i = max(0, bisect.bisect_right(starts, index) - 1)
+    return lines[i].page, lines[i].offset + index - starts[i]
+
+
+def clause_documents(
+    clauses: List[_Clause], page_metadata: dict[int, dict]
+) -> list[Document]:
+    """每个条款（或术语条目）生成一个片段，过长的条款在段落与句子边界处继续切分"""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CLAUSE_MAX_SIZE,
+        chunk_overlap=0,
+        separators=["\n\n", "\n", "。", "；", ""],
+        keep_separator="end",
+        add_start_index=True,
+    )
+    documents = []
+    for clause in clauses:
+        # 只有标题、没有正文的上级条款不单独成片段，其标题记录在下级条款的 heading 中
+        if len(clause.lines) <= (1 if clause.number else 0):
+            continue
+        texts = [line.text for line in clause.lines]
+        text = "\n".join(texts)
+        starts = []
+        position = 0
+        for line_text in texts:
+            starts.append(position)
+            position += len(line_text) + 1
+
+        # 片段内容保持为原文的连续子串：build_context 按 start_index 合并同一页中相接的片段，
+        # 续接部分的出处由元数据中的条款编号与标题给出
+        for part in splitter.create_documents([text]):
+            start = part.metadata["start_index"]
+            page, start_index = _position(clause.lines, starts, start)
+            end_page, _ = _position(clause.lines, starts, start + len(part.page_content) - 1)
+            content = part.page_content
+
+            metadata = dict(page_metadata.get(page, {}))
+            metadata.update(page=page, start_index=start_index)
+            if end_page != page:
+                metadata["page_end"] = end_page
+            if clause.number:
+                metadata["clause"] = clause.number
+            if clause.title:
+                metadata["clause_title"] = clause.title
+            if clause.heading:
+                metadata["heading"] = " > ".join(clause.heading)
+            if clause.term:
+                metadata["term"] = clause.term
+            documents.append(Document(page_content=content, metadata=metadata))
+    return documents
+
+
+def get_splitter_docs(file_path: Path) -> list[Document]:
+    """按国家标准的条款结构分割：去除页眉页脚与目次，每个条款（术语条目）一个片段
+
+    片段元数据中记录条款编号 clause、条款标题 clause_title、上级标题 heading、
+    术语 term（术语条目）与起止页码。未识别出条款结构的文件退回按字符长度分割。
+    """
+    docs = load_pages(file_path)
+    pages = clean_page_lines([doc.page_content for doc in docs])
+    clauses = parse_clauses(pages)
+    if clauses is not None:
+        page_metadata = {doc.metadata["page"]: doc.metadata for doc in docs}
+        return clause_documents(clauses, page_metadata)
+
+    log.debug(f"{file_path.name} 未识别出条款结构，按字符长度分割")
+    for doc, lines in zip(docs, pages):
+        doc.page_content = "\n".join(lines)
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=512, chunk_overlap=64, add_start_index=True
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True
     )
+    return text_splitter.split_documents([doc for doc in docs if doc.page_content])
+
+
+def make_chunk_id(source: str, page: int, start_index: int, content: str) -> str:
+    """由片段内容与位置生成确定性的 ID，重复写入同一片段时结果不变"""
+    key = json.dumps([source, page, start_index, content], ensure_ascii=False)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def split_pdf_chunks(file_path: Path) -> list[tuple[str, str, dict]]:
+    """分割 PDF 文件，返回 (片段 ID, 内容, 元数据) 列表
 
-    all_splits = text_splitter.split_documents(docs)
-    return all_splits
+    只依赖分割器本身，可在进程池的子进程中执行。
+    """
+    return [
+        (
+            make_chunk_id(
+                split.metadata.get("source", file_path.stem),
+                split.metadata.get("page", 0),
+                split.metadata.get("start_index", 0),
+                split.page_content,
+            ),
+            split.page_content,
+            split.metadata,
+        )
+        for split in get_splitter_docs(file_path)
+    ]
@@ -1,6 +1,115 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Iterable
+
+import numpy as np
 from diskcache import Cache
 from pathlib import Path
 
+from config import llm_cache_size_limit, llm_cache_ttl
+
 pwd = Path.cwd()
 
-cache = Cache(pwd / "tmp/cache")
+# 与 LocalFileStore 的 tmp/cache 分开存放，避免混在逐键文件中
+cache = Cache(
+    pwd / "tmp/diskcache",
+    size_limit=llm_cache_size_limit,
+    eviction_policy="least-recently-used",
+)
+
+CORPUS_VERSION_KEY = "corpus_version"
+
+# 知识库版本单独存放在不淘汰的缓存中：与回答放在同一个 LRU 缓存里时可能被淘汰，
+# 版本号回到 0 后尚未过期的旧回答会重新生效
+versions = Cache(pwd / "tmp/diskcache_versions", eviction_policy="none")
+# 早先的版本号存放在回答缓存中，迁移时加一，迁移前缓存的回答全部失效
+if versions.add(CORPUS_VERSION_KEY, cache.get(CORPUS_VERSION_KEY, 0) + 1):  # type: ignore
+    cache.delete(CORPUS_VERSION_KEY)
+
+
+def get_corpus_version() -> int:
+    return versions.get(CORPUS_VERSION_KEY, 0)  # type: ignore
+
+
+def bump_corpus_version():
+    """知识库文档发生变化时调用，使已缓存的 LLM 回答全部失效"""
+    versions.incr(CORPUS_VERSION_KEY, default=0)
+
+
+class LLMCache:
+    """LLM 回答缓存，键由模型、提示词、上下文片段 ID 与知识库版本共同决定"""
+
+    tag = "llm"
+
+    def __init__(self, cache: Cache, ttl: int):
+        self.cache = cache
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, model: str, prompt: str, chunk_ids: Iterable[str | None]) -> str:
+        fingerprint = hashlib.sha256(
+            "\n".join(sorted(str(id) for id in chunk_ids)).encode("utf-8")
+        ).hexdigest()
+        payload = json.dumps(
+            [model, prompt, fingerprint, get_corpus_version()], ensure_ascii=False
+        )
+        return "llm:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        value = self.cache.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value  # type: ignore
+
+    def set(self, key: str, value: str):
+        self.cache.set(key, value, expire=self.ttl, tag=self.tag)
+
+    def clear(self):
+        self.cache.evict(self.tag)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "corpus_version": get_corpus_version(),
+        }
+
+
+llm_cache = LLMCache(cache, ttl=llm_cache_ttl)
+
+
+class LRUCache:
+    """线程安全的定长 LRU 缓存"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> np.ndarray | None:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: np.ndarray):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,172 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import httpx
+from fastapi import HTTPException, status
+from loguru import logger as log
+
+from config import (
+    http_backoff_base,
+    http_backoff_max,
+    http_connect_timeout,
+    http_max_connections,
+    http_max_retries,
+    http_timeout,
+    siliconflow_token,
+)
+
+# 触发重试的上游状态码
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+timeout = httpx.Timeout(http_timeout, connect=http_connect_timeout)
+limits = httpx.Limits(
+    max_connections=http_max_connections,
+    max_keepalive_connections=http_max_connections,
+    keepalive_expiry=60,
+)
+
+# 进程内共享的连接池，复用 TCP/TLS 连接
+client = httpx.Client(timeout=timeout, limits=limits)
+
+# AsyncClient 与事件循环绑定，按事件循环分别创建；以事件循环对象为键，
+# 避免已回收事件循环的 id 被新的事件循环复用
+_async_clients: dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+
+
+def get_async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None or async_client.is_closed:
+        # 已关闭的事件循环上的连接池无法再使用，创建新连接池时一并移除
+        for closed in [other for other in list(_async_clients) if other.is_closed()]:
+            _async_clients.pop(closed, None)
+        async_client = httpx.AsyncClient(timeout=timeout, limits=limits)
+        _async_clients[loop] = async_client
+    return async_client
+
+
+def auth_headers() -> dict:
+    return {
+        "Authorization": f"Bearer {siliconflow_token}",
+        "Content-Type": "application/json",
+    }
+
+
+def backoff_delay(attempt: int, response: httpx.Response | None = None) -> float:
+    """计算第 attempt 次重试前的等待时间（指数退避 + 全抖动），优先遵循 Retry-After"""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), http_backoff_max)
+    return random.uniform(0, min(http_backoff_max, http_backoff_base * 2**attempt))
+
+
+def _transport_error(url: str, e: httpx.TransportError) -> HTTPException:
+    if isinstance(e, httpx.TimeoutException):
+        return HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=f"Upstream request timed out: {url}",
+        )
+    return HTTPException(
+        status_code=status.HTTP_502_BAD_GATEWAY,
+        detail=f"Upstream request failed: {url} ({e})",
+    )
+
+
+def post_json(url: str, payload: dict) -> httpx.Response:
+    """同步 POST JSON，对 429/5xx 与网络错误按退避策略重试
+
+    Returns:
+        最后一次请求的响应，状态码由调用方检查
+    """
+    for attempt in range(http_max_retries + 1):
+        try:
+            response = client.post(url, json=payload, headers=auth_headers())
+        except httpx.TransportError as e:
+            if attempt >= http_max_retries:
+                raise _transport_error(url, e)
+            delay = backoff_delay(attempt)
+            log.warning(f"请求 {url} 出错: {e!r}，{delay:.2f}s 后重试")
+            time.sleep(delay)
+            continue
+
+        if response.status_code in RETRY_STATUS_CODES and attempt < http_max_retries:
+            delay = backoff_delay(attempt, response)
+            log.warning(f"请求 {url} 返回 {response.status_code}，{delay:.2f}s 后重试")
+            time.sleep(delay)
+            continue
+
+        return response
+
+    raise AssertionError("unreachable")
+
+
+async def apost_json(url: str, payload: dict) -> httpx.Response:
+    """post_json 的异步版本"""
+    async_client = get_async_client()
+    for attempt in range(http_max_retries + 1):
+        try:
+            response = await async_client.post(url, json=payload, headers=auth_headers())
+        except httpx.TransportError as e:
+            if attempt >= http_max_retries:
+                raise _transport_error(url, e)
+            delay = backoff_delay(attempt)
+            log.warning(f"请求 {url} 出错: {e!r}，{delay:.2f}s 后重试")
+            await asyncio.sleep(delay)
+            continue
+
+        if response.status_code in RETRY_STATUS_CODES and attempt < http_max_retries:
+            delay = backoff_delay(attempt, response)
+            log.warning(f"请求 {url} 返回 {response.status_code}，{delay:.2f}s 后重试")
+            await asyncio.sleep(delay)
+            continue
+
+        return response
+
+    raise AssertionError("unreachable")
+
+
+@asynccontextmanager
+async def astream_post_json(url: str, payload: dict) -> AsyncIterator[httpx.Response]:
+    """流式 POST JSON，返回尚未读取响应体的响应，退出时关闭
+
+    只在收到响应头之前按退避策略重试；响应体开始传输后出错由调用方处理。
+    """
+    async_client = get_async_client()
+    for attempt in range(http_max_retries + 1):
+        request = async_client.build_request("POST", url, json=payload, headers=auth_headers())
+        try:
+            response = await async_client.send(request, stream=True)
+        except httpx.TransportError as e:
+            if attempt >= http_max_retries:
+                raise _transport_error(url, e)
+            delay = backoff_delay(attempt)
+            log.warning(f"请求 {url} 出错: {e!r}，{delay:.2f}s 后重试")
+            await asyncio.sleep(delay)
+            continue
+
+        if response.status_code in RETRY_STATUS_CODES and attempt < http_max_retries:
+            await response.aclose()
+            delay = backoff_delay(attempt, response)
+            log.warning(f"请求 {url} 返回 {response.status_code}，{delay:.2f}s 后重试")
+            await asyncio.sleep(delay)
+            continue
+
+        try:
+            yield response
+        finally:
+            await response.aclose()
+        return
+
+    raise AssertionError("unreachable")
+
+
+async def aclose_clients():
+    """关闭当前事件循环的连接池及同步连接池，在应用退出时调用"""
+    async_client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if async_client is not None:
+        await async_client.aclose()
+    client.close()
@@ -0,0 +1,143 @@
+import json
+import re
+import threading
+from typing import List
+
+from loguru import logger as log
+
+from config import llm_context_token_budget
+from database import DocumentRecord
+
+_CJK = re.compile(r"[　-〿一-鿿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 数：中文字符与全角标点约 1 个 token，其余字符约 4 个一个 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class ContextStats:
+    """累计发送与因超出预算而丢弃的上下文 token 数"""
+
+    def __init__(self):
+        self.prompts = 0
+        self.sent_tokens = 0
+        self.dropped_tokens = 0
+        self.dropped_chunks = 0
+        self._lock = threading.Lock()
+
+    def add(self, context: "Context"):
+        with self._lock:
+            self.prompts += 1
+            self.sent_tokens += context.tokens
+            self.dropped_tokens += context.dropped_tokens
+            self.dropped_chunks += context.dropped_chunks
+
+    def stats(self) -> dict:
+        return {
+            "prompts": self.prompts,
+            "sent_tokens": self.sent_tokens,
+            "dropped_tokens": self.dropped_tokens,
+            "dropped_chunks": self.dropped_chunks,
+            "avg_tokens": round(self.sent_tokens / self.prompts, 1) if self.prompts else 0.0,
+        }
+
+
+context_stats = ContextStats()
+
+
+class Context:
+    """组装好的上下文及其 token 统计"""
+
+    def __init__(self):
+        self.text = ""
+        self.chunk_ids: List[str] = []
+        self.tokens = 0
+        self.dropped_tokens = 0
+        self.dropped_chunks = 0
+
+
+class _Passage:
+    """同一页中相邻片段合并后的段落，排名取其中最靠前的片段"""
+
+    def __init__(self, doc: DocumentRecord, rank: int):
+        self.rank = rank
+        self.source = doc.metadata.get("source", "未知文档")
+        self.page = doc.metadata.get("page", 0)
+        self.start = doc.metadata.get("start_index", 0)
+        self.content = doc.content
+        self.chunk_ids = [doc.id] if doc.id else []
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.content)
+
+    def extend(self, doc: DocumentRecord, rank: int) -> bool:
+        """起始位置不早于本段落的 doc 与本段落重叠或相接时并入，返回是否合并"""
+        start = doc.metadata["start_index"]
+        if start > self.end:
+            return False
+        self.content += doc.content[self.end - start :]
+        self.rank = min(self.rank, rank)
+        if doc.id:
+            self.chunk_ids.append(doc.id)
+        return True
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {"content": self.content, "doc_name": self.source, "page_number": self.page},
+            ensure_ascii=False,
+        )
+
+
+def _merge_adjacent(docs: List[DocumentRecord]) -> List[_Passage]:
+    """合并同一页中重叠或相接的片段，按排名返回段落"""
+    passages: List[_Passage] = []
+    pages: dict[tuple, List[tuple[int, DocumentRecord]]] = {}
+    for rank, doc in enumerate(docs):
+        if doc.metadata.get("start_index") is None:
+            passages.append(_Passage(doc, rank))
+            continue
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        pages.setdefault(key, []).append((rank, doc))
+
+    for page_docs in pages.values():
+        page_docs.sort(key=lambda item: item[1].metadata["start_index"])
+        current: _Passage | None = None
+        for rank, doc in page_docs:
+            if current is None or not current.extend(doc, rank):
+                current = _Passage(doc, rank)
+                passages.append(current)
+    return sorted(passages, key=lambda p: p.rank)
+
+
+def build_context(
+    docs: List[DocumentRecord], token_budget: int = llm_context_token_budget
+) -> Context:
+    """按排名将片段装入 token 预算，每个段落序列化为一个 JSON 对象
+
+    同一页中重叠或相接的片段（分割时的 chunk_overlap）先合并为一个段落。放不下的
+    段落被跳过，排名更靠后但更短的段落仍可装入。
+    """
+    context = Context()
+    entries = []
+    for passage in _merge_adjacent(docs):
+        entry = passage.to_json()
+        tokens = estimate_tokens(entry)
+        if entries and context.tokens + tokens > token_budget:
+            context.dropped_tokens += tokens
+            context.dropped_chunks += len(passage.chunk_ids) or 1
+            continue
+        # 排名第一的段落即使超出预算也保留，避免上下文为空
+        entries.append(entry)
+        context.tokens += tokens
+        context.chunk_ids.extend(passage.chunk_ids)
+
+    context.text = "\n\n".join(entries)
+    context_stats.add(context)
+    log.debug(
+        f"上下文 {len(docs)} 个片段 -> {len(entries)} 个段落，约 {context.tokens} tokens，"
+        f"丢弃 {context.dropped_chunks} 个片段约 {context.dropped_tokens} tokens"
+    )
+    return context
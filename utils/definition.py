@@ -1,9 +1,39 @@
 import json
-from typing import List
+from typing import AsyncIterator, List, Tuple
 from loguru import logger as log
-from database import CustomDocument, DocumentRecord
+from config import llm_batch_token_budget
+from database import DocumentRecord
 from model import TermDefinition
-from utils.llm import llm_query
+from utils.context import build_context
+from utils.llm import (
+    acached_llm_stream,
+    cached_llm_query,
+    parse_json_array,
+    partial_field_updates,
+)
+
+
+def _definition_prompt(term: str, context_text: str) -> str:
+    return f"""
+    # 根据以下上下文，请分析术语“{term}”的定义，并按要求回答。
+    
+    上下文内容如下：
+    {context_text}
+    
+    # 回答格式
+    请按照以下格式进行回答:
+    {{
+        "term": <string>,
+        "definition": <string>,
+        "documents": <string>,
+        "page": <number>
+    }}
+
+    # 回答的要求:
+    "definition"字段请直接回复术语的定义。
+    "documents"字段请回复最主要的文档的标题。
+    "page"字段请回复依据的页码。
+"""
 
 
 def extract_term_definition(
@@ -33,48 +63,49 @@ def extract_term_definition(
 
     log.debug(json.dumps(docs[0].metadata, ensure_ascii=False, indent=2))
 
-    context_docs = [
-        CustomDocument(
-            content=doc.content,
-            doc_name=doc.metadata.get("source", "未知文档"),
-            page_number=doc.metadata.get("page", 0),
-        )
-        for doc in docs
-    ]
+    context = build_context(docs)
 
-    source_docs = [
-        f'{{"content": "{doc.content}", "doc_name": "{doc.doc_name}", "page_number": {doc.page_number}}}'
-        for doc in context_docs
-    ]
+    message = _definition_prompt(term, context.text)
 
-    context = "\n\n".join(source_docs)
+    # print(message)
 
-    message = f"""
-    # 根据以下上下文，请分析术语“{term}”的定义，并按要求回答。
-    
-    上下文内容如下：
-    {context}
-    
-    # 回答格式
-    请按照以下格式进行回答:
-    {{
-        "term": <string>,
-        "definition": <string>,
-        "documents": <string>,
-        "page": <number>
-    }}
+    data = cached_llm_query(message, context.chunk_ids)
+    result = json.loads(data)
+    return _to_definition(term, result)
 
-    # 回答的要求:
-    "definition"字段请直接回复术语的定义。
-    "documents"字段请回复最主要的文档的标题。
-    "page"字段请回复依据的页码。
-"""
 
-    # print(message)
+async def astream_term_definition(
+    term: str,
+    docs: List[DocumentRecord],
+) -> AsyncIterator[Tuple[str, object]]:
+    """
+    extract_term_definition 的流式版本
 
-    data = llm_query(message)
-    result = json.loads(data)
-    tr = TermDefinition(
+    依次产生 ("token", 回答的文本增量) 与 ("field", {"name", "value", "done"})，
+    即已生成的部分字段；最后产生 ("result", TermDefinition | None)。
+    完整回答不是合法 JSON 时抛出 json.JSONDecodeError。
+    """
+    if not len(docs):
+        log.warning("No documents provided for term definition extraction.")
+        yield "result", None
+        return
+
+    context = build_context(docs)
+    message = _definition_prompt(term, context.text)
+
+    text = ""
+    seen: dict = {}
+    async for delta in acached_llm_stream(message, context.chunk_ids):
+        text += delta
+        yield "token", delta
+        for update in partial_field_updates(text, seen):
+            yield "field", update
+
+    yield "result", _to_definition(term, json.loads(text))
+
+
+def _to_definition(term: str, result: dict) -> TermDefinition:
+    return TermDefinition(
         term=term,
         definition=result.get("definition", ""),
         reason=result.get("reason", ""),
@@ -82,4 +113,90 @@ def extract_term_definition(
         page=result.get("page", 0),
     )
 
-    return tr
+
+def _is_valid_definition(result) -> bool:
+    return (
+        isinstance(result, dict)
+        and isinstance(result.get("definition"), str)
+        and bool(result["definition"].strip())
+        and isinstance(result.get("documents", ""), str)
+        and isinstance(result.get("page", 0), int)
+    )
+
+
+def extract_term_definitions(
+    items: List[Tuple[str, List[DocumentRecord]]],
+) -> List[TermDefinition | None]:
+    """
+    在一个提示词中提取多个术语的定义
+
+    参数:
+        items: (术语, 包含该术语的文档) 列表
+
+    返回:
+        与 items 顺序一致的 TermDefinition 列表，没有文档的术语为 None。
+        回答中缺失或格式错误的术语逐个调用 extract_term_definition 重新提取。
+    """
+    results: List[TermDefinition | None] = [None] * len(items)
+    pending = [i for i, (_, docs) in enumerate(items) if docs]
+    if len(pending) <= 1:
+        return [extract_term_definition(term, docs) for term, docs in items]
+
+    # 各术语平分上下文预算
+    budget = llm_batch_token_budget // len(pending)
+    sections = []
+    chunk_ids = []
+    for number, i in enumerate(pending, start=1):
+        term, docs = items[i]
+        context = build_context(docs, budget)
+        chunk_ids.extend(context.chunk_ids)
+        sections.append(f"""
+    ## 术语 {number}：“{term}”
+    上下文内容如下：
+    {context.text}
+""")
+
+    message = f"""
+    # 根据以下各术语的上下文，请分别分析下列 {len(pending)} 个术语的定义，并按要求回答。
+    {"".join(sections)}
+    # 回答格式
+    请以 JSON 数组回答，每个术语对应数组中的一个对象，按术语编号排列:
+    [
+        {{
+            "index": <number>,
+            "term": <string>,
+            "definition": <string>,
+            "documents": <string>,
+            "page": <number>
+        }}
+    ]
+
+    # 回答的要求:
+    "index"字段请回复术语的编号。
+    "definition"字段请直接回复术语的定义，只依据该术语自己的上下文。
+    "documents"字段请回复最主要的文档的标题。
+    "page"字段请回复依据的页码。
+"""
+
+    answers = parse_json_array(cached_llm_query(message, chunk_ids)) or []
+    by_index = {
+        answer["index"]: answer
+        for answer in answers
+        if isinstance(answer, dict) and isinstance(answer.get("index"), int)
+    }
+    by_term = {
+        answer.get("term"): answer for answer in answers if isinstance(answer, dict)
+    }
+
+    for number, i in enumerate(pending, start=1):
+        term, docs = items[i]
+        answer = by_index.get(number)
+        if answer is None or answer.get("term", term) != term:
+            answer = by_term.get(term)
+        if _is_valid_definition(answer):
+            results[i] = _to_definition(term, answer)  # type: ignore
+        else:
+            log.warning(f"批量提取中术语“{term}”的回答缺失或格式错误，单独重新提取")
+            results[i] = extract_term_definition(term, docs)
+
+    return results
@@ -0,0 +1,471 @@
+import asyncio
+import bisect
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import httpx
+import numpy as np
+from fastapi import HTTPException, status
+from langchain_classic.embeddings.base import Embeddings as LangChainEmbeddings
+
+from config import (
+    embedding_backend,
+    embedding_batch_concurrency,
+    embedding_batch_max_size,
+    embedding_batch_window_ms,
+    onnx_max_batch_size,
+    onnx_max_batch_tokens,
+    onnx_max_length,
+    onnx_model_path,
+    onnx_threads,
+    siliconflow_base_url,
+)
+from utils.cache import LRUCache
+from utils.client import apost_json, post_json
+from utils.hash import make_hash
+from utils.vector_cache import PackedEmbeddingStore
+
+
+class SiliconFlowEmbeddings(LangChainEmbeddings):
+    """自定义 SiliconFlow embedding 类，兼容 LangChain 接口"""
+
+    # 沿用启用多后端之前的缓存键，已有的 embedding 缓存继续有效
+    cache_namespace = ""
+
+    def __init__(self):
+        self.model = "BAAI/bge-m3"
+        self.base_url = siliconflow_base_url
+
+    def _parse_response(self, response: httpx.Response) -> List[List[float]]:
+        if not response.is_success:
+            if response.status_code == 401:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Invalid API key for Embedding service",
+                )
+
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Embedding API request failed with status code {response.status_code}",
+            )
+
+        data = response.json()
+        message = data.get("message")
+        if message:
+            assert False, f"Embedding API error: {message}"
+
+        return [item["embedding"] for item in data["data"]] if data["data"] else []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """嵌入多个文档"""
+        payload = {
+            "model": self.model,
+            "input": texts,
+        }
+        response = post_json(f"{self.base_url}/embeddings", payload)
+        return self._parse_response(response)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """异步嵌入多个文档"""
+        payload = {
+            "model": self.model,
+            "input": texts,
+        }
+        response = await apost_json(f"{self.base_url}/embeddings", payload)
+        return self._parse_response(response)
+
+    def embed_query(self, text: str) -> List[float]:
+        """嵌入单个查询"""
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步嵌入单个查询"""
+        return (await self.aembed_documents([text]))[0]
+
+
+class OnnxEmbeddings(LangChainEmbeddings):
+    """本地 CPU 推理的 ONNX embedding 模型（如量化的 bge-m3）
+
+    model_path 目录下需包含 model.onnx 与 tokenizer.json。输入按长度排序后动态组批，
+    每批的 token 数（批大小 × 批内最大长度）不超过 max_batch_tokens，以减少填充。
+    """
+
+    def __init__(
+        self,
+        model_path: Path = onnx_model_path,
+        threads: int = onnx_threads,
+        max_batch_size: int = onnx_max_batch_size,
+        max_batch_tokens: int = onnx_max_batch_tokens,
+        max_length: int = onnx_max_length,
+    ):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError(
+                "本地 embedding 后端需要安装 onnxruntime 与 tokenizers"
+            ) from e
+
+        model_path = Path(model_path)
+        for name in ("model.onnx", "tokenizer.json"):
+            if not (model_path / name).exists():
+                raise FileNotFoundError(f"本地 embedding 模型文件不存在: {model_path / name}")
+        self.model = model_path.name
+        self.cache_namespace = f"onnx:{self.model}"
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_tokens = max(max_length, max_batch_tokens)
+
+        self.tokenizer = Tokenizer.from_file(str(model_path / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.no_padding()
+
+        options = ort.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            str(model_path / "model.onnx"),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _batches(self, lengths: List[int]) -> List[List[int]]:
+        """按长度排序后组批，返回每批的输入下标"""
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        for i in order:
+            # 已按长度升序，加入后批内最大长度即为 lengths[i]
+            if batch and (
+                len(batch) >= self.max_batch_size
+                or (len(batch) + 1) * lengths[i] > self.max_batch_tokens
+            ):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _run(self, encodings) -> np.ndarray:
+        width = max(len(e.ids) for e in encodings)
+        input_ids = np.zeros((len(encodings), width), dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), width), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            input_ids[row, : len(encoding.ids)] = encoding.ids
+            attention_mask[row, : len(encoding.ids)] = 1
+
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = np.zeros_like(input_ids)
+        output = self.session.run(None, {k: v for k, v in inputs.items() if k in self.input_names})[0]
+
+        # 输出为 [batch, seq, hidden] 时取 [CLS] 向量（bge 系列的池化方式）
+        vectors = output[:, 0] if output.ndim == 3 else output
+        vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+        return vectors.astype(np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """嵌入多个文档"""
+        if not texts:
+            return []
+        encodings = self.tokenizer.encode_batch(texts)
+        results: List[List[float]] = [[] for _ in texts]
+        for batch in self._batches([len(e.ids) for e in encodings]):
+            vectors = self._run([encodings[i] for i in batch])
+            for i, vector in zip(batch, vectors):
+                results[i] = vector.tolist()
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        """嵌入单个查询"""
+        return self.embed_documents([text])[0]
+
+
+# embedding 后端名称 -> 构造函数
+_backends: Dict[str, Callable[[], LangChainEmbeddings]] = {
+    "siliconflow": SiliconFlowEmbeddings,
+    "onnx": OnnxEmbeddings,
+}
+
+
+def register_embedding_backend(name: str, factory: Callable[[], LangChainEmbeddings]):
+    """注册 embedding 后端，通过配置 embedding_backend 选用"""
+    _backends[name] = factory
+
+
+def create_embeddings(name: str = embedding_backend) -> LangChainEmbeddings:
+    if name not in _backends:
+        raise ValueError(
+            f"Unknown embedding backend: {name}, available: {', '.join(_backends)}"
+        )
+    return _backends[name]()
+
+
+class Histogram:
+    """按上界分桶计数，每个值计入第一个不小于它的上界"""
+
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.total += value
+
+    def stats(self) -> dict:
+        with self._lock:
+            buckets = {f"<={bound:g}": count for bound, count in zip(self.bounds, self.counts)}
+            buckets[f">{self.bounds[-1]:g}"] = self.counts[-1]
+            return {
+                "count": self.count,
+                "mean": round(self.total / self.count, 3) if self.count else 0.0,
+                "buckets": buckets,
+            }
+
+
+class BatchingEmbeddings(LangChainEmbeddings):
+    """把并发的 embed_query 调用合并为一次 embed_documents 调用
+
+    第一个查询到达后最多等待 window_ms 毫秒，或凑满 max_size 个查询即发出一批；上游调用
+    在独立的线程中进行，最多 concurrency 批同时请求。文档的 embedding 本身已成批，直接转发。
+    """
+
+    def __init__(
+        self,
+        underlying: LangChainEmbeddings,
+        window_ms: float = embedding_batch_window_ms,
+        max_size: int = embedding_batch_max_size,
+        concurrency: int = embedding_batch_concurrency,
+    ):
+        self.underlying = underlying
+        self.window = max(0.0, window_ms) / 1000
+        self.max_size = max(1, max_size)
+        self._queue: queue.Queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, concurrency), thread_name_prefix="embed-batch"
+        )
+        self._collector: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64, 128])
+        # 查询从提交到所在批次发出的等待时间（毫秒）
+        self.wait_ms = Histogram([0.5, 1, 2, 5, 10, 20, 50, 100])
+
+    def _submit(self, text: str) -> Future:
+        if self._collector is None:
+            with self._start_lock:
+                if self._collector is None:
+                    self._collector = threading.Thread(
+                        target=self._collect, name="embed-batch-collector", daemon=True
+                    )
+                    self._collector.start()
+        future: Future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        while True:
+            first = self._queue.get()
+            batch = [first]
+            deadline = first[2] + self.window
+            while len(batch) < self.max_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    if timeout > 0:
+                        item = self._queue.get(timeout=timeout)
+                    else:
+                        # 等待窗口已过，仍取走已在排队的查询
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+            self._executor.submit(self._run, batch)
+
+    def _run(self, batch: List[tuple]):
+        started = time.perf_counter()
+        self.batch_sizes.observe(len(batch))
+        for _, _, submitted in batch:
+            self.wait_ms.observe((started - submitted) * 1000)
+
+        # 同一批中的相同查询只计算一次
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        try:
+            vectors = self.underlying.embed_documents(texts)
+            if len(vectors) != len(texts):
+                raise ValueError(
+                    f"Embedding API returned {len(vectors)} vectors for {len(texts)} inputs"
+                )
+        except BaseException as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        by_text = dict(zip(texts, vectors))
+        for text, future, _ in batch:
+            future.set_result(by_text[text])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.underlying.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.underlying.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit(text).result()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self._submit(text))
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": self.window * 1000,
+            "max_size": self.max_size,
+            "batch_size": self.batch_sizes.stats(),
+            "wait_ms": self.wait_ms.stats(),
+        }
+
+
+class CachedEmbeddings(LangChainEmbeddings):
+    """两级缓存的 embedding：进程内 LRU（float32 数组）+ 磁盘 PackedEmbeddingStore
+
+    文档与查询的向量都会缓存，查询使用独立的键空间。legacy_store 为旧版
+    LocalFileStore（每个键一个 JSON 文件），磁盘缓存未命中时从中读取并写入磁盘缓存。
+    """
+
+    def __init__(
+        self,
+        underlying: LangChainEmbeddings,
+        store: PackedEmbeddingStore,
+        lru_size: int,
+        namespace: str = "",
+        legacy_store=None,
+    ):
+        self.underlying = underlying
+        self.store = store
+        self.lru = LRUCache(lru_size)
+        self.namespace = namespace
+        self.legacy_store = legacy_store
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _key(self, text: str, query: bool) -> str:
+        prefix = f"{self.namespace}:" if self.namespace else ""
+        return make_hash(f"{prefix}{'query:' if query else ''}{text}")
+
+    def _lookup(self, texts: List[str], query: bool) -> tuple[List[str], Dict[str, np.ndarray]]:
+        """依次查找内存与磁盘缓存，返回 (键列表, 已找到的向量)"""
+        keys = [self._key(text, query) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        for key in keys:
+            vector = self.lru.get(key)
+            if vector is not None:
+                found[key] = vector
+        memory_hits = len(found)
+
+        missing = list({key for key in keys if key not in found})
+        if missing:
+            on_disk = self.store.get_many(missing)
+            if self.legacy_store is not None and not query:
+                on_disk.update(self._legacy_lookup([k for k in missing if k not in on_disk]))
+            for key, vector in on_disk.items():
+                self.lru.set(key, vector)
+            found.update(on_disk)
+
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.disk_hits += sum(1 for key in keys if key in found) - memory_hits
+            self.misses += sum(1 for key in keys if key not in found)
+        return keys, found
+
+    def _legacy_lookup(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        found = {
+            key: np.asarray(json.loads(value), dtype=np.float32)
+            for key, value in zip(keys, self.legacy_store.mget(keys))  # type: ignore
+            if value is not None
+        }
+        if found:
+            self.store.set_many(found)
+        return found
+
+    def _save(self, keys: List[str], vectors: List[List[float]]) -> Dict[str, np.ndarray]:
+        computed = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(keys, vectors)}
+        self.store.set_many(computed)
+        for key, vector in computed.items():
+            self.lru.set(key, vector)
+        return computed
+
+    def _missing(self, texts: List[str], keys: List[str], found: Dict[str, np.ndarray]):
+        """未命中缓存的 (键, 文本)，重复文本只计算一次"""
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        return list(missing.keys()), list(missing.values())
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found = self._lookup(texts, query=False)
+        missing_keys, missing_texts = self._missing(texts, keys, found)
+        if missing_texts:
+            found.update(self._save(missing_keys, self.underlying.embed_documents(missing_texts)))
+        return [found[key].tolist() for key in keys]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found = self._lookup(texts, query=False)
+        missing_keys, missing_texts = self._missing(texts, keys, found)
+        if missing_texts:
+            vectors = await self.underlying.aembed_documents(missing_texts)
+            found.update(self._save(missing_keys, vectors))
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        keys, found = self._lookup([text], query=True)
+        if keys[0] not in found:
+            found.update(self._save(keys, [self.underlying.embed_query(text)]))
+        return found[keys[0]].tolist()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """批量嵌入查询，缓存未命中的查询合并为一次 embed_documents 请求
+
+        两种后端的 embed_query 均等同于单个文本的 embed_documents，向量可与之互换。
+        只有一个查询未命中时仍调用 embed_query，以便与其他请求的查询合并。
+        """
+        keys, found = self._lookup(texts, query=True)
+        missing_keys, missing_texts = self._missing(texts, keys, found)
+        if len(missing_texts) == 1:
+            found.update(self._save(missing_keys, [self.underlying.embed_query(missing_texts[0])]))
+        elif missing_texts:
+            found.update(self._save(missing_keys, self.underlying.embed_documents(missing_texts)))
+        return [found[key].tolist() for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        keys, found = self._lookup([text], query=True)
+        if keys[0] not in found:
+            found.update(self._save(keys, [await self.underlying.aembed_query(text)]))
+        return found[keys[0]].tolist()
+
+    def stats(self) -> dict:
+        total = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / total if total else 0.0,
+            "memory_entries": len(self.lru),
+            "disk_entries": len(self.store),
+            "disk_bytes": self.store.disk_bytes(),
+        }
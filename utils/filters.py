@@ -0,0 +1,121 @@
+import re
+from typing import Iterable, List
+
+_SEPARATORS = re.compile(r"[\s+/_]+")
+# 标准号前缀：GB、GB/T、HY/T 等
+_DOC_TYPE = re.compile(r"^([A-Z]+)(?:_([TZ]))?(?=_|\d|-|$)")
+# 文件名中省略分隔符的推荐性/指导性国标：GBT、GBZ
+_GB_SUFFIX = re.compile(r"^GB([TZ])_?(?=\d)")
+
+
+def normalize_source(source: str) -> str:
+    """统一标准号的写法：GB/T 19721、GB+14778、gb_t_19721、GBZ+45260 分别归一为
+    GB_T_19721、GB_14778、GB_T_19721、GB_Z_45260"""
+    source = source.strip()
+    if source.lower().endswith(".pdf"):
+        source = source[:-4]
+    return _GB_SUFFIX.sub(r"GB_\1_", _SEPARATORS.sub("_", source).upper())
+
+
+def document_type(source: str) -> str | None:
+    """由来源文件名得到文档类型，如 GB_T_19721.1-2017-... 为 GB/T"""
+    match = _DOC_TYPE.match(normalize_source(source))
+    if not match:
+        return None
+    return "/".join(part for part in match.groups() if part)
+
+
+def normalize_doc_type(doc_type: str) -> str:
+    doc_type = _SEPARATORS.sub("/", doc_type.strip()).upper()
+    return "GB/" + doc_type[2:] if doc_type in ("GBT", "GBZ") else doc_type
+
+
+class SearchFilter:
+    """检索范围：来源文件、文档类型与页码范围，各条件同时满足
+
+    来源按标准号前缀匹配：GB+14778-2025 匹配 GB_14778-2025-标题-发布日期 等完整文件名，
+    GB/T 19721 匹配该标准的各个部分。多个来源（或多个文档类型）之间为“或”的关系。
+    """
+
+    def __init__(
+        self,
+        sources: Iterable[str] | None = None,
+        doc_types: Iterable[str] | None = None,
+        page_from: int | None = None,
+        page_to: int | None = None,
+    ):
+        self.sources = [normalize_source(s) for s in sources or [] if s.strip()]
+        self.doc_types = [normalize_doc_type(t) for t in doc_types or [] if t.strip()]
+        self.page_from = page_from
+        self.page_to = page_to
+        if page_from is not None and page_to is not None and page_from > page_to:
+            raise ValueError("page_from must not be greater than page_to")
+
+    @property
+    def empty(self) -> bool:
+        return not (self.sources or self.doc_types or self.has_pages)
+
+    @property
+    def has_pages(self) -> bool:
+        return self.page_from is not None or self.page_to is not None
+
+    def key(self) -> tuple:
+        """可哈希的检索范围，用于合并相同条件的并发检索"""
+        return (
+            tuple(sorted(self.sources)),
+            tuple(sorted(self.doc_types)),
+            self.page_from,
+            self.page_to,
+        )
+
+    def match_source(self, source: str | None) -> bool:
+        if not source:
+            return not (self.sources or self.doc_types)
+        normalized = normalize_source(source)
+        if self.sources and not any(
+            normalized == prefix
+            or (normalized.startswith(prefix) and normalized[len(prefix)] in "-_.")
+            for prefix in self.sources
+        ):
+            return False
+        if self.doc_types and document_type(source) not in self.doc_types:
+            return False
+        return True
+
+    def match_page(self, page) -> bool:
+        if not self.has_pages:
+            return True
+        if not isinstance(page, int):
+            return False
+        if self.page_from is not None and page < self.page_from:
+            return False
+        if self.page_to is not None and page > self.page_to:
+            return False
+        return True
+
+    def matches(self, metadata: dict) -> bool:
+        return self.match_source(metadata.get("source")) and self.match_page(metadata.get("page"))
+
+    def where(self, sources: List[str] | None) -> dict | None:
+        """Chroma 的 where 条件
+
+        Args:
+            sources: 已解析出的满足来源与文档类型条件的完整来源名；为 None 时不下推来源条件，
+                由调用方对结果按 matches 过滤
+        """
+        clauses: List[dict] = []
+        if sources is not None:
+            clauses.append({"source": {"$in": sources}})
+        if self.page_from is not None:
+            clauses.append({"page": {"$gte": self.page_from}})
+        if self.page_to is not None:
+            clauses.append({"page": {"$lte": self.page_to}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def __repr__(self) -> str:
+        return (
+            f"SearchFilter(sources={self.sources}, doc_types={self.doc_types}, "
+            f"pages={self.page_from}-{self.page_to})"
+        )
@@ -0,0 +1,382 @@
+import json
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+_WHITESPACE = re.compile(r"\s+")
+
+# SQLite 单条语句的参数个数上限较小，IN 查询需要分批
+_SQL_BATCH = 900
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    doc INTEGER PRIMARY KEY,
+    id TEXT UNIQUE NOT NULL,
+    source TEXT,
+    content TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_source ON chunks(source);
+CREATE TABLE IF NOT EXISTS postings (
+    gram TEXT NOT NULL,
+    doc INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (gram, doc)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_doc ON postings(doc);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def normalize(text: str) -> str:
+    """去除空白并转为小写。PDF 抽取的中文常被插入空格，检索时忽略空白"""
+    return _WHITESPACE.sub("", text).lower()
+
+
+def ngrams(text: str, n: int = 2) -> List[str]:
+    """字符 n-gram，长度不足 n 的文本整体作为一个 gram"""
+    if len(text) < n:
+        return [text] if text else []
+    return [text[i : i + n] for i in range(len(text) - n + 1)]
+
+
+def _batched(items: List, size: int = _SQL_BATCH):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+class LexicalIndex:
+    """基于字符二元组的 BM25 倒排索引，持久化在 SQLite 中
+
+    与向量库使用相同的片段 ID，入库与删除时同步更新。
+    """
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @property
+    def ready(self) -> bool:
+        """索引是否已与向量库对齐，未就绪时调用方应退回纯向量检索"""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'ready'").fetchone()
+        return bool(row and row[0] == "1")
+
+    def set_ready(self, ready: bool):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('ready', ?)",
+                ("1" if ready else "0",),
+            )
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def add(self, records: Iterable[Tuple[str, str, dict]]):
+        """写入 (片段 ID, 内容, 元数据)，已存在的片段先删除再写入"""
+        records = list(records)
+        if not records:
+            return
+        with self.conn:
+            self._remove_ids([id for id, _, _ in records])
+            for id, content, metadata in records:
+                text = normalize(content)
+                cursor = self.conn.execute(
+                    "INSERT INTO chunks (id, source, content, metadata, length) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        id,
+                        metadata.get("source"),
+                        content,
+                        json.dumps(metadata, ensure_ascii=False),
+                        len(text),
+                    ),
+                )
+                doc = cursor.lastrowid
+                self.conn.executemany(
+                    "INSERT INTO postings (gram, doc, tf) VALUES (?, ?, ?)",
+                    [(gram, doc, tf) for gram, tf in Counter(ngrams(text)).items()],
+                )
+
+    def remove(self, ids: List[str]):
+        with self.conn:
+            self._remove_ids(ids)
+
+    def remove_source(self, source: str):
+        with self.conn:
+            docs = [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT doc FROM chunks WHERE source = ?", (source,)
+                )
+            ]
+            self._remove_docs(docs)
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM postings")
+            self.conn.execute("DELETE FROM chunks")
+
+    def _remove_ids(self, ids: List[str]):
+        docs = []
+        for batch in _batched(ids):
+            placeholders = ",".join("?" * len(batch))
+            docs.extend(
+                row[0]
+                for row in self.conn.execute(
+                    f"SELECT doc FROM chunks WHERE id IN ({placeholders})", batch
+                )
+            )
+        self._remove_docs(docs)
+
+    def _remove_docs(self, docs: List[int]):
+        for batch in _batched(docs):
+            placeholders = ",".join("?" * len(batch))
+            self.conn.execute(f"DELETE FROM postings WHERE doc IN ({placeholders})", batch)
+            self.conn.execute(f"DELETE FROM chunks WHERE doc IN ({placeholders})", batch)
+
+    def _document_frequency(self, grams: List[str]) -> Dict[str, int]:
+        placeholders = ",".join("?" * len(grams))
+        return dict(
+            self.conn.execute(
+                f"SELECT gram, COUNT(*) FROM postings WHERE gram IN ({placeholders}) "
+                "GROUP BY gram",
+                grams,
+            ).fetchall()
+        )
+
+    def _docs_with_gram(self, gram: str) -> set[int]:
+        return {
+            row[0]
+            for row in self.conn.execute("SELECT doc FROM postings WHERE gram = ?", (gram,))
+        }
+
+    def _docs_for_ids(self, ids: List[str]) -> set[int]:
+        docs = set()
+        for batch in _batched(ids):
+            placeholders = ",".join("?" * len(batch))
+            docs.update(
+                row[0]
+                for row in self.conn.execute(
+                    f"SELECT doc FROM chunks WHERE id IN ({placeholders})", batch
+                )
+            )
+        return docs
+
+    def ids_for_source(self, source: str) -> List[str]:
+        return [
+            row[0]
+            for row in self.conn.execute("SELECT id FROM chunks WHERE source = ?", (source,))
+        ]
+
+    def sources(self) -> List[str]:
+        return [
+            row[0]
+            for row in self.conn.execute(
+                "SELECT DISTINCT source FROM chunks WHERE source IS NOT NULL"
+            )
+        ]
+
+    def filter_ids(
+        self,
+        sources: List[str] | None = None,
+        page_from: int | None = None,
+        page_to: int | None = None,
+    ) -> List[str]:
+        """来源属于 sources 且页码在 [page_from, page_to] 内的片段 ID，条件为 None 时不限制"""
+        conditions: List[str] = []
+        params: List = []
+        if page_from is not None:
+            conditions.append("json_extract(metadata, '$.page') >= ?")
+            params.append(page_from)
+        if page_to is not None:
+            conditions.append("json_extract(metadata, '$.page') <= ?")
+            params.append(page_to)
+        if sources is None:
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            return [row[0] for row in self.conn.execute(f"SELECT id FROM chunks{where}", params)]
+
+        ids = []
+        for batch in _batched(sources):
+            batch_conditions = [f"source IN ({','.join('?' * len(batch))})", *conditions]
+            ids.extend(
+                row[0]
+                for row in self.conn.execute(
+                    f"SELECT id FROM chunks WHERE {' AND '.join(batch_conditions)}",
+                    [*batch, *params],
+                )
+            )
+        return ids
+
+    def get(self, ids: List[str]) -> Dict[str, Tuple[str, dict]]:
+        """按片段 ID 读取 (内容, 元数据)，不存在的 ID 不出现在结果中"""
+        found = {}
+        for batch in _batched(ids):
+            placeholders = ",".join("?" * len(batch))
+            for id, content, metadata in self.conn.execute(
+                f"SELECT id, content, metadata FROM chunks WHERE id IN ({placeholders})", batch
+            ):
+                found[id] = (content, json.loads(metadata))
+        return found
+
+    def containing(self, term: str) -> List[Tuple[str, str, dict]]:
+        """（忽略空白）包含 term 的全部片段，返回 (片段 ID, 内容, 元数据)"""
+        term = normalize(term)
+        grams = list(set(ngrams(term)))
+        if not grams:
+            return []
+        df: Dict[str, int] = {}
+        for batch in _batched(grams):
+            df.update(self._document_frequency(batch))
+
+        results = []
+        for batch in _batched(list(self._candidates(term, df))):
+            placeholders = ",".join("?" * len(batch))
+            for id, content, metadata in self.conn.execute(
+                f"SELECT id, content, metadata FROM chunks WHERE doc IN ({placeholders})",
+                batch,
+            ):
+                if term in normalize(content):
+                    results.append((id, content, json.loads(metadata)))
+        return results
+
+    def _candidates(self, term: str, df: Dict[str, int]) -> set[int]:
+        """同时包含 term 全部 gram 的片段，从最稀有的 gram 开始求交集"""
+        grams = sorted(set(ngrams(term)), key=lambda gram: df.get(gram, 0))
+        if not grams or df.get(grams[0], 0) == 0:
+            return set()
+
+        candidates = self._docs_with_gram(grams[0])
+        for gram in grams[1:]:
+            candidates &= self._docs_with_gram(gram)
+            if not candidates:
+                break
+        return candidates
+
+    def search(
+        self,
+        query: str,
+        limit: int = 20,
+        must_contain: List[str] | None = None,
+        ids: List[str] | None = None,
+        within: List[str] | None = None,
+    ) -> List[Tuple[str, str, dict, float]]:
+        """BM25 检索
+
+        Args:
+            query: 查询文本
+            limit: 返回数量上限
+            must_contain: 结果必须（忽略空白）包含的全部词
+            ids: 已知的候选片段 ID，给出时不再通过倒排表求候选集
+            within: 检索范围内的片段 ID，结果只取自其中
+
+        Returns:
+            按得分降序的 (片段 ID, 内容, 元数据, 得分) 列表
+        """
+        must = [normalize(term) for term in must_contain or [] if normalize(term)]
+        query_grams = Counter(ngrams(normalize(query)))
+        all_grams = list(set(query_grams) | {g for term in must for g in ngrams(term)})
+        if not all_grams:
+            return []
+
+        total, avg_length = self.conn.execute(
+            "SELECT COUNT(*), AVG(length) FROM chunks"
+        ).fetchone()
+        if not total:
+            return []
+        avg_length = avg_length or 1
+        df: Dict[str, int] = {}
+        for batch in _batched(all_grams):
+            df.update(self._document_frequency(batch))
+
+        candidates: set[int] | None = None
+        if ids is not None:
+            candidates = self._docs_for_ids(ids)
+            if not candidates:
+                return []
+        if within is not None:
+            within_docs = self._docs_for_ids(within)
+            candidates = within_docs if candidates is None else candidates & within_docs
+            if not candidates:
+                return []
+        for term in must if ids is None else []:
+            term_candidates = self._candidates(term, df)
+            candidates = term_candidates if candidates is None else candidates & term_candidates
+            if not candidates:
+                return []
+
+        # 计算候选片段的 BM25 得分
+        scores: Dict[int, float] = defaultdict(float)
+        grams = [gram for gram in query_grams if df.get(gram)]
+        doc_filter = ""
+        doc_params: List[int] = []
+        if candidates is not None:
+            doc_params = list(candidates)
+            if len(doc_params) <= _SQL_BATCH:
+                doc_filter = f" AND p.doc IN ({','.join('?' * len(doc_params))})"
+        for gram in grams:
+            idf = math.log(1 + (total - df[gram] + 0.5) / (df[gram] + 0.5))
+            rows = self.conn.execute(
+                "SELECT p.doc, p.tf, c.length FROM postings p JOIN chunks c ON c.doc = p.doc "
+                f"WHERE p.gram = ?{doc_filter}",
+                [gram, *doc_params] if doc_filter else [gram],
+            )
+            for doc, tf, length in rows:
+                if candidates is not None and doc not in candidates:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                scores[doc] += query_grams[gram] * idf * tf * (self.k1 + 1) / (tf + norm)
+
+        if candidates is not None:
+            for doc in candidates:
+                scores.setdefault(doc, 0.0)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+        results = []
+        for doc, score in ranked:
+            row = self.conn.execute(
+                "SELECT id, content, metadata FROM chunks WHERE doc = ?", (doc,)
+            ).fetchone()
+            if row is None:
+                continue
+            id, content, metadata = row
+            if must:
+                text = normalize(content)
+                if not all(term in text for term in must):
+                    continue
+            results.append((id, content, json.loads(metadata), score))
+            if len(results) >= limit:
+                break
+        return results
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """倒数排名融合，按融合得分降序返回 ID"""
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, id in enumerate(ranking):
+            scores[id] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda id: scores[id], reverse=True)
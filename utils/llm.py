@@ -1,14 +1,53 @@
-import os
-import requests
+import json
+import re
+import threading
+from typing import AsyncIterator, Iterable, List
+
+import httpx
 from loguru import logger as log
-from fastapi import HTTPException, status
+from fastapi import HTTPException
 
+from config import llm_cache_enabled, siliconflow_base_url, single_flight_enabled
+from utils.cache import llm_cache
+from utils.client import astream_post_json, post_json
+from utils.singleflight import SingleFlight
 
-def llm_query(content: str) -> str:
-    url = "https://api.siliconflow.cn/v1/chat/completions"
+LLM_MODEL = "THUDM/GLM-4-9B-0414"
+
+
+class LLMUsage:
+    """累计 LLM 请求次数与上游返回的 token 用量（缓存命中不计）"""
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, usage: dict | None):
+        usage = usage or {}
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.get("prompt_tokens") or 0
+            self.completion_tokens += usage.get("completion_tokens") or 0
 
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+        }
+
+
+llm_usage = LLMUsage()
+# 相同提示词（与上下文片段）的并发请求只调用一次 LLM
+llm_flight = SingleFlight(single_flight_enabled)
+
+
+def _build_payload(content: str, stream: bool = False) -> dict:
     payload = {
-        "model": "THUDM/GLM-4-9B-0414",
+        "model": LLM_MODEL,
         "messages": [
             {
                 "role": "user",
@@ -17,24 +56,186 @@ def llm_query(content: str) -> str:
         ],
         "temperature": 0,
     }
-    headers = {
-        "Authorization": f"Bearer {os.getenv('siliconflow_token')}",
-        "Content-Type": "application/json",
-    }
+    if stream:
+        payload["stream"] = True
+    return payload
 
-    response = requests.post(url, json=payload, headers=headers)
-    if not response.ok:
+
+def _parse_response(response: httpx.Response) -> str:
+    if not response.is_success:
         raise HTTPException(
             status_code=response.status_code,
             detail=f"LLM API request failed: {response.text}",
         )
 
-    result = response.json()["choices"][0]["message"]["content"]
+    data = response.json()
+    llm_usage.add(data.get("usage"))
+    result = data["choices"][0]["message"]["content"]
+
+    log.debug("Raw LLM Response: {}", result)
+
+    return result
+
+
+def llm_query(content: str) -> str:
+    url = f"{siliconflow_base_url}/chat/completions"
+    response = post_json(url, _build_payload(content))
+    return _parse_response(response)
+
+
+async def astream_llm_query(content: str) -> AsyncIterator[str]:
+    """流式请求 LLM，逐段返回生成的文本"""
+    url = f"{siliconflow_base_url}/chat/completions"
+    parts: List[str] = []
+    usage = None
+    try:
+        async with astream_post_json(url, _build_payload(content, stream=True)) as response:
+            if not response.is_success:
+                await response.aread()
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail=f"LLM API request failed: {response.text}",
+                )
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                # 上游在最后一个（或每个）数据块中返回累计用量
+                usage = chunk.get("usage") or usage
+                choices = chunk.get("choices") or []
+                delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+    finally:
+        if parts or usage:
+            llm_usage.add(usage)
+
+    log.debug("Raw LLM Response: {}", "".join(parts))
+
 
-    log.debug("Raw LLM Response:", result)
+def _is_json(content: str) -> bool:
+    try:
+        json.loads(content)
+    except json.JSONDecodeError:
+        return False
+    return True
 
+
+def parse_json_array(content: str) -> list | None:
+    """解析 LLM 回答中的 JSON 数组，兼容 ```json 代码块与 {"results": [...]} 包装，失败时返回 None"""
+    content = content.strip()
+    if content.startswith("```"):
+        content = content.split("\n", 1)[-1].rsplit("```", 1)[0]
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        start, end = content.find("["), content.rfind("]")
+        if start < 0 or end <= start:
+            return None
+        try:
+            data = json.loads(content[start : end + 1])
+        except json.JSONDecodeError:
+            return None
+
+    if isinstance(data, dict):
+        data = next((value for value in data.values() if isinstance(value, list)), None)
+    return data if isinstance(data, list) else None
+
+
+def _query_and_cache(key: str, content: str) -> str:
+    result = llm_query(content)
+    if llm_cache_enabled and _is_json(result):
+        llm_cache.set(key, result)
     return result
 
 
+def cached_llm_query(content: str, chunk_ids: Iterable[str | None]) -> str:
+    """带缓存的 llm_query，chunk_ids 为构成上下文的文档片段 ID
+
+    只缓存可解析为 JSON 的回答，格式错误的回答下次仍会重新请求。
+    缓存未命中时，相同的并发请求共享一次 LLM 调用。
+    """
+    key = llm_cache.make_key(LLM_MODEL, content, chunk_ids)
+    if llm_cache_enabled:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            log.debug("LLM cache hit: {}", key)
+            return cached
+
+    return llm_flight.do(key, _query_and_cache, key, content)
+
+
+async def _stream_and_cache(key: str, content: str) -> AsyncIterator[str]:
+    parts = []
+    async for delta in astream_llm_query(content):
+        parts.append(delta)
+        yield delta
+    result = "".join(parts)
+    if llm_cache_enabled and _is_json(result):
+        llm_cache.set(key, result)
+
+
+async def acached_llm_stream(
+    content: str, chunk_ids: Iterable[str | None]
+) -> AsyncIterator[str]:
+    """带缓存的 astream_llm_query，缓存命中时一次返回完整回答
+
+    缓存未命中时，相同的并发请求订阅同一个流式调用，后加入的请求先收到已生成的部分。
+    """
+    key = llm_cache.make_key(LLM_MODEL, content, chunk_ids)
+    if llm_cache_enabled:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            log.debug("LLM cache hit: {}", key)
+            yield cached
+            return
+
+    async for delta in llm_flight.astream(key, _stream_and_cache, key, content):
+        yield delta
+
+
+# 尚未生成完的 JSON 对象中的字段：字符串值可能缺少结尾引号，数值以逗号或右花括号结束
+_PARTIAL_FIELD = re.compile(
+    r'"(\w+)"\s*:\s*(?:"((?:[^"\\]|\\.)*\\?)(")?|(-?\d+(?:\.\d+)?)(?=\s*[,}]))'
+)
+
+
+def _decode_partial_string(raw: str) -> str:
+    # 末尾可能是不完整的转义序列（如 \u4e），逐个去掉末尾字符直到可以解码
+    for end in range(len(raw), max(-1, len(raw) - 7), -1):
+        try:
+            return json.loads(f'"{raw[:end]}"')
+        except json.JSONDecodeError:
+            continue
+    return ""
+
+
+def partial_field_updates(text: str, seen: dict) -> List[dict]:
+    """流式回答中新出现或有变化的字段
+
+    Args:
+        text: 目前为止收到的回答
+        seen: 上次调用后各字段的 (值, 是否完整)，由本函数更新
+
+    Returns:
+        [{"name": 字段名, "value": 当前值, "done": 值是否已完整}]
+    """
+    updates = []
+    for match in _PARTIAL_FIELD.finditer(text):
+        name, string, closed, number = match.groups()
+        if string is not None:
+            value, done = _decode_partial_string(string), closed is not None
+        else:
+            value, done = json.loads(number), True
+        if seen.get(name) != (value, done):
+            seen[name] = (value, done)
+            updates.append({"name": name, "value": value, "done": done})
+    return updates
+
+
 if __name__ == "__main__":
     llm_query("你好！")
@@ -0,0 +1,223 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+from utils.lexical import normalize
+
+# 重排序函数：(查询文本, 片段内容列表) -> 与片段一一对应的得分，得分越高越相关
+Reranker = Callable[[str, List[str]], Sequence[float]]
+
+_reranker: Reranker | None = None
+
+
+def set_reranker(reranker: Reranker | None):
+    """注册本地重排序模型（如 cross-encoder），传入 None 时关闭重排序"""
+    global _reranker
+    _reranker = reranker
+
+
+def get_reranker() -> Reranker | None:
+    return _reranker
+
+
+class Candidate:
+    """向量检索返回的候选片段"""
+
+    def __init__(
+        self,
+        id: str,
+        content: str,
+        metadata: dict,
+        distance: float,
+        embedding: Sequence[float] | None = None,
+    ):
+        self.id = id
+        self.content = content
+        self.metadata = metadata
+        self.distance = distance
+        self.embedding = embedding
+
+
+class RankingStats:
+    """各排序阶段的累计调用次数与耗时"""
+
+    def __init__(self):
+        self.calls: Dict[str, int] = {}
+        self.seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                stage: {
+                    "calls": calls,
+                    "avg_ms": round(self.seconds[stage] / calls * 1000, 3),
+                }
+                for stage, calls in self.calls.items()
+            }
+
+
+ranking_stats = RankingStats()
+
+
+class StageTimer:
+    """记录单次检索中各阶段的耗时，同时累计到 ranking_stats"""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def __call__(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+            ranking_stats.add(stage, seconds)
+
+    def summary(self) -> str:
+        return "，".join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in self.timings.items())
+
+
+def _span(candidate: Candidate) -> tuple[str, int, int, int] | None:
+    """片段在原文中的位置 (来源, 页码, 起始, 结束)，缺少 start_index 时返回 None"""
+    start = candidate.metadata.get("start_index")
+    if start is None:
+        return None
+    return (
+        candidate.metadata.get("source", ""),
+        candidate.metadata.get("page", 0),
+        start,
+        start + len(candidate.content),
+    )
+
+
+def dedupe_overlapping(candidates: List[Candidate], max_covered: float = 0.8) -> List[Candidate]:
+    """去除重复片段
+
+    内容（忽略空白）被排名更靠前的片段包含的片段直接去除；同一页中与已保留片段的
+    重叠部分（分割时的 chunk_overlap 及重复写入的片段）超过 max_covered 的片段同样去除。
+    """
+    kept: List[Candidate] = []
+    kept_texts: List[str] = []
+    kept_spans: Dict[tuple, List[tuple[int, int]]] = {}
+    for candidate in candidates:
+        text = normalize(candidate.content)
+        if any(text in kept_text for kept_text in kept_texts):
+            continue
+
+        span = _span(candidate)
+        if span is not None:
+            source, page, start, end = span
+            ranges = kept_spans.get((source, page), [])
+            covered = _covered_length(start, end, ranges)
+            if end > start and covered / (end - start) > max_covered:
+                continue
+            kept_spans.setdefault((source, page), []).append((start, end))
+
+        kept.append(candidate)
+        kept_texts.append(text)
+    return kept
+
+
+def _covered_length(start: int, end: int, ranges: List[tuple[int, int]]) -> int:
+    """[start, end) 被 ranges 覆盖的字符数"""
+    covered = 0
+    cursor = start
+    for range_start, range_end in sorted(ranges):
+        range_start = max(range_start, cursor)
+        range_end = min(range_end, end)
+        if range_end > range_start:
+            covered += range_end - range_start
+            cursor = range_end
+    return covered
+
+
+def mmr(
+    query_embedding: Sequence[float],
+    candidates: List[Candidate],
+    k: int,
+    lambda_mult: float = 0.5,
+) -> List[Candidate]:
+    """最大边际相关性（MMR）选择，在相关性与多样性之间取舍
+
+    候选片段缺少向量时按原顺序返回前 k 个。
+    """
+    if len(candidates) <= 1 or any(c.embedding is None for c in candidates):
+        return candidates[:k]
+
+    vectors = np.asarray([c.embedding for c in candidates], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query /= np.linalg.norm(query) + 1e-12
+
+    relevance = vectors @ query
+    selected = [int(np.argmax(relevance))]
+    # 每个候选与已选片段的最大相似度
+    redundancy = vectors @ vectors[selected[0]]
+    while len(selected) < min(k, len(candidates)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        chosen = int(np.argmax(scores))
+        selected.append(chosen)
+        redundancy = np.maximum(redundancy, vectors @ vectors[chosen])
+    return [candidates[i] for i in selected]
+
+
+def rerank(
+    query: str, candidates: List[Candidate], top_k: int, reranker: Reranker
+) -> List[Candidate]:
+    """用重排序模型对前 top_k 个候选重新打分，其余候选保持原顺序排在其后"""
+    head, tail = candidates[:top_k], candidates[top_k:]
+    if not head:
+        return candidates
+    scores = reranker(query, [c.content for c in head])
+    order = sorted(range(len(head)), key=lambda i: scores[i], reverse=True)
+    return [head[i] for i in order] + tail
+
+
+def rank_candidates(
+    query: str,
+    query_embedding: Sequence[float],
+    candidates: List[Candidate],
+    limit: int,
+    timer: StageTimer,
+    use_mmr: bool = False,
+    mmr_lambda: float = 0.5,
+    dedupe_max_covered: float | None = 0.8,
+    rerank_top_k: int = 0,
+) -> List[Candidate]:
+    """检索结果排序：按距离升序 → 去重 → MMR → 重排序 → 截取 limit 个"""
+    with timer("sort"):
+        # 距离越小越相似
+        ranked = sorted(candidates, key=lambda c: c.distance)
+
+    if dedupe_max_covered is not None:
+        with timer("dedupe"):
+            ranked = dedupe_overlapping(ranked, dedupe_max_covered)
+
+    reranker = get_reranker()
+    if use_mmr:
+        with timer("mmr"):
+            # 需要重排序时多保留一些候选交给重排序模型
+            ranked = mmr(
+                query_embedding,
+                ranked,
+                max(limit, rerank_top_k if reranker else 0),
+                mmr_lambda,
+            )
+
+    if reranker and rerank_top_k > 0:
+        with timer("rerank"):
+            ranked = rerank(query, ranked, rerank_top_k, reranker)
+
+    return ranked[:limit]
@@ -1,11 +1,48 @@
 from model import TermRelation
 import json
-from typing import List
+from typing import AsyncIterator, List, Tuple
 
 from loguru import logger as log
 
-from database import CustomDocument, DocumentRecord, similarity_search
-from utils.llm import llm_query
+from config import llm_batch_token_budget
+from database import DocumentRecord, similarity_search
+from utils.context import build_context
+from utils.llm import (
+    acached_llm_stream,
+    cached_llm_query,
+    parse_json_array,
+    partial_field_updates,
+)
+
+
+def _relation_prompt(term1: str, term2: str, context_text: str) -> str:
+    return f"""
+    # 根据以下上下文，请分析术语“{term1}”和“{term2}”之间的关系，并按要求回答。
+    
+    上下文内容如下：
+    {context_text}
+    
+    请按照以下格式进行回答:
+    {{
+        "relationship": <number>,
+        "reason": <string>,
+        "documents": <string>,
+        "page": <number>
+    }}
+
+    "relationship"的内容要求如下：
+    1. 如果为因果关系，回复`1`；
+    2. 如果为主从关系，回复`2`；
+    
+    "reason"字段的内容要求如下：
+    1. 请在"reason"中填入引入文档的原文解释
+
+    "documents"的内容要求如下：
+    1. 请在"documents"中填入引入文档的标题；
+
+    "page"的内容要求如下：
+    1. 请在"page"中填入引入文档的页码；
+"""
 
 
 def extract_term_relation(
@@ -39,66 +76,59 @@ def extract_term_relation(
 
     log.debug(json.dumps(docs[0].metadata, ensure_ascii=False, indent=2))
 
-    context_docs = [
-        CustomDocument(
-            content=doc.content,
-            doc_name=doc.metadata.get("source", "未知文档"),
-            page_number=doc.metadata.get("page", 0),
-        )
-        for doc in docs
-    ]
+    context = build_context(docs)
+    log.debug(f"文档上下文数量：{len(docs)}")
 
-    log.debug(f"文档上下文数量：{len(context_docs)}")
-    log.debug(json.dumps(context_docs[0].to_dict(), ensure_ascii=False, indent=2))
+    message = _relation_prompt(term1, term2, context.text)
 
-    source_docs = [
-        f'{{"content": "{doc.content}", "doc_name": "{doc.doc_name}", "page_number": {doc.page_number}}}'
-        for doc in context_docs
-    ]
+    # print(message)
 
-    context = "\n\n".join(source_docs)
-    # log.debug(f"用于关系分析的上下文文档：{context}")
+    data = cached_llm_query(message, context.chunk_ids)
+    result = json.loads(data)
+    return _to_relation(term1, term2, result)
 
-    message = f"""
-    # 根据以下上下文，请分析术语“{term1}”和“{term2}”之间的关系，并按要求回答。
-    
-    上下文内容如下：
-    {context}
-    
-    请按照以下格式进行回答:
-    {{
-        "relationship": <number>,
-        "reason": <string>,
-        "documents": <string>,
-        "page": <number>
-    }}
 
-    "relationship"的内容要求如下：
-    1. 如果为因果关系，回复`1`；
-    2. 如果为主从关系，回复`2`；
-    
-    "reason"字段的内容要求如下：
-    1. 请在"reason"中填入引入文档的原文解释
+async def astream_term_relation(
+    term1: str,
+    term2: str,
+    docs: List[DocumentRecord],
+) -> AsyncIterator[Tuple[str, object]]:
+    """
+    extract_term_relation 的流式版本
 
-    "documents"的内容要求如下：
-    1. 请在"documents"中填入引入文档的标题；
+    依次产生 ("token", 回答的文本增量) 与 ("field", {"name", "value", "done"})，
+    即已生成的部分字段；最后产生 ("result", TermRelation | None)。
+    完整回答不是合法 JSON 时抛出 json.JSONDecodeError。
+    """
+    if not len(docs):
+        log.warning("No documents provided for term relation extraction.")
+        yield "result", None
+        return
 
-    "page"的内容要求如下：
-    1. 请在"page"中填入引入文档的页码；
-"""
+    context = build_context(docs)
+    message = _relation_prompt(term1, term2, context.text)
 
-    # print(message)
+    text = ""
+    seen: dict = {}
+    async for delta in acached_llm_stream(message, context.chunk_ids):
+        text += delta
+        yield "token", delta
+        for update in partial_field_updates(text, seen):
+            yield "field", update
 
-    data = llm_query(message)
-    result = json.loads(data)
+    yield "result", _to_relation(term1, term2, json.loads(text))
 
-    relation = result.get("relationship", 0)
+
+def _relation_number(relation) -> int:
     if type(relation) == str:
-        relationNumber = int(relation)
+        return int(relation)
     elif type(relation) == int:
-        relationNumber = relation
-    else:
-        relationNumber = 0
+        return relation
+    return 0
+
+
+def _to_relation(term1: str, term2: str, result: dict) -> TermRelation:
+    relationNumber = _relation_number(result.get("relationship", 0))
 
     if relationNumber == 0:
         relationStr = "没有关系"
@@ -119,3 +149,96 @@ def extract_term_relation(
     )
 
     return tr
+
+
+def _is_valid_relation(result) -> bool:
+    if not isinstance(result, dict) or "relationship" not in result:
+        return False
+    try:
+        _relation_number(result["relationship"])
+    except ValueError:
+        return False
+    return isinstance(result.get("documents", ""), str) and isinstance(
+        result.get("page", 0), int
+    )
+
+
+def extract_term_relations(
+    items: List[Tuple[str, str, List[DocumentRecord]]],
+) -> List[TermRelation | None]:
+    """
+    在一个提示词中提取多组术语的关系
+
+    参数:
+        items: (第一个术语, 第二个术语, 包含两个术语的文档) 列表
+
+    返回:
+        与 items 顺序一致的 TermRelation 列表，没有文档的术语对为 None。
+        回答中缺失或格式错误的术语对逐个调用 extract_term_relation 重新提取。
+    """
+    results: List[TermRelation | None] = [None] * len(items)
+    pending = [i for i, (_, _, docs) in enumerate(items) if docs]
+    if len(pending) <= 1:
+        return [extract_term_relation(term1, term2, docs) for term1, term2, docs in items]
+
+    # 各术语对平分上下文预算
+    budget = llm_batch_token_budget // len(pending)
+    sections = []
+    chunk_ids = []
+    for number, i in enumerate(pending, start=1):
+        term1, term2, docs = items[i]
+        context = build_context(docs, budget)
+        chunk_ids.extend(context.chunk_ids)
+        sections.append(f"""
+    ## 术语对 {number}：“{term1}”和“{term2}”
+    上下文内容如下：
+    {context.text}
+""")
+
+    message = f"""
+    # 根据以下各术语对的上下文，请分别分析下列 {len(pending)} 组术语之间的关系，并按要求回答。
+    {"".join(sections)}
+    请以 JSON 数组回答，每组术语对应数组中的一个对象，按术语对编号排列:
+    [
+        {{
+            "index": <number>,
+            "relationship": <number>,
+            "reason": <string>,
+            "documents": <string>,
+            "page": <number>
+        }}
+    ]
+
+    "index"字段请回复术语对的编号。
+
+    "relationship"的内容要求如下：
+    1. 如果为因果关系，回复`1`；
+    2. 如果为主从关系，回复`2`；
+
+    "reason"字段的内容要求如下：
+    1. 请在"reason"中填入引入文档的原文解释，只依据该术语对自己的上下文
+
+    "documents"的内容要求如下：
+    1. 请在"documents"中填入引入文档的标题；
+
+    "page"的内容要求如下：
+    1. 请在"page"中填入引入文档的页码；
+"""
+
+    answers = parse_json_array(cached_llm_query(message, chunk_ids)) or []
+    by_index = {
+        answer["index"]: answer
+        for answer in answers
+        if isinstance(answer, dict) and isinstance(answer.get("index"), int)
+    }
+
+    for number, i in enumerate(pending, start=1):
+        term1, term2, docs = items[i]
+        answer = by_index.get(number)
+        if _is_valid_relation(answer):
+            results[i] = _to_relation(term1, term2, answer)  # type: ignore
+        else:
+            log.warning(f"批量提取中术语对“{term1}”和“{term2}”的回答缺失或格式错误，单独重新提取")
+            results[i] = extract_term_relation(term1, term2, docs)
+
+    return results
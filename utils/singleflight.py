@@ -0,0 +1,136 @@
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, Dict, Hashable, List, TypeVar
+
+R = TypeVar("R")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class _Broadcast:
+    """一次流式调用的输出，订阅者从头重放已产生的部分并等待后续部分"""
+
+    def __init__(self):
+        self.items: List = []
+        self.finished = False
+        self.error: BaseException | None = None
+        self.changed = asyncio.Condition()
+        # 保留任务的引用，避免执行中被回收
+        self.task: asyncio.Task | None = None
+
+
+class SingleFlight:
+    """合并相同键的并发调用：同一时刻只执行一次，其余调用等待并共享其结果（或异常）
+
+    执行结束后即移除，之后的调用重新执行；结果的复用由各层缓存负责。
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        # 流式调用在事件循环中合并，按事件循环分别登记
+        self._streams: Dict[tuple, _Broadcast] = {}
+        self.executions = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, func: Callable[..., R], *args) -> R:
+        """执行 func(*args)；相同 key 的调用正在执行时等待并返回其结果"""
+        if not self.enabled:
+            return func(*args)
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()  # type: ignore
+            if call.error is not None:  # type: ignore
+                raise call.error  # type: ignore
+            return call.result  # type: ignore
+
+        try:
+            call.result = func(*args)  # type: ignore
+            return call.result  # type: ignore
+        except BaseException as e:
+            call.error = e  # type: ignore
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()  # type: ignore
+
+    async def astream(
+        self, key: Hashable, func: Callable[..., AsyncIterator[R]], *args
+    ) -> AsyncIterator[R]:
+        """逐项返回 func(*args) 产生的内容；相同 key 的流式调用正在进行时订阅其输出
+
+        底层调用在独立的任务中进行，个别订阅者中途断开不影响其他订阅者。
+        """
+        if not self.enabled:
+            async for item in func(*args):
+                yield item
+            return
+
+        stream_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            broadcast = self._streams.get(stream_key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._streams[stream_key] = _Broadcast()
+                self.executions += 1
+            else:
+                self.shared += 1
+        if leader:
+            broadcast.task = asyncio.create_task(self._pump(stream_key, broadcast, func(*args)))
+
+        index = 0
+        while True:
+            async with broadcast.changed:
+                await broadcast.changed.wait_for(
+                    lambda: index < len(broadcast.items) or broadcast.finished
+                )
+                items = broadcast.items[index:]
+                finished, error = broadcast.finished, broadcast.error
+            for item in items:
+                yield item
+            index += len(items)
+            if finished and index >= len(broadcast.items):
+                if error is not None:
+                    raise error
+                return
+
+    async def _pump(self, stream_key: tuple, broadcast: _Broadcast, source: AsyncIterator):
+        try:
+            async for item in source:
+                async with broadcast.changed:
+                    broadcast.items.append(item)
+                    broadcast.changed.notify_all()
+        except BaseException as e:
+            broadcast.error = e
+        finally:
+            with self._lock:
+                self._streams.pop(stream_key, None)
+            async with broadcast.changed:
+                broadcast.finished = True
+                broadcast.changed.notify_all()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.executions + self.shared
+            return {
+                "executions": self.executions,
+                "shared": self.shared,
+                "shared_ratio": round(self.shared / total, 4) if total else 0.0,
+                "in_flight": len(self._calls) + len(self._streams),
+            }
@@ -0,0 +1,338 @@
+import re
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Tuple
+
+from utils.filters import SearchFilter
+from utils.lexical import LexicalIndex, _batched, normalize
+
+# 术语条目的格式：条款编号单独成行（pdfplumber 常把 "3.1" 抽取为 "31" 与 "." 两行），
+# 下一行为中文术语与英文对应词
+_CLAUSE = re.compile(r"^\s*(\d+(?:\s*\.\s*\d+)+|\d{2,5})\s*$")
+_DOTS = re.compile(r"^\s*\.+\s*$")
+_TERM = re.compile(
+    r"^\s*([一-鿿][一-鿿0-9A-Za-z（）()·、\-]{0,30}?)\s+[A-Za-z][A-Za-z\-,;’' ()]*\s*$"
+)
+# 定义之后的注、示例与来源说明不属于定义本身
+# （部分文件的文字层中“注”后的冒号落在另一行，只剩“注 ……”）
+_DEFINITION_END = re.compile(r"^\s*(注\s*\d*\s*([:：]|\s|$)|示例|[\[［【]\s*来源)")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS term_defs (
+    term TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    PRIMARY KEY (term, chunk_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS term_defs_chunk ON term_defs(chunk_id);
+CREATE TABLE IF NOT EXISTS term_chunks (
+    term TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    source TEXT,
+    page INTEGER,
+    PRIMARY KEY (term, chunk_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS term_chunks_chunk ON term_chunks(chunk_id);
+CREATE TABLE IF NOT EXISTS glossary (
+    key TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    term TEXT NOT NULL,
+    definition TEXT NOT NULL,
+    source TEXT,
+    page INTEGER,
+    clause TEXT,
+    PRIMARY KEY (key, chunk_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS glossary_chunk ON glossary(chunk_id);
+"""
+
+
+def extract_terms(text: str) -> List[str]:
+    """从标准的“术语和定义”条目中提取术语"""
+    lines = text.splitlines()
+    terms = []
+    for i, line in enumerate(lines):
+        if not _CLAUSE.match(line):
+            continue
+        j = i + 1
+        while j < len(lines) and _DOTS.match(lines[j]):
+            j += 1
+        if j < len(lines):
+            match = _TERM.match(lines[j])
+            if match:
+                terms.append(match.group(1))
+    return terms
+
+
+def extract_definition(content: str, metadata: dict) -> Tuple[str, str] | None:
+    """由术语条目片段得到 (术语, 定义)
+
+    术语条目片段由分割器生成，元数据中带有 term；片段依次为条款编号、“术语 英文名称”行
+    与定义，定义不含其后的注、示例与来源说明。PDF 抽取的折行直接拼接。
+    """
+    term = metadata.get("term")
+    if not term:
+        return None
+    lines = content.splitlines()
+    key = normalize(term)
+    for i, line in enumerate(lines):
+        if normalize(line).startswith(key):
+            lines = lines[i + 1 :]
+            break
+    else:
+        # 过长条目的续接部分不含术语行
+        return None
+
+    definition = []
+    for line in lines:
+        if _DEFINITION_END.match(line):
+            break
+        definition.append(line.strip())
+    text = "".join(definition)
+    return (term, text) if text else None
+
+
+class AhoCorasick:
+    """多模式串匹配自动机，一次扫描找出文本中出现的全部术语"""
+
+    def __init__(self, words: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[str]] = [[]]
+        for word in words:
+            self._add(word)
+        self._build()
+
+    def _add(self, word: str):
+        state = 0
+        for char in word:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = next_state
+            state = next_state
+        self.output[state].append(word)
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def find(self, text: str) -> set[str]:
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.output[state]:
+                found.update(self.output[state])
+        return found
+
+
+class TermIndex:
+    """术语到片段的倒排索引
+
+    术语表来自各标准“术语和定义”中的条目，与关键词索引存放在同一个 SQLite 文件中。
+    片段写入时用自动机扫描出其中出现的全部已知术语；新发现的术语则通过关键词索引
+    找到已入库的包含它的片段。定义术语的片段全部删除后，该术语随之移出术语表。
+
+    术语条目的定义同时记入 glossary 表（术语 → 定义、来源、页码、条款），
+    查询术语定义时可直接取用，无需检索与调用 LLM。
+    """
+
+    def __init__(self, lexical: LexicalIndex):
+        self.lexical = lexical
+        self._lock = threading.Lock()
+        self._automaton: Tuple[int, AhoCorasick] | None = None
+        self._schema_ready = threading.local()
+
+    @property
+    def conn(self):
+        conn = self.lexical.conn
+        if not getattr(self._schema_ready, "done", False):
+            conn.executescript(SCHEMA)
+            self._schema_ready.done = True
+        return conn
+
+    def _version(self) -> int:
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'terms_version'"
+        ).fetchone()
+        return int(row[0]) if row else 0
+
+    def _bump_version(self):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('terms_version', ?)",
+            (str(self._version() + 1),),
+        )
+
+    def terms(self) -> List[str]:
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT term FROM term_defs")]
+
+    def automaton(self) -> AhoCorasick:
+        version = self._version()
+        with self._lock:
+            if self._automaton is None or self._automaton[0] != version:
+                self._automaton = (version, AhoCorasick(self.terms()))
+            return self._automaton[1]
+
+    def add(self, records: Iterable[Tuple[str, str, dict]]):
+        """登记 (片段 ID, 内容, 元数据) 中定义的术语与出现的术语，需在关键词索引写入之后调用"""
+        records = list(records)
+        if not records:
+            return
+
+        definitions = {
+            (normalize(term), id)
+            for id, content, _ in records
+            for term in extract_terms(content)
+        }
+        glossary = []
+        for id, content, metadata in records:
+            entry = extract_definition(content, metadata)
+            if entry is None:
+                continue
+            term, definition = entry
+            definitions.add((normalize(term), id))
+            glossary.append(
+                (
+                    normalize(term),
+                    id,
+                    term,
+                    definition,
+                    metadata.get("source"),
+                    metadata.get("page"),
+                    metadata.get("clause"),
+                )
+            )
+        with self.conn:
+            known = set(self.terms())
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO term_defs (term, chunk_id) VALUES (?, ?)",
+                list(definitions),
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO glossary "
+                "(key, chunk_id, term, definition, source, page, clause) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                glossary,
+            )
+            new_terms = {term for term, _ in definitions} - known
+            if new_terms:
+                self._bump_version()
+
+        automaton = self.automaton()
+        rows = []
+        for id, content, metadata in records:
+            for term in automaton.find(normalize(content)):
+                rows.append((term, id, metadata.get("source"), metadata.get("page")))
+        # 新术语可能出现在此前入库的片段中
+        for term in new_terms:
+            for id, _, metadata in self.lexical.containing(term):
+                rows.append((term, id, metadata.get("source"), metadata.get("page")))
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO term_chunks (term, chunk_id, source, page) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def remove(self, ids: List[str]):
+        with self.conn:
+            defined = set()
+            for batch in _batched(ids):
+                placeholders = ",".join("?" * len(batch))
+                defined.update(
+                    row[0]
+                    for row in self.conn.execute(
+                        f"SELECT DISTINCT term FROM term_defs WHERE chunk_id IN ({placeholders})",
+                        batch,
+                    )
+                )
+                self.conn.execute(
+                    f"DELETE FROM term_defs WHERE chunk_id IN ({placeholders})", batch
+                )
+                self.conn.execute(
+                    f"DELETE FROM term_chunks WHERE chunk_id IN ({placeholders})", batch
+                )
+                self.conn.execute(
+                    f"DELETE FROM glossary WHERE chunk_id IN ({placeholders})", batch
+                )
+
+            orphans = [
+                term
+                for term in defined
+                if not self.conn.execute(
+                    "SELECT 1 FROM term_defs WHERE term = ? LIMIT 1", (term,)
+                ).fetchone()
+            ]
+            for term in orphans:
+                self.conn.execute("DELETE FROM term_chunks WHERE term = ?", (term,))
+            if orphans:
+                self._bump_version()
+
+    def remove_source(self, source: str):
+        """删除某个来源文件的片段，需在关键词索引删除之前调用"""
+        self.remove(self.lexical.ids_for_source(source))
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM term_defs")
+            self.conn.execute("DELETE FROM term_chunks")
+            self.conn.execute("DELETE FROM glossary")
+            self._bump_version()
+
+    def lookup(self, terms: List[str]) -> List[str] | None:
+        """包含全部 terms 的片段 ID，有术语不在术语表中时返回 None"""
+        chunk_ids: set[str] | None = None
+        for term in terms:
+            term = normalize(term)
+            if not self.conn.execute(
+                "SELECT 1 FROM term_defs WHERE term = ? LIMIT 1", (term,)
+            ).fetchone():
+                return None
+            term_chunk_ids = {
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT chunk_id FROM term_chunks WHERE term = ?", (term,)
+                )
+            }
+            chunk_ids = term_chunk_ids if chunk_ids is None else chunk_ids & term_chunk_ids
+        return list(chunk_ids or [])
+
+    def define(self, term: str, search_filter: SearchFilter | None = None) -> List[dict]:
+        """术语表中该术语的定义，每个定义它的条款一项，按来源与页码排序"""
+        rows = self.conn.execute(
+            "SELECT term, definition, source, page, clause, chunk_id FROM glossary "
+            "WHERE key = ? ORDER BY source, page",
+            (normalize(term),),
+        )
+        entries = [
+            dict(zip(("term", "definition", "source", "page", "clause", "chunk_id"), row))
+            for row in rows
+        ]
+        if search_filter is not None:
+            entries = [entry for entry in entries if search_filter.matches(entry)]
+        return entries
+
+    def stats(self) -> dict:
+        return {
+            "terms": self.conn.execute(
+                "SELECT COUNT(DISTINCT term) FROM term_defs"
+            ).fetchone()[0],
+            "postings": self.conn.execute("SELECT COUNT(*) FROM term_chunks").fetchone()[0],
+            "glossary": self.conn.execute("SELECT COUNT(*) FROM glossary").fetchone()[0],
+        }
@@ -0,0 +1,223 @@
+import json
+import struct
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+from diskcache import Cache
+from loguru import logger as log
+
+from config import embedding_cache_dtype, embedding_cache_path, legacy_embedding_cache_paths
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，只保证进程内的写入互斥
+    fcntl = None
+
+_DTYPES = {"float32": 0, "float16": 1}
+
+_VECTORS_HEADER = struct.Struct("<8sB7x")
+_VECTORS_MAGIC = b"KBVEC001"
+_INDEX_MAGIC = b"KBIDX001"
+# 索引记录：md5 键（16 字节）、向量在 vectors.bin 中的偏移、维度
+_RECORD = struct.Struct("<16sQI")
+
+
+class PackedEmbeddingStore:
+    """磁盘上的 embedding 缓存，全部向量紧凑存放在一个只追加的文件中
+
+    vectors.bin 按 float32 或 float16 顺序存放向量，通过内存映射读取；index.bin 为
+    只追加的 (键, 偏移, 维度) 定长记录，启动时整体读入内存。键为 make_hash 生成的
+    md5 十六进制串。写入时先写向量再写索引，中断后未写完的索引记录在下次打开时截去。
+    """
+
+    def __init__(self, path: Path = embedding_cache_path, dtype: str = embedding_cache_dtype):
+        if dtype not in _DTYPES:
+            raise ValueError(f"Unsupported embedding cache dtype: {dtype}")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.path / "vectors.bin"
+        self.index_path = self.path / "index.bin"
+        self.offsets: Dict[bytes, Tuple[int, int]] = {}
+        self._index_size = len(_INDEX_MAGIC)
+        self._lock = threading.Lock()
+        self._mmap: np.memmap | None = None
+
+        self.dtype = self._open(dtype)
+        self._refresh()
+
+    @contextmanager
+    def _file_lock(self):
+        """跨进程的写锁，批量导入脚本与服务可以同时写入"""
+        with open(self.path / "lock", "a") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _open(self, dtype: str) -> np.dtype:
+        with self._file_lock():
+            if not self.vectors_path.exists() or self.vectors_path.stat().st_size == 0:
+                self.vectors_path.write_bytes(_VECTORS_HEADER.pack(_VECTORS_MAGIC, _DTYPES[dtype]))
+            if not self.index_path.exists() or self.index_path.stat().st_size == 0:
+                self.index_path.write_bytes(_INDEX_MAGIC)
+
+            # 截去中断写入留下的不完整索引记录
+            index_size = self.index_path.stat().st_size
+            complete = len(_INDEX_MAGIC) + (index_size - len(_INDEX_MAGIC)) // _RECORD.size * _RECORD.size
+            if complete != index_size:
+                with open(self.index_path, "rb+") as f:
+                    f.truncate(complete)
+
+        with open(self.vectors_path, "rb") as f:
+            magic, code = _VECTORS_HEADER.unpack(f.read(_VECTORS_HEADER.size))
+        with open(self.index_path, "rb") as f:
+            index_magic = f.read(len(_INDEX_MAGIC))
+        if magic != _VECTORS_MAGIC or index_magic != _INDEX_MAGIC:
+            raise ValueError(f"{self.path} is not an embedding cache")
+
+        stored = next(name for name, value in _DTYPES.items() if value == code)
+        if stored != dtype:
+            log.warning(f"embedding 缓存 {self.path} 以 {stored} 存储，忽略配置的 {dtype}")
+        return np.dtype(stored)
+
+    def _refresh(self):
+        """读入其它进程追加的索引记录"""
+        size = self.index_path.stat().st_size
+        if size <= self._index_size:
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_size)
+            data = f.read(size - self._index_size)
+        count = len(data) // _RECORD.size
+        for key, offset, dim in _RECORD.iter_unpack(data[: count * _RECORD.size]):
+            self.offsets[key] = (offset, dim)
+        self._index_size += count * _RECORD.size
+
+    def _read(self, offset: int, dim: int) -> np.ndarray:
+        end = offset + dim * self.dtype.itemsize
+        if self._mmap is None or end > len(self._mmap):
+            # 文件增长后重新映射
+            self._mmap = np.memmap(self.vectors_path, dtype=np.uint8, mode="r")
+        return self._mmap[offset:end].view(self.dtype).astype(np.float32)
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        with self._lock:
+            if any(bytes.fromhex(key) not in self.offsets for key in keys):
+                self._refresh()
+            found = {}
+            for key in keys:
+                location = self.offsets.get(bytes.fromhex(key))
+                if location is not None:
+                    found[key] = self._read(*location)
+            return found
+
+    def set_many(self, items: Dict[str, np.ndarray]):
+        with self._lock, self._file_lock():
+            self._refresh()
+            new = [
+                (bytes.fromhex(key), np.asarray(vector, dtype=self.dtype))
+                for key, vector in items.items()
+                if bytes.fromhex(key) not in self.offsets
+            ]
+            if not new:
+                return
+
+            with open(self.vectors_path, "ab") as f:
+                offset = f.seek(0, 2)
+                records = []
+                for key, vector in new:
+                    f.write(vector.tobytes())
+                    records.append((key, offset, len(vector)))
+                    offset += vector.nbytes
+            with open(self.index_path, "ab") as f:
+                f.write(b"".join(_RECORD.pack(*record) for record in records))
+
+            for key, offset, dim in records:
+                self.offsets[key] = (offset, dim)
+            self._index_size += len(records) * _RECORD.size
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __contains__(self, key: str) -> bool:
+        try:
+            return bytes.fromhex(key) in self.offsets
+        except ValueError:
+            return False
+
+    def disk_bytes(self) -> int:
+        return self.vectors_path.stat().st_size + self.index_path.stat().st_size
+
+
+def _iter_local_file_store(
+    path: Path, store: PackedEmbeddingStore
+) -> Iterator[Tuple[str, np.ndarray]]:
+    """LocalFileStore 目录：每个文件名为键，内容为 JSON 数组"""
+    for file in path.iterdir():
+        if not file.is_file() or len(file.name) != 32 or file.name in store:
+            continue
+        try:
+            yield file.name, np.asarray(json.loads(file.read_bytes()), dtype=np.float32)
+        except (ValueError, json.JSONDecodeError):
+            log.warning(f"跳过无法解析的缓存文件 {file}")
+
+
+def _iter_diskcache(path: Path, store: PackedEmbeddingStore) -> Iterator[Tuple[str, np.ndarray]]:
+    """diskcache 目录：值为 float32 字节"""
+    with Cache(path) as cache:
+        for key in cache.iterkeys():
+            if key in store:
+                continue
+            value = cache.get(key)
+            if isinstance(key, str) and isinstance(value, bytes):
+                yield key, np.frombuffer(value, dtype=np.float32)
+
+
+def migrate_embedding_cache(
+    store: PackedEmbeddingStore,
+    sources: List[Path] = legacy_embedding_cache_paths,
+    batch_size: int = 1000,
+) -> int:
+    """将旧版 embedding 缓存目录中的向量导入 store，已存在的键跳过，返回导入数量"""
+    migrated = 0
+    for source in sources:
+        source = Path(source)
+        if not source.is_dir():
+            continue
+        entries = (
+            _iter_diskcache(source, store)
+            if (source / "cache.db").exists()
+            else _iter_local_file_store(source, store)
+        )
+        batch: Dict[str, np.ndarray] = {}
+        for key, vector in entries:
+            batch[key] = vector
+            if len(batch) >= batch_size:
+                migrated += _store_new(store, batch)
+                batch = {}
+        migrated += _store_new(store, batch)
+        log.info(f"已从 {source} 导入 embedding 缓存，累计 {migrated} 条")
+    return migrated
+
+
+def _store_new(store: PackedEmbeddingStore, batch: Dict[str, np.ndarray]) -> int:
+    before = len(store)
+    if batch:
+        store.set_many(batch)
+    return len(store) - before
+
+
+if __name__ == "__main__":
+    # python -m utils.vector_cache [旧缓存目录 ...]
+    target = PackedEmbeddingStore()
+    count = migrate_embedding_cache(
+        target, [Path(arg) for arg in sys.argv[1:]] or legacy_embedding_cache_paths
+    )
+    print(f"导入 {count} 条，共 {len(target)} 条，占用 {target.disk_bytes() / 1024**2:.1f} MB")
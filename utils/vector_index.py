@@ -0,0 +1,577 @@
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from loguru import logger as log
+
+INDEX_TYPES = ("flat", "ivf", "auto")
+QUANTIZATIONS = ("none", "int8")
+
+# 构建索引时每批处理的行数
+_BLOCK_ROWS = 65536
+# 计算相似度时每块的行数：int8 向量逐块转换为 float32，块较小时转换结果留在 CPU 缓存中
+_SCORE_BLOCK_ROWS = 4096
+# 训练聚类中心时每个中心的采样点数
+_KMEANS_SAMPLES_PER_LIST = 32
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """按行对称量化为 int8，返回 (codes, scales)，还原为 codes * scales"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """球面 k-means（余弦相似度），返回归一化的聚类中心"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        empty = np.bincount(assign, minlength=k) == 0
+        # 空簇重新随机取点
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class _Segment:
+    """一次构建得到的只读索引数据，数组均为内存映射
+
+    ivf 类型的向量按所属聚类排列，第 i 个聚类的行为 offsets[i]:offsets[i + 1]。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.info = json.loads((path / "info.json").read_text("utf-8"))
+        self.ids: List[str] = json.loads((path / "ids.json").read_text("utf-8"))
+        self.rows = {id: row for row, id in enumerate(self.ids)}
+        self.vectors = np.load(path / "vectors.npy", mmap_mode="r")
+        self.scales = (
+            np.load(path / "scales.npy", mmap_mode="r")
+            if self.info["quantization"] == "int8"
+            else None
+        )
+        self.centroids = None
+        self.offsets = None
+        if self.info["type"] == "ivf":
+            self.centroids = np.load(path / "centroids.npy")
+            self.offsets = np.load(path / "offsets.npy")
+        # 删除或被覆盖写入的行，检索时跳过
+        self.alive = np.ones(len(self.ids), dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def vector(self, row: int) -> np.ndarray:
+        if self.scales is None:
+            return np.asarray(self.vectors[row], dtype=np.float32)
+        return self.vectors[row].astype(np.float32) * self.scales[row]
+
+    def _score_range(self, query: np.ndarray, start: int, end: int) -> np.ndarray:
+        scores = np.empty(end - start, dtype=np.float32)
+        for block in range(start, end, _SCORE_BLOCK_ROWS):
+            stop = min(block + _SCORE_BLOCK_ROWS, end)
+            vectors = self.vectors[block:stop]
+            if self.scales is None:
+                scores[block - start : stop - start] = vectors @ query
+            else:
+                scores[block - start : stop - start] = (
+                    vectors.astype(np.float32) @ query
+                ) * self.scales[block:stop]
+        return scores
+
+    def score_rows(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """指定行（升序，按顺序读取内存映射）的余弦相似度"""
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), _SCORE_BLOCK_ROWS):
+            block = rows[start : start + _SCORE_BLOCK_ROWS]
+            vectors = np.asarray(self.vectors[block], dtype=np.float32)
+            scores[start : start + len(block)] = vectors @ query
+            if self.scales is not None:
+                scores[start : start + len(block)] *= self.scales[block]
+        return scores
+
+    def search(self, query: np.ndarray, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (行号, 余弦相似度)，已去除失效的行"""
+        if self.centroids is None or self.offsets is None:
+            ranges = [(0, len(self.ids))]
+        else:
+            probes = np.argsort(-(self.centroids @ query))[: max(1, nprobe)]
+            ranges = [(int(self.offsets[c]), int(self.offsets[c + 1])) for c in probes]
+
+        rows = np.concatenate(
+            [np.arange(start, end) for start, end in ranges] or [np.empty(0, dtype=np.int64)]
+        )
+        scores = (
+            np.concatenate([self._score_range(query, start, end) for start, end in ranges])
+            if len(rows)
+            else np.empty(0, dtype=np.float32)
+        )
+        keep = self.alive[rows]
+        return rows[keep], scores[keep]
+
+
+class VectorIndex:
+    """进程内的向量检索索引，作为 Chroma 查询之外的另一种检索引擎
+
+    向量归一化后按余弦相似度检索，可选 int8 量化（内存与磁盘占用约为 float32 的 1/4）。
+    flat 类型对全部向量做分块矩阵乘法；ivf 类型先用 k-means 将向量分为 nlist 个聚类，
+    检索时只扫描与查询最接近的 nprobe 个聚类。
+
+    索引文件持久化在 path 下的版本目录中，以内存映射方式读取，同一台机器上的多个
+    进程共享页缓存。入库与删除先记录在内存中的增量里，累计超过 compact_threshold 条
+    且超过索引片段数的 compact_ratio 时在后台线程中重写索引文件，调用 flush 时立即重写；
+    按比例触发使重写的总开销与片段数成线性。重写期间检索与写入照常进行，期间的变更
+    在新索引文件替换旧文件时补上。有未保存的增量时索引在磁盘上标记为 dirty，
+    其它进程与异常退出后的下次启动视其为未就绪，由调用方从向量库重建。
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        index_type: str = "auto",
+        quantization: str = "int8",
+        ivf_min_size: int = 50000,
+        nlist: int = 0,
+        nprobe: int = 16,
+        compact_threshold: int = 2000,
+        compact_ratio: float = 0.1,
+    ):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported vector index type: {index_type}")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unsupported vector index quantization: {quantization}")
+        self.path = Path(path)
+        self.index_type = index_type
+        self.quantization = quantization
+        self.ivf_min_size = ivf_min_size
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.compact_threshold = compact_threshold
+        self.compact_ratio = compact_ratio
+
+        self._lock = threading.RLock()
+        # 同一时刻只进行一次重写
+        self._flush_lock = threading.Lock()
+        self._compacting = False
+        self._segment: _Segment | None = None
+        self._added: Dict[str, np.ndarray] = {}
+        self._removed = 0
+        # 重写进行中：正在写入新文件的增量（检索时仍然可见），以及重写期间变更过的片段 ID
+        self._flushing: Dict[str, np.ndarray] = {}
+        self._touched: set[str] | None = None
+        # 增量向量堆叠成的矩阵，增量变化时失效
+        self._delta: Tuple[List[str], np.ndarray] | None = None
+        self._stale = False
+        self._meta_mtime = 0
+        self.searches = 0
+        self.search_seconds = 0.0
+        self._load()
+
+    @property
+    def meta_path(self) -> Path:
+        return self.path / "meta.json"
+
+    def _read_meta(self) -> dict:
+        try:
+            return json.loads(self.meta_path.read_text("utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_meta(self, **data):
+        meta = self._read_meta()
+        meta.update(data)
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.meta_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(meta), "utf-8")
+        os.replace(tmp_path, self.meta_path)
+        self._meta_mtime = self.meta_path.stat().st_mtime_ns
+
+    def _load(self):
+        meta = self._read_meta()
+        segment = None
+        if meta.get("version"):
+            try:
+                segment = _Segment(self.path / meta["version"])
+            except (FileNotFoundError, ValueError, KeyError) as e:
+                log.warning(f"向量索引 {self.path} 无法读取，需要重建: {e}")
+        with self._lock:
+            self._segment = segment
+            self._added = {}
+            self._removed = 0
+            self._delta = None
+            # 其它进程有未保存的增量，或上次异常退出
+            self._stale = bool(meta.get("dirty"))
+            self._meta_mtime = self.meta_path.stat().st_mtime_ns if meta else 0
+
+    def _reload_if_changed(self):
+        """其它进程重写了索引文件且本进程没有未保存的增量时重新加载"""
+        if self._added or self._removed or self._touched is not None:
+            return
+        try:
+            mtime = self.meta_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._meta_mtime:
+            self._load()
+
+    @property
+    def ready(self) -> bool:
+        """索引是否已构建且与向量库一致，未就绪时调用方应退回 Chroma 查询"""
+        self._reload_if_changed()
+        return self._segment is not None and not self._stale
+
+    def count(self) -> int:
+        with self._lock:
+            base = int(self._segment.alive.sum()) if self._segment is not None else 0
+            return base + len(self._added) + len(self._flushing)
+
+    def _resolve_type(self, count: int) -> str:
+        if self.index_type != "auto":
+            return self.index_type
+        return "ivf" if count >= self.ivf_min_size else "flat"
+
+    def _write_version(self, batches: Iterable[Tuple[List[str], List[List[float]]]]) -> str:
+        """由 (片段 ID, 向量) 批次写入新的版本目录，返回版本名"""
+        version = f"v{time.time_ns()}"
+        target = self.path / version
+        target.mkdir(parents=True, exist_ok=True)
+        try:
+            ids, dim = self._write_raw(target, batches)
+            self._finalize(target, ids, dim)
+        except BaseException:
+            shutil.rmtree(target, ignore_errors=True)
+            raise
+        return version
+
+    def build(self, batches: Iterable[Tuple[List[str], List[List[float]]]]):
+        """由 (片段 ID, 向量) 批次构建索引并替换当前索引"""
+        with self._flush_lock:
+            version = self._write_version(batches)
+            with self._lock:
+                old = self._read_meta().get("version")
+                self._write_meta(version=version, dirty=False)
+                self._load()
+        if old and old != version:
+            # 其它进程已映射的旧文件在 Linux 上删除后仍可读取
+            shutil.rmtree(self.path / old, ignore_errors=True)
+        log.info(
+            f"向量索引构建完成：{len(self._segment)} 个片段，{self._segment.info['type']}，"  # type: ignore
+            f"{self.quantization}"
+        )
+
+    def _write_raw(
+        self, target: Path, batches: Iterable[Tuple[List[str], List[List[float]]]]
+    ) -> Tuple[List[str], int]:
+        """归一化后的 float32 向量先顺序写入临时文件，不在内存中保留全部向量"""
+        ids: List[str] = []
+        dim = 0
+        with open(target / "raw.f32", "wb") as f:
+            for batch_ids, embeddings in batches:
+                if not batch_ids:
+                    continue
+                vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+                dim = dim or vectors.shape[1]
+                if vectors.shape[1] != dim:
+                    raise ValueError(f"向量维度不一致：{vectors.shape[1]} != {dim}")
+                f.write(vectors.tobytes())
+                ids.extend(batch_ids)
+        return ids, dim
+
+    def _finalize(self, target: Path, ids: List[str], dim: int):
+        raw_path = target / "raw.f32"
+        count = len(ids)
+        raw = (
+            np.memmap(raw_path, dtype=np.float32, mode="r", shape=(count, dim))
+            if count
+            else np.empty((0, dim), dtype=np.float32)
+        )
+        index_type = self._resolve_type(count)
+        nlist = 0
+        order = np.arange(count)
+        if index_type == "ivf" and count:
+            nlist = self.nlist or int(4 * math.sqrt(count))
+            nlist = max(1, min(nlist, count))
+            rng = np.random.default_rng(0)
+            sample_size = min(count, nlist * _KMEANS_SAMPLES_PER_LIST)
+            sample = np.asarray(raw[np.sort(rng.choice(count, size=sample_size, replace=False))])
+            centroids = kmeans(sample, nlist)
+            assign = np.concatenate(
+                [
+                    np.argmax(np.asarray(raw[i : i + _BLOCK_ROWS]) @ centroids.T, axis=1)
+                    for i in range(0, count, _BLOCK_ROWS)
+                ]
+            )
+            order = np.argsort(assign, kind="stable")
+            offsets = np.zeros(nlist + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+            np.save(target / "centroids.npy", centroids)
+            np.save(target / "offsets.npy", offsets)
+
+        dtype = np.int8 if self.quantization == "int8" else np.float32
+        vectors = np.lib.format.open_memmap(
+            target / "vectors.npy", mode="w+", dtype=dtype, shape=(count, dim)
+        )
+        scales = np.empty(count, dtype=np.float32)
+        for start in range(0, count, _BLOCK_ROWS):
+            rows = order[start : start + _BLOCK_ROWS]
+            block = np.asarray(raw[np.sort(rows)])[np.argsort(np.argsort(rows))]
+            if self.quantization == "int8":
+                vectors[start : start + len(rows)], scales[start : start + len(rows)] = (
+                    quantize_int8(block)
+                )
+            else:
+                vectors[start : start + len(rows)] = block
+        vectors.flush()
+        del vectors, raw
+        if self.quantization == "int8":
+            np.save(target / "scales.npy", scales)
+        raw_path.unlink()
+
+        (target / "ids.json").write_text(json.dumps([ids[i] for i in order]), "utf-8")
+        (target / "info.json").write_text(
+            json.dumps(
+                {
+                    "type": index_type,
+                    "quantization": self.quantization,
+                    "dim": dim,
+                    "count": count,
+                    "nlist": nlist,
+                    "built_at": time.time(),
+                }
+            ),
+            "utf-8",
+        )
+
+    def _begin_update(self) -> bool:
+        """有未保存的增量时在磁盘上标记为 dirty，异常退出后下次启动时重建
+
+        索引未构建或已过期时不记录增量（需要从向量库整体重建），返回 False。
+        """
+        if not self.ready:
+            return False
+        if not (self._added or self._removed):
+            self._write_meta(dirty=True)
+        return True
+
+    def add(self, ids: List[str], embeddings: List[List[float]]):
+        """写入或覆盖片段向量"""
+        if not ids:
+            return
+        with self._lock:
+            if not self._begin_update():
+                return
+            vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+            for id, vector in zip(ids, vectors):
+                self._kill(id)
+                self._added[id] = vector
+            self._delta = None
+            self._compact_if_needed()
+
+    def remove(self, ids: List[str]):
+        if not ids:
+            return
+        with self._lock:
+            if not self._begin_update():
+                return
+            for id in ids:
+                self._kill(id)
+                self._added.pop(id, None)
+            self._delta = None
+            self._compact_if_needed()
+
+    def _kill(self, id: str):
+        if self._touched is not None:
+            # 重写进行中，新文件替换旧文件后再使其中的这一行失效
+            self._touched.add(id)
+            self._flushing.pop(id, None)
+        row = self._segment.rows.get(id)  # type: ignore
+        if row is not None and self._segment.alive[row]:  # type: ignore
+            self._segment.alive[row] = False  # type: ignore
+            self._removed += 1
+
+    def _compact_if_needed(self):
+        if self._compacting or self._segment is None:
+            return
+        threshold = max(self.compact_threshold, self.compact_ratio * len(self._segment))
+        if len(self._added) + self._removed >= threshold:
+            self._compacting = True
+            threading.Thread(target=self._compact, name="vector-index-compact", daemon=True).start()
+
+    def _compact(self):
+        try:
+            self.flush()
+        except Exception as e:
+            log.exception(f"向量索引 {self.path} 重写失败: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+                # 重写期间累积的增量可能已再次超过阈值
+                self._compact_if_needed()
+
+    def flush(self):
+        """将内存中的增量写入索引文件
+
+        新文件在锁外写入，期间检索与写入照常进行；替换时补上期间的变更。
+        """
+        with self._flush_lock:
+            with self._lock:
+                if self._segment is None or not (self._added or self._removed):
+                    return
+                segment = self._segment
+                alive = segment.alive.copy()
+                added = dict(self._added)
+                removed = self._removed
+                self._flushing = self._added
+                self._added = {}
+                self._removed = 0
+                self._touched = set()
+
+            def batches():
+                rows_alive = np.flatnonzero(alive)
+                for start in range(0, len(rows_alive), _BLOCK_ROWS):
+                    rows = rows_alive[start : start + _BLOCK_ROWS]
+                    yield [segment.ids[row] for row in rows], [segment.vector(row) for row in rows]
+                if added:
+                    yield list(added), list(added.values())
+
+            try:
+                version = self._write_version(batches())
+            except BaseException:
+                with self._lock:
+                    # 未写入的增量放回，下次重写时一并写入
+                    self._added = {**self._flushing, **self._added}
+                    self._removed += removed
+                    self._flushing = {}
+                    self._touched = None
+                    self._delta = None
+                raise
+
+            with self._lock:
+                new_segment = _Segment(self.path / version)
+                touched = self._touched or set()
+                for id in touched:
+                    row = new_segment.rows.get(id)
+                    if row is not None:
+                        # 新文件中的这一行要等下次重写才会删除，计入未保存的变更
+                        new_segment.alive[row] = False
+                        self._removed += 1
+                old = self._read_meta().get("version")
+                self._segment = new_segment
+                self._flushing = {}
+                self._touched = None
+                self._delta = None
+                # 重写期间的变更仍在内存中，索引保持 dirty
+                self._write_meta(version=version, dirty=bool(self._added or self._removed))
+            if old and old != version:
+                shutil.rmtree(self.path / old, ignore_errors=True)
+            log.info(f"向量索引重写完成：{len(new_segment)} 个片段，重写期间变更 {len(touched)} 个")
+
+    def _delta_vectors(self) -> Tuple[List[str], np.ndarray] | None:
+        """内存中的增量（含正在重写的部分）及其向量矩阵，调用方持有锁"""
+        if not (self._added or self._flushing):
+            return None
+        if self._delta is None:
+            delta = {**self._flushing, **self._added}
+            self._delta = (list(delta), np.stack(list(delta.values())))
+        return self._delta
+
+    def search(
+        self, query: List[float], k: int, within: List[str] | None = None
+    ) -> List[Tuple[str, float, np.ndarray]]:
+        """返回最相似的 k 个片段 (片段 ID, 距离, 归一化向量)，按距离升序
+
+        距离为归一化向量的平方欧氏距离 2 - 2cos，与 Chroma 默认的 l2 距离一致。
+        给出 within 时只在这些片段中精确检索（不经过 ivf 聚类），检索范围越小越快。
+        """
+        started = time.perf_counter()
+        with self._lock:
+            segment = self._segment
+            delta = self._delta_vectors()
+        if segment is None or k <= 0:
+            return []
+
+        q = normalize_rows(np.asarray(query, dtype=np.float32))
+        if within is None:
+            rows, scores = segment.search(q, self.nprobe)
+        else:
+            rows = np.sort(
+                np.fromiter(
+                    (segment.rows[id] for id in within if id in segment.rows), dtype=np.int64
+                )
+            )
+            rows = rows[segment.alive[rows]]
+            scores = segment.score_rows(q, rows)
+        # 命中分为索引文件中的行 (分数, ID, 行号, None) 与增量 (分数, ID, None, 增量下标)
+        hits: List[Tuple[float, str, int | None, int | None]] = []
+        if len(rows):
+            top = np.argpartition(-scores, min(k, len(rows)) - 1)[:k]
+            hits.extend((float(scores[i]), segment.ids[rows[i]], int(rows[i]), None) for i in top)
+        if delta is not None:
+            delta_ids, delta_vectors = delta
+            indexes = (
+                np.arange(len(delta_ids))
+                if within is None
+                else np.flatnonzero(np.isin(delta_ids, within))
+            )
+            if len(indexes):
+                delta_scores = delta_vectors[indexes] @ q
+                top = np.argpartition(-delta_scores, min(k, len(indexes)) - 1)[:k]
+                hits.extend(
+                    (float(delta_scores[i]), delta_ids[indexes[i]], None, int(indexes[i]))
+                    for i in top
+                )
+        hits.sort(key=lambda hit: -hit[0])
+
+        results = [
+            (
+                id,
+                max(0.0, 2.0 - 2.0 * score),
+                segment.vector(row) if row is not None else delta[1][index],  # type: ignore
+            )
+            for score, id, row, index in hits[:k]
+        ]
+        with self._lock:
+            self.searches += 1
+            self.search_seconds += time.perf_counter() - started
+        return results
+
+    def disk_bytes(self) -> int:
+        segment = self._segment
+        if segment is None:
+            return 0
+        return sum(file.stat().st_size for file in segment.path.iterdir())
+
+    def stats(self) -> dict:
+        segment = self._segment
+        return {
+            "ready": self.ready,
+            "type": segment.info["type"] if segment else None,
+            "quantization": segment.info["quantization"] if segment else None,
+            "dim": segment.info["dim"] if segment else None,
+            "nlist": segment.info["nlist"] if segment else None,
+            "nprobe": self.nprobe,
+            "count": self.count(),
+            "pending": len(self._added) + len(self._flushing) + self._removed,
+            "compacting": self._touched is not None,
+            "disk_bytes": self.disk_bytes(),
+            "searches": self.searches,
+            "avg_ms": round(self.search_seconds / self.searches * 1000, 3) if self.searches else 0.0,
+        }